@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 
-import ctypes, ctypes.util, logging, os.path, getopt, sys, subprocess, select, time, math, configparser
+import ctypes, ctypes.util, logging, os.path, getopt, sys, subprocess, select, time, math, configparser, json, bisect, socketserver, signal
 from fcntl import ioctl
-from threading import Thread
+from threading import Thread, Condition, Lock, RLock, get_ident
+from collections import namedtuple, deque
+from struct import unpack_from, calcsize
 
 ghurl = 'https://github.com/soyersoyer/cameractrls'
 version = 'v0.6.6'
@@ -16,11 +18,12 @@ v4ldirs = {
 
 
 class Device:
-    def __init__(self, name, path, real_path, driver):
+    def __init__(self, name, path, real_path, driver, usb_ids=''):
         self.name = name
         self.path = path
         self.real_path = real_path
         self.driver = driver
+        self.usb_ids = usb_ids
 
     def _is_valid_operand(self, other):
         return (hasattr(other, "name") and
@@ -39,9 +42,12 @@ class Device:
     def __str__(self):
         return f'"{self.name}" at {self.path}{" -> " + self.real_path if self.real_path != self.path else ""}'
 
-def get_devices(dirs):
+# the devices are described from sysfs and the udev database without opening them,
+# only the nodes unknown to udev are opened, in parallel
+def get_devices(dirs, timeout=2.0):
     devices = []
-    resolved_devices = []
+    resolved_devices = set()
+    unknown = []
     for dir, prefix in dirs.items():
         if not os.path.isdir(dir):
             continue
@@ -49,17 +55,220 @@ def get_devices(dirs):
             if not device.startswith(prefix):
                 continue
             device = dir + device
-            resolved = device if not os.path.islink(device) else os.path.abspath(dir + os.readlink(device))
+            resolved = os.path.realpath(device)
             if resolved in resolved_devices:
                 continue
-            caps = get_device_capability(device)
-            if not(caps.device_caps & V4L2_CAP_VIDEO_CAPTURE):
+            resolved_devices.add(resolved)
+            info = get_device_info_from_sysfs(resolved)
+            if info is None:
+                unknown.append((device, resolved))
                 continue
-            devices.append(Device(f'{str(caps.card, "utf-8")} ({resolved})', device, resolved, str(caps.driver)))
-            resolved_devices.append(resolved)
+            name, capture, driver = info
+            if not capture:
+                continue
+            devices.append(Device(f'{name} ({resolved})', device, resolved, driver, find_usb_ids_in_sysfs(resolved)))
+
+    for device, resolved, caps in probe_device_capabilities(unknown, timeout):
+        if not(caps.device_caps & V4L2_CAP_VIDEO_CAPTURE):
+            continue
+        devices.append(Device(f'{str(caps.card, "utf-8")} ({resolved})', device, resolved, str(caps.driver, 'utf-8'), find_usb_ids_in_sysfs(resolved)))
+
     devices.sort()
     return devices
 
+def read_udev_properties(devnum):
+    props = {}
+    try:
+        with open(f'/run/udev/data/c{devnum}') as f:
+            for line in f:
+                if line.startswith('E:'):
+                    k, _, v = line[2:].rstrip('\n').partition('=')
+                    props[k] = v
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f'read_udev_properties({devnum}) failed: {e}')
+        return None
+    return props
+
+# returns (name, capture, driver) or None when sysfs and udev do not know enough
+def get_device_info_from_sysfs(device):
+    sysdir = f'/sys/class/video4linux/{os.path.basename(device)}'
+    try:
+        with open(f'{sysdir}/name') as f:
+            name = f.read().strip()
+        with open(f'{sysdir}/dev') as f:
+            devnum = f.read().strip()
+    except Exception:
+        return None
+
+    props = read_udev_properties(devnum)
+    if props is None or 'ID_V4L_CAPABILITIES' not in props:
+        return None
+
+    driver = ''
+    driverdir = f'{sysdir}/device/driver'
+    if os.path.exists(driverdir):
+        driver = os.path.basename(os.path.realpath(driverdir))
+
+    return name, ':capture:' in props['ID_V4L_CAPABILITIES'], driver
+
+# QUERYCAP on each device in its own thread, the ones not answering in time are skipped
+def probe_device_capabilities(devices, timeout):
+    results = [None] * len(devices)
+
+    def probe(i, device):
+        results[i] = get_device_capability(device)
+
+    threads = [Thread(target=probe, args=(i, d[0]), daemon=True) for i, d in enumerate(devices)]
+    for t in threads:
+        t.start()
+
+    deadline = time.monotonic() + timeout
+    for (device, resolved), t in zip(devices, threads):
+        t.join(max(0, deadline - time.monotonic()))
+        if t.is_alive():
+            logging.warning(f'probe_device_capabilities: {device} did not answer in {timeout}s')
+
+    return [(d[0], d[1], caps) for d, caps in zip(devices, results) if caps is not None]
+
+libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+inotify_init1 = libc.inotify_init1
+inotify_init1.restype = ctypes.c_int
+inotify_init1.argtypes = [ctypes.c_int]
+# int inotify_init1(int flags);
+
+inotify_add_watch = libc.inotify_add_watch
+inotify_add_watch.restype = ctypes.c_int
+inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+# int inotify_add_watch(int fd, const char *pathname, uint32_t mask);
+
+inotify_rm_watch = libc.inotify_rm_watch
+inotify_rm_watch.restypes = ctypes.c_int
+inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+# int inotify_rm_watch(int fd, int wd);
+
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+IN_ACCESS =	0x00000001 # File was accessed
+IN_MODIFY =	0x00000002 # File was modified
+IN_ATTRIB =	0x00000004 # Metadata changed
+IN_CLOSE_WRITE = 0x00000008 # Writable file was closed
+IN_CLOSE_NOWRITE = 0x00000010 # Unwritable file closed
+IN_OPEN	= 0x00000020 # File was opened
+IN_MOVED_FROM = 0x00000040 # File was moved from X
+IN_MOVED_TO = 0x00000080 # File was moved to Y
+IN_CREATE = 0x00000100 # Subfile was created
+IN_DELETE = 0x00000200 # Subfile was deleted
+IN_DELETE_SELF = 0x00000400 # Self was deleted
+IN_MOVE_SELF = 0x00000800 # Self was moved
+
+IN_ALL_EVENTS = ( \
+    IN_ACCESS | IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | \
+    IN_CLOSE_NOWRITE | IN_OPEN | IN_MOVED_FROM | \
+    IN_MOVED_TO | IN_DELETE | IN_CREATE | IN_DELETE_SELF | \
+    IN_MOVE_SELF \
+)
+
+IN_UNMOUNT = 0x00002000 # Backing fs was unmounted
+IN_Q_OVERFLOW = 0x00004000 # Event queued overflowed
+IN_IGNORED = 0x00008000 # File was ignored
+
+IN_CLOSE = (IN_CLOSE_WRITE | IN_CLOSE_NOWRITE)
+IN_MOVE	= (IN_MOVED_FROM | IN_MOVED_TO)
+
+IN_ONLYDIR = 0x01000000 # only watch the path if it is a directory
+IN_DONT_FOLLOW = 0x02000000 # don't follow a sym link
+IN_EXCL_UNLINK = 0x04000000 # exclude events on unlinked objects
+IN_MASK_CREATE = 0x10000000 # only create watches
+IN_MASK_ADD = 0x20000000 # add to the mask of an already existing watch
+IN_ISDIR = 0x40000000 # event occurred against dir
+IN_ONESHOT = 0x80000000 # only send event once
+
+NAME_MAX = 255
+
+InotifyEvent = namedtuple('InotifyEvent', ['wd', 'mask', 'cookie', 'namesize', 'name'])
+INOTIFY_EVENT_FMT = 'iIII'
+INOTIFY_EVENT_SIZE = calcsize(INOTIFY_EVENT_FMT)
+
+def parse_inotify_events(data):
+    pos = 0
+    events = []
+    while pos < len(data):
+        wd, mask, cookie, namesize = unpack_from(INOTIFY_EVENT_FMT, data, pos)
+        pos += INOTIFY_EVENT_SIZE + namesize
+        name = data[pos - namesize : pos].split(b'\x00', 1)[0]
+        events.append(InotifyEvent(wd, mask, cookie, namesize, name.decode()))
+    return events
+
+# watches /dev and /dev/v4l/by-id for appearing and disappearing cameras,
+# the fd can be polled, read_events tells whether the device list could change
+class DeviceMonitor:
+    def __init__(self, dev_path='/dev', byid_path='/dev/v4l/by-id'):
+        self.dev_path = dev_path
+        self.byid_path = byid_path
+        self.byid_wd = -1
+        self.fd = inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd == -1:
+            logging.warning(f'DeviceMonitor: inotify_init1 failed: {os.strerror(ctypes.get_errno())}')
+            return
+        if inotify_add_watch(self.fd, dev_path.encode(), IN_CREATE | IN_DELETE) == -1:
+            logging.warning(f'DeviceMonitor: inotify_add_watch({dev_path}) failed: {os.strerror(ctypes.get_errno())}')
+        self.watch_byid()
+
+    # by-id comes and goes with the cameras
+    def watch_byid(self):
+        if self.byid_wd != -1 or not os.path.isdir(self.byid_path):
+            return
+        self.byid_wd = inotify_add_watch(self.fd, self.byid_path.encode(), IN_CREATE | IN_DELETE)
+
+    def fileno(self):
+        return self.fd
+
+    def read_events(self):
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * (INOTIFY_EVENT_SIZE + NAME_MAX + 1))
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            for e in parse_inotify_events(data):
+                if e.wd == self.byid_wd:
+                    if e.mask & IN_IGNORED:
+                        self.byid_wd = -1
+                    changed = True
+                elif e.name.startswith('video') or e.name == 'v4l' or e.mask & IN_Q_OVERFLOW:
+                    changed = True
+        self.watch_byid()
+        return changed
+
+    def close(self):
+        if self.fd != -1:
+            os.close(self.fd)
+            self.fd = -1
+
+# returns the removed and the added devices by their real paths
+def diff_devices(old, new):
+    old_paths = {d.real_path for d in old}
+    new_paths = {d.real_path for d in new}
+    return [d for d in old if d.real_path not in new_paths], [d for d in new if d.real_path not in old_paths]
+
+# applies the removals and the additions to the sorted devices list,
+# calls remove_cb(idx) and insert_cb(idx, device) to follow with the models
+def apply_device_diff(devices, removed, added, remove_cb, insert_cb):
+    for d in removed:
+        idx = devices.index(d)
+        devices.pop(idx)
+        remove_cb(idx)
+    for d in added:
+        idx = bisect.bisect(devices, d)
+        devices.insert(idx, d)
+        insert_cb(idx, d)
+
 ptz_hw_executables = [
     f'{sys.path[0]}/cameraptzspnav.py',
     f'{sys.path[0]}/cameraptzgame.py',
@@ -588,10 +797,12 @@ v4l2_ctrl_type = enum
 V4L2_CTRL_FLAG_READ_ONLY = 0x0004
 V4L2_CTRL_FLAG_UPDATE = 0x0008
 V4L2_CTRL_FLAG_INACTIVE = 0x0010
+V4L2_CTRL_FLAG_WRITE_ONLY = 0x0040
 V4L2_CTRL_FLAG_NEXT_CTRL = 0x80000000
 V4L2_CTRL_FLAG_NEXT_COMPOUND = 0x40000000
 
 V4L2_CTRL_CLASS_MASK = 0x00ff0000
+V4L2_CTRL_WHICH_CUR_VAL = 0
 V4L2_CTRL_CLASS_USER = 0x00980000
 V4L2_CTRL_CLASS_CODEC = 0x00990000
 V4L2_CTRL_CLASS_CAMERA = 0x009a0000
@@ -704,6 +915,38 @@ V4L2_CTRL_ZEROERS = [
     V4L2_CID_ZOOM_CONTINUOUS,
 ]
 
+# the auto controls make their manual counterparts inactive
+V4L2_CTRL_DEPENDENTS = {
+    V4L2_CID_EXPOSURE_AUTO: [
+        V4L2_CID_EXPOSURE_ABSOLUTE,
+        V4L2_CID_EXPOSURE,
+        V4L2_CID_EXPOSURE_AUTO_PRIORITY,
+        V4L2_CID_IRIS_ABSOLUTE,
+        V4L2_CID_IRIS_RELATIVE,
+    ],
+    V4L2_CID_AUTOGAIN: [V4L2_CID_GAIN],
+    V4L2_CID_AUTO_WHITE_BALANCE: [
+        V4L2_CID_WHITE_BALANCE_TEMPERATURE,
+        V4L2_CID_RED_BALANCE,
+        V4L2_CID_BLUE_BALANCE,
+        V4L2_CID_DO_WHITE_BALANCE,
+    ],
+    V4L2_CID_AUTO_N_PRESET_WHITE_BALANCE: [
+        V4L2_CID_WHITE_BALANCE_TEMPERATURE,
+        V4L2_CID_RED_BALANCE,
+        V4L2_CID_BLUE_BALANCE,
+    ],
+    V4L2_CID_FOCUS_AUTO: [
+        V4L2_CID_FOCUS_ABSOLUTE,
+        V4L2_CID_FOCUS_RELATIVE,
+        V4L2_CID_AUTO_FOCUS_START,
+        V4L2_CID_AUTO_FOCUS_STOP,
+    ],
+    V4L2_CID_HUE_AUTO: [V4L2_CID_HUE],
+    V4L2_CID_AUTOBRIGHTNESS: [V4L2_CID_BRIGHTNESS],
+    V4L2_CID_ISO_SENSITIVITY_AUTO: [V4L2_CID_ISO_SENSITIVITY],
+}
+
 V4L2_CTRL_INFO = {
     V4L2_CID_BRIGHTNESS: ('V4L2_CID_BRIGHTNESS', 'Picture brightness, or more precisely, the black level.'),
     V4L2_CID_CONTRAST: ('V4L2_CID_CONTRAST', 'Picture contrast or luma gain.'),
@@ -803,6 +1046,32 @@ class v4l2_control(ctypes.Structure):
         ('value', ctypes.c_int32),
     ]
 
+class v4l2_ext_control(ctypes.Structure):
+    class _u(ctypes.Union):
+        _fields_ = [
+            ('value', ctypes.c_int32),
+            ('value64', ctypes.c_int64),
+            ('ptr', ctypes.c_void_p),
+        ]
+    _pack_ = 1
+    _fields_ = [
+        ('id', ctypes.c_uint32),
+        ('size', ctypes.c_uint32),
+        ('reserved2', ctypes.c_uint32 * 1),
+        ('_u', _u),
+    ]
+    _anonymous_ = ('_u',)
+
+class v4l2_ext_controls(ctypes.Structure):
+    _fields_ = [
+        ('which', ctypes.c_uint32),
+        ('count', ctypes.c_uint32),
+        ('error_idx', ctypes.c_uint32),
+        ('request_fd', ctypes.c_int32),
+        ('reserved', ctypes.c_uint32 * 1),
+        ('controls', ctypes.POINTER(v4l2_ext_control)),
+    ]
+
 class v4l2_queryctrl(ctypes.Structure):
     _fields_ = [
         ('id', ctypes.c_uint32),
@@ -907,6 +1176,8 @@ VIDIOC_G_CTRL = _IOWR('V', 27, v4l2_control)
 VIDIOC_S_CTRL = _IOWR('V', 28, v4l2_control)
 VIDIOC_QUERYCTRL = _IOWR('V', 36, v4l2_queryctrl)
 VIDIOC_QUERYMENU = _IOWR('V', 37, v4l2_querymenu)
+VIDIOC_G_EXT_CTRLS = _IOWR('V', 71, v4l2_ext_controls)
+VIDIOC_S_EXT_CTRLS = _IOWR('V', 72, v4l2_ext_controls)
 VIDIOC_DQEVENT = _IOR('V', 89, v4l2_event)
 VIDIOC_SUBSCRIBE_EVENT = _IOW('V', 90, v4l2_event_subscription)
 VIDIOC_UNSUBSCRIBE_EVENT = _IOW('V', 91, v4l2_event_subscription)
@@ -1006,41 +1277,108 @@ def query_xu_control(fd, unit_id, selector, query, data):
         ioctl(fd, UVCIOC_CTRL_QUERY, xu_ctrl_query)
     except Exception as e:
         logging.warning(f'UVCIOC_CTRL_QUERY (0x{query:02x}) - Fd: {fd} - Error: {e}')
+        return False
+    return True
 
-# the usb device descriptors file contains the descriptors in a binary format
-# the byte before the extension guid is the extension unit id
-def find_unit_id_in_sysfs(device, guid):
-    if os.path.islink(device):
-        device = os.readlink(device)
-    device = os.path.basename(device)
-    descfile = f'/sys/class/video4linux/{device}/../../../descriptors'
-    if not os.path.isfile(descfile):
-        return 0
-
-    try:
-        with open(descfile, 'rb') as f:
-            descriptors = f.read()
-            guid_start = descriptors.find(guid)
-            if guid_start > 0:
-                return descriptors[guid_start - 1]
-    except Exception as e:
-        logging.warning(f'Failed to read uvc xu unit id from {descfile}: {e}')
+USB_DT_DEVICE = 0x01
+USB_DT_INTERFACE = 0x04
+USB_DT_CS_INTERFACE = 0x24
+USB_CLASS_VIDEO = 0x0e
+UVC_SC_VIDEOCONTROL = 0x01
+UVC_VC_INPUT_TERMINAL = 0x02
+UVC_VC_PROCESSING_UNIT = 0x05
+UVC_VC_EXTENSION_UNIT = 0x06
+UVC_ITT_CAMERA = 0x0201
 
-    return 0
+UVCUnit = namedtuple('UVCUnit', ['interface', 'id', 'subtype', 'guid', 'controls'])
 
-def find_usb_ids_in_sysfs(device):
+def get_sysfs_device_name(device):
     if os.path.islink(device):
         device = os.readlink(device)
-    device = os.path.basename(device)
-    vendorfile = f'/sys/class/video4linux/{device}/../../../idVendor'
-    productfile = f'/sys/class/video4linux/{device}/../../../idProduct'
-    if not os.path.isfile(vendorfile) or not os.path.isfile(productfile):
-        return ''
+    return os.path.basename(device)
+
+# the usb device descriptors file contains the device and the configuration descriptors
+# in a binary format, it is parsed once per physical device and shared by its video nodes
+class UVCDescriptors:
+    # usb device dir -> (inode of the descriptors file, UVCDescriptors)
+    cache = {}
+
+    def __init__(self, descriptors=b''):
+        self.usb_ids = ''
+        self.bcd_device = ''
+        self.units = []
+        self.parse(descriptors)
+
+    # the sysfs inode changes when the device is reconnected to the same port
+    @classmethod
+    def for_device(cls, device):
+        usbdir = os.path.realpath(f'/sys/class/video4linux/{get_sysfs_device_name(device)}/../../..')
+        descfile = os.path.join(usbdir, 'descriptors')
+        try:
+            ino = os.stat(descfile).st_ino
+        except OSError:
+            return cls()
 
-    vendor = read_usb_id_from_file(vendorfile)
-    product = read_usb_id_from_file(productfile)
+        cached = cls.cache.get(usbdir)
+        if cached is not None and cached[0] == ino:
+            return cached[1]
 
-    return vendor + ':' + product
+        try:
+            with open(descfile, 'rb') as f:
+                descs = cls(f.read())
+        except Exception as e:
+            logging.warning(f'Failed to read the usb descriptors from {descfile}: {e}')
+            return cls()
+        cls.cache[usbdir] = (ino, descs)
+        return descs
+
+    def parse(self, descriptors):
+        interface = None
+        video_control = False
+        pos = 0
+        while pos + 2 <= len(descriptors):
+            length, desc_type = descriptors[pos], descriptors[pos + 1]
+            if length < 2 or pos + length > len(descriptors):
+                logging.warning(f'UVCDescriptors: invalid descriptor length {length} at {pos}')
+                break
+            desc = descriptors[pos:pos + length]
+            if desc_type == USB_DT_DEVICE and length >= 14:
+                vendor, product, bcd_device = unpack_from('<HHH', desc, 8)
+                self.usb_ids = f'{vendor:04x}:{product:04x}'
+                self.bcd_device = f'{bcd_device:04x}'
+            elif desc_type == USB_DT_INTERFACE and length >= 7:
+                interface = desc[2]
+                video_control = desc[5] == USB_CLASS_VIDEO and desc[6] == UVC_SC_VIDEOCONTROL
+            elif desc_type == USB_DT_CS_INTERFACE and video_control and length >= 4:
+                self.parse_vc_desc(interface, desc)
+            pos += length
+
+    # only the guid field of the extension units is matched, not any bytes of the blob
+    def parse_vc_desc(self, interface, desc):
+        subtype = desc[2]
+        guid = None
+        if subtype == UVC_VC_EXTENSION_UNIT and len(desc) >= 24:
+            guid = desc[4:20]
+            size_pos = 22 + desc[21]
+        elif subtype == UVC_VC_PROCESSING_UNIT and len(desc) >= 8:
+            size_pos = 7
+        elif subtype == UVC_VC_INPUT_TERMINAL and len(desc) >= 15 and unpack_from('<H', desc, 4)[0] == UVC_ITT_CAMERA:
+            size_pos = 14
+        else:
+            return
+        if size_pos >= len(desc):
+            return
+        controls = desc[size_pos + 1:size_pos + 1 + desc[size_pos]]
+        self.units.append(UVCUnit(interface, desc[3], subtype, guid, int.from_bytes(controls, 'little')))
+
+    def find_unit_id(self, guid):
+        for u in self.units:
+            if u.guid == guid:
+                return u.id
+        return 0
+
+def find_usb_ids_in_sysfs(device):
+    return UVCDescriptors.for_device(device).usb_ids
 
 def read_usb_id_from_file(file):
     id = ''
@@ -1153,6 +1491,19 @@ class BaseCtrl:
         self.step_big = step_big
         self.unrestorable = unrestorable
 
+# copies the re-queried state into the existing ctrl, so its widgets stay attached, returns True if it changed
+def update_ctrl_from(ctrl, new):
+    changed = False
+    for attr in ['value', 'default', 'min', 'max', 'step', 'step_big', 'inactive', 'readonly']:
+        if getattr(ctrl, attr) != getattr(new, attr):
+            setattr(ctrl, attr, getattr(new, attr))
+            changed = True
+    if ctrl.menu is not None and new.menu is not None and \
+        [m.text_id for m in ctrl.menu] != [m.text_id for m in new.menu]:
+        ctrl.menu = new.menu
+        changed = True
+    return changed
+
 class BaseCtrlMenu:
     def __init__(self, text_id, name, value, gui_hidden=False, lp_text_id=None):
         self.text_id = text_id
@@ -1171,11 +1522,14 @@ class KiyoMenu(BaseCtrlMenu):
         self._before = before
 
 class KiyoProCtrls:
+    provides = ['kiyo_pro_af_mode', 'kiyo_pro_hdr', 'kiyo_pro_hdr_mode', 'kiyo_pro_fov', 'kiyo_pro_save']
+
     def __init__(self, device, fd):
         self.device = device
         self.fd = fd
-        self.unit_id = find_unit_id_in_sysfs(device, UVC_EU1_GUID)
-        self.usb_ids = find_usb_ids_in_sysfs(device)
+        descs = UVCDescriptors.for_device(device)
+        self.unit_id = descs.find_unit_id(UVC_EU1_GUID)
+        self.usb_ids = descs.usb_ids
         self.get_device_controls()
 
     def supported(self):
@@ -1390,10 +1744,18 @@ class LogitechCtrl(BaseCtrl):
         self._offset = offset
 
 class LogitechCtrls:
-    def __init__(self, device, fd):
+    provides = [
+        'logitech_led1_mode', 'logitech_led1_frequency',
+        'logitech_pan_relative', 'logitech_tilt_relative', 'logitech_pantilt_reset', 'logitech_pantilt_preset',
+        'logitech_motor_focus', 'logitech_brio_fov',
+    ]
+
+    def __init__(self, device, fd, cache=None):
         self.device = device
         self.fd = fd
-        self.usb_ids = find_usb_ids_in_sysfs(device)
+        self.cache = cache or CapabilityCache()
+        self.descs = UVCDescriptors.for_device(device)
+        self.usb_ids = self.descs.usb_ids
         self.ctrls = []
 
         self.get_device_controls()
@@ -1402,9 +1764,9 @@ class LogitechCtrls:
         return len(self.ctrls) != 0
 
     def get_device_controls(self):
-        peripheral_unit_id = find_unit_id_in_sysfs(self.device, LOGITECH_PERIPHERAL_GUID)
+        peripheral_unit_id = self.descs.find_unit_id(LOGITECH_PERIPHERAL_GUID)
         if peripheral_unit_id != 0:
-            if try_xu_control(self.fd, peripheral_unit_id, LOGITECH_PERIPHERAL_LED1_SEL):
+            if self.try_xu_control(peripheral_unit_id, LOGITECH_PERIPHERAL_LED1_SEL):
                 self.ctrls.extend([
                     LogitechCtrl(
                         'logitech_led1_mode',
@@ -1433,7 +1795,7 @@ class LogitechCtrls:
                         LOGITECH_PERIPHERAL_LED1_FREQUENCY_OFFSET,
                     ),
                 ])
-            if try_xu_control(self.fd, peripheral_unit_id, LOGITECH_PERIPHERAL_PANTILT_REL_SEL):
+            if self.try_xu_control(peripheral_unit_id, LOGITECH_PERIPHERAL_PANTILT_REL_SEL):
                 self.ctrls.extend([
                     LogitechCtrl(
                         'logitech_pan_relative',
@@ -1468,7 +1830,7 @@ class LogitechCtrls:
                         ],
                     ),
                 ])
-            if try_xu_control(self.fd, peripheral_unit_id, LOGITECH_PERIPHERAL_PANTILT_RESET_SEL):
+            if self.try_xu_control(peripheral_unit_id, LOGITECH_PERIPHERAL_PANTILT_RESET_SEL):
                 self.ctrls.extend([
                     LogitechCtrl(
                         'logitech_pantilt_reset',
@@ -1486,7 +1848,7 @@ class LogitechCtrls:
                         ],
                     ),
                 ])
-            if try_xu_control(self.fd, peripheral_unit_id, LOGITECH_PERIPHERAL_PANTILT_PRESET_SEL)\
+            if self.try_xu_control(peripheral_unit_id, LOGITECH_PERIPHERAL_PANTILT_PRESET_SEL)\
                 and self.usb_ids in LOGITECH_PRESET_DEV_MATCH:
                 self.ctrls.extend([
                     LogitechCtrl(
@@ -1520,7 +1882,7 @@ class LogitechCtrls:
                     ),
                 ])
 
-        user_hw_unit_id = find_unit_id_in_sysfs(self.device, LOGITECH_USER_HW_CONTROL_V1_GUID)
+        user_hw_unit_id = self.descs.find_unit_id(LOGITECH_USER_HW_CONTROL_V1_GUID)
         if user_hw_unit_id != 0:
             self.ctrls.extend([
                 LogitechCtrl(
@@ -1551,7 +1913,7 @@ class LogitechCtrls:
                 ),
             ])
 
-        motor_control_unit_id = find_unit_id_in_sysfs(self.device, LOGITECH_MOTOR_CONTROL_V1_GUID)
+        motor_control_unit_id = self.descs.find_unit_id(LOGITECH_MOTOR_CONTROL_V1_GUID)
         if motor_control_unit_id != 0 and self.usb_ids in LOGITECH_MOTOR_CONTROL_FOCUS_DEV_MATCH:
             self.ctrls.extend([
                 LogitechCtrl(
@@ -1566,7 +1928,7 @@ class LogitechCtrls:
                 ),
             ])
 
-        brio_unit_id = find_unit_id_in_sysfs(self.device, LOGITECH_BRIO_GUID)
+        brio_unit_id = self.descs.find_unit_id(LOGITECH_BRIO_GUID)
         if brio_unit_id != 0 and self.usb_ids in LOGITECH_BRIO_FOV_DEV_MATCH:
             self.ctrls.extend([
                 LogitechCtrl(
@@ -1587,13 +1949,8 @@ class LogitechCtrls:
             ])
 
         for c in self.ctrls:
-            minimum_config = to_buf(bytes(c._len))
-            query_xu_control(self.fd, c._unit_id, c._selector, UVC_GET_MIN, minimum_config)
-            c.min = minimum_config[c._offset][0]
-
-            maximum_config = to_buf(bytes(c._len))
-            query_xu_control(self.fd, c._unit_id, c._selector, UVC_GET_MAX, maximum_config)
-            c.max = maximum_config[c._offset][0]
+            c.min, c.max = self.cache.memo('logitech_ranges', f'{c._unit_id}_{c._selector}_{c._offset}',
+                lambda c=c: self.query_range(c)) or [0, 0]
 
             if c.type == 'button':
                 continue
@@ -1608,6 +1965,19 @@ class LogitechCtrls:
                     c.value = valmenu.text_id
 
 
+    def try_xu_control(self, unit_id, selector):
+        return self.cache.memo('logitech_xu', f'{unit_id}_{selector}',
+            lambda: try_xu_control(self.fd, unit_id, selector))
+
+    def query_range(self, c):
+        minimum_config = to_buf(bytes(c._len))
+        maximum_config = to_buf(bytes(c._len))
+        if not query_xu_control(self.fd, c._unit_id, c._selector, UVC_GET_MIN, minimum_config) or \
+            not query_xu_control(self.fd, c._unit_id, c._selector, UVC_GET_MAX, maximum_config):
+            return None
+
+        return [minimum_config[c._offset][0], maximum_config[c._offset][0]]
+
     def setup_ctrls(self, params, errs):
         if not self.supported():
             return
@@ -1659,6 +2029,8 @@ class V4L2Ctrl(BaseCtrl):
     def __init__(self, v4l2_id, text_id, name, type, value, default = None, min = None, max = None, step = None, menu = None):
         super().__init__(text_id, name, type, value, default, min, max, step, menu=menu)
         self.v4l2_id = v4l2_id
+        self.writeonly = False
+        self.update = False
         self.last_set = 0
         self.repeat = None
 
@@ -1673,55 +2045,130 @@ class V4L2Ctrls:
     strtrans = bytes.maketrans(b' -', b'__')
 
 
-    def __init__(self, device, fd):
+    def __init__(self, device, fd, cache=None):
         self.device = device
         self.fd = fd
+        self.cache = cache or CapabilityCache()
         self.get_device_controls()
 
 
     def setup_ctrls(self, params, errs):
+        groups = {}
         for k, v in params.items():
-            ctrl = find_by_text_id(self.ctrls, k)
+            ctrl = self.find_by_text_id(k)
             if ctrl is None:
                 continue
-            intvalue = 0
             if v == 'default':
                 v = ctrl.default
-            if ctrl.type == 'integer':
-                if str(v).endswith('%'):
-                    percent = float(str(v)[:-1])/100
-                    # use default value as 50%
-                    intvalue = round(ctrl.min+(ctrl.default-ctrl.min)*percent*2)
-                    intvalue = min(ctrl.max, intvalue)
-                    intvalue = max(ctrl.min, intvalue)
-                else:
-                    intvalue = int(v)
-            elif ctrl.type == 'boolean':
-                intvalue = int(to_bool(v))
-            elif ctrl.type == 'menu':
-                menu = find_by_text_id(ctrl.menu, v)
-                if menu is None:
-                    collect_warning(f'V4L2Ctrls: Can\'t find {v} in {[c.text_id for c in ctrl.menu]}', errs)
-                    continue
-                intvalue = menu.value
-            elif ctrl.type == 'button':
-                intvalue = 0
-            else:
-                collect_warning(f'V4L2Ctrls: Can\'t set {k} to {v} (Unsupported control type {ctrl.type})', errs)
+            intvalue = self.to_int_value(ctrl, k, v, errs)
+            if intvalue is None:
                 continue
-            try:
-                new_ctrl = v4l2_control(ctrl.v4l2_id, intvalue)
-                ioctl(self.fd, VIDIOC_S_CTRL, new_ctrl)
-                if new_ctrl.value != intvalue:
-                    collect_warning(f'V4L2Ctrls: Can\'t set {k} to {v} using {new_ctrl.value}', errs)
-                    continue
+            # S_EXT_CTRLS accepts controls only from the same class
+            groups.setdefault(ctrl.v4l2_id & V4L2_CTRL_CLASS_MASK, []).append((ctrl, k, v, intvalue))
 
-                if ctrl.type == 'menu':
-                    ctrl.value = v
-                else:
-                    ctrl.value = intvalue
-            except Exception as e:
+        applied = []
+        for ctrl_class, group in groups.items():
+            applied += self.set_ext_ctrls(ctrl_class, group, errs)
+
+        for (ctrl, k, v, intvalue) in applied:
+            if ctrl.type == 'menu':
+                ctrl.value = v
+            else:
+                ctrl.value = intvalue
+
+        self.read_back([ctrl for (ctrl, k, v, intvalue) in applied])
+        # the keys which are not set
+        applied_keys = {k for (ctrl, k, v, intvalue) in applied}
+        return [k for k in params if k not in applied_keys]
+
+    def to_int_value(self, ctrl, k, v, errs):
+        if ctrl.type == 'integer':
+            if str(v).endswith('%'):
+                percent = float(str(v)[:-1])/100
+                # use default value as 50%
+                intvalue = round(ctrl.min+(ctrl.default-ctrl.min)*percent*2)
+                intvalue = min(ctrl.max, intvalue)
+                return max(ctrl.min, intvalue)
+            try:
+                return int(v)
+            except ValueError as e:
                 collect_warning(f'V4L2Ctrls: Can\'t set {k} to {v} ({e})', errs)
+                return None
+        elif ctrl.type == 'boolean':
+            return int(to_bool(v))
+        elif ctrl.type == 'menu':
+            menu = find_by_text_id(ctrl.menu, v)
+            if menu is None:
+                collect_warning(f'V4L2Ctrls: Can\'t find {v} in {[c.text_id for c in ctrl.menu]}', errs)
+                return None
+            return menu.value
+        elif ctrl.type == 'button':
+            return 0
+        collect_warning(f'V4L2Ctrls: Can\'t set {k} to {v} (Unsupported control type {ctrl.type})', errs)
+        return None
+
+    def set_ext_ctrls(self, ctrl_class, group, errs):
+        ext_ctrls = (v4l2_ext_control * len(group))()
+        for i, (ctrl, k, v, intvalue) in enumerate(group):
+            ext_ctrls[i].id = ctrl.v4l2_id
+            ext_ctrls[i].value = intvalue
+
+        ctrls = v4l2_ext_controls(ctrl_class, len(group))
+        ctrls.controls = ext_ctrls
+        try:
+            ioctl(self.fd, VIDIOC_S_EXT_CTRLS, ctrls)
+        except Exception as e:
+            # the drivers differ in what they apply before the error,
+            # the controls are set one by one to get the real errors
+            logging.debug(f'V4L2Ctrls: VIDIOC_S_EXT_CTRLS failed at {ctrls.error_idx}: {e}, falling back to VIDIOC_S_CTRL')
+            return [p for p in group if self.set_ctrl(p, errs)]
+
+        return self.check_set_values(group, ext_ctrls, errs)
+
+    def check_set_values(self, group, ext_ctrls, errs):
+        applied = []
+        for i, p in enumerate(group):
+            (ctrl, k, v, intvalue) = p
+            if ext_ctrls[i].value != intvalue:
+                collect_warning(f'V4L2Ctrls: Can\'t set {k} to {v} using {ext_ctrls[i].value}', errs)
+                continue
+            applied.append(p)
+        return applied
+
+    def set_ctrl(self, p, errs):
+        (ctrl, k, v, intvalue) = p
+        try:
+            new_ctrl = v4l2_control(ctrl.v4l2_id, intvalue)
+            ioctl(self.fd, VIDIOC_S_CTRL, new_ctrl)
+            if new_ctrl.value != intvalue:
+                collect_warning(f'V4L2Ctrls: Can\'t set {k} to {v} using {new_ctrl.value}', errs)
+                return False
+        except Exception as e:
+            collect_warning(f'V4L2Ctrls: Can\'t set {k} to {v} ({e})', errs)
+            return False
+        return True
+
+    # refresh the values of the just set controls with one ioctl
+    def read_back(self, ctrls):
+        ctrls = [c for c in ctrls if c.type != 'button' and not c.writeonly]
+        if not ctrls:
+            return
+
+        ext_ctrls = (v4l2_ext_control * len(ctrls))()
+        for i, ctrl in enumerate(ctrls):
+            ext_ctrls[i].id = ctrl.v4l2_id
+
+        ext = v4l2_ext_controls(V4L2_CTRL_WHICH_CUR_VAL, len(ctrls))
+        ext.controls = ext_ctrls
+        try:
+            ioctl(self.fd, VIDIOC_G_EXT_CTRLS, ext)
+        except Exception as e:
+            logging.debug(f'V4L2Ctrls: VIDIOC_G_EXT_CTRLS failed: {e}')
+            return
+
+        errs = []
+        for i, ctrl in enumerate(ctrls):
+            self.set_ctrl_int_value(ctrl, ext_ctrls[i].value, errs)
 
     def set_ctrl_int_value(self, ctrl, intvalue, errs):
         if ctrl.type != 'menu':
@@ -1734,7 +2181,38 @@ class V4L2Ctrls:
             ctrl.value = menu.text_id
 
     def get_device_controls(self):
-        ctrls = []
+        # the ids are validated by the walk, the cache saves the menu queries
+        qctrls = self.query_ctrls()
+        descs = self.cache.get('v4l2_ctrls')
+        if descs is not None and [d['id'] for d in descs] != [q.id for q in qctrls]:
+            logging.info('V4L2Ctrls: the controls changed, dropping the cached ones')
+            descs = None
+        if descs is None:
+            descs = [self.to_ctrl_desc(q) for q in qctrls]
+            if descs:
+                self.cache.put('v4l2_ctrls', [{k: v for k, v in d.items() if k != 'flags'} for d in descs])
+        else:
+            # the flags and the ranges follow the device state
+            descs = [self.update_ctrl_desc(d, q) for d, q in zip(descs, qctrls)]
+
+        values = self.get_ctrl_values([d for d in descs if d['type'] != V4L2_CTRL_TYPE_BUTTON and not d['flags'] & V4L2_CTRL_FLAG_WRITE_ONLY])
+        self.ctrls = [self.to_ctrl(d, values.get(d['id'], 0)) for d in descs]
+        self.index_ctrls()
+
+    # re-queries the ranges, flags and values into the same ctrls,
+    # returns the changed ones or None if the controls themselves changed
+    def refresh(self):
+        ctrls = self.ctrls
+        self.get_device_controls()
+        if [c.v4l2_id for c in self.ctrls] != [c.v4l2_id for c in ctrls]:
+            return None
+        new_ctrls = self.ctrls
+        self.ctrls = ctrls
+        self.index_ctrls()
+        return [c for c, n in zip(ctrls, new_ctrls) if update_ctrl_from(c, n)]
+
+    def query_ctrls(self):
+        qctrls = []
         next_flag = V4L2_CTRL_FLAG_NEXT_CTRL | V4L2_CTRL_FLAG_NEXT_COMPOUND
         qctrl = v4l2_queryctrl(next_flag)
         while True:
@@ -1744,82 +2222,133 @@ class V4L2Ctrls:
                 break
             if qctrl.type in [V4L2_CTRL_TYPE_INTEGER, V4L2_CTRL_TYPE_BOOLEAN,
                 V4L2_CTRL_TYPE_MENU, V4L2_CTRL_TYPE_INTEGER_MENU, V4L2_CTRL_TYPE_BUTTON]:
-
-                text_id = self.to_text_id(qctrl.name)
-                text = str(qctrl.name, 'utf-8')
-                ctrl_type = V4L2Ctrls.to_type.get(qctrl.type)
-                if ctrl_type == 'integer' and qctrl.minimum == 0 and qctrl.maximum == 1 and qctrl.step == 1:
-                    ctrl_type = 'boolean'
-
-                if ctrl_type != 'button':
-                    try:
-                        ctrl = v4l2_control(qctrl.id)
-                        ioctl(self.fd, VIDIOC_G_CTRL, ctrl)
-                    except:
-                        logging.warning(f'V4L2Ctrls: Can\'t get ctrl {qctrl.name} value')
-
-                    v4l2ctrl = V4L2Ctrl(qctrl.id, text_id, text, ctrl_type, int(ctrl.value),
-                        qctrl.default, qctrl.minimum, qctrl.maximum, qctrl.step)
-                else:
-                    v4l2ctrl = V4L2Ctrl(qctrl.id, text_id, text, ctrl_type, None, menu = [ BaseCtrlMenu(text_id, text, text_id) ])
-
-                v4l2ctrl.inactive = bool(qctrl.flags & V4L2_CTRL_FLAG_INACTIVE)
-                v4l2ctrl.readonly = bool(qctrl.flags & V4L2_CTRL_FLAG_READ_ONLY)
-                ctrl_info = V4L2_CTRL_INFO.get(qctrl.id)
-                if ctrl_info is not None:
-                    v4l2ctrl.kernel_id = ctrl_info[0]
-                    v4l2ctrl.tooltip = ctrl_info[1]
-
-                if qctrl.id in V4L2_CTRL_ZEROERS:
-                    v4l2ctrl.zeroer = True
-                    v4l2ctrl.default = 0
-                
-                if v4l2ctrl.step:
-                    v4l2ctrl.step_big = v4l2ctrl.step * 20
-
-                if qctrl.id == V4L2_CID_WHITE_BALANCE_TEMPERATURE:
-                    v4l2ctrl.scale_class = 'white-balance-temperature'
-                    v4l2ctrl.format_value = lambda s,v: f'{v:.0f} K'
-
-                if qctrl.id == V4L2_CID_EXPOSURE_ABSOLUTE:
-                    v4l2ctrl.scale_class = 'dark-to-light'
-                    v4l2ctrl.format_value = lambda s,v: f'{v:.0f}00 µs'
-
-                if qctrl.id in [V4L2_CID_GAIN, V4L2_CID_ANALOGUE_GAIN, V4L2_CID_DIGITAL_GAIN]:
-                    v4l2ctrl.scale_class = 'dark-to-light'
-
-                if qctrl.type in [V4L2_CTRL_TYPE_MENU, V4L2_CTRL_TYPE_INTEGER_MENU]:
-                    v4l2ctrl.menu = []
-                    for i in range(qctrl.minimum, qctrl.maximum + 1):
-                        try:
-                            qmenu = v4l2_querymenu(qctrl.id, i)
-                            ioctl(self.fd, VIDIOC_QUERYMENU, qmenu)
-                        except:
-                            continue
-                        if qctrl.type == V4L2_CTRL_TYPE_MENU:
-                            menu_text = str(qmenu.name, 'utf-8')
-                            menu_text_id = self.to_text_id(qmenu.name)
-                        else:
-                            menu_text_id = str(qmenu.value)
-                            menu_text = menu_text_id
-                        v4l2menu = BaseCtrlMenu(menu_text_id, menu_text, int(qmenu.index))
-                        v4l2ctrl.menu.append(v4l2menu)
-                        if v4l2ctrl.value == qmenu.index:
-                            v4l2ctrl.value = menu_text_id
-                        if v4l2ctrl.default == qmenu.index:
-                            v4l2ctrl.default = menu_text_id
-
-                    # when there is no menu item for the value
-                    # it should be None
-                    if isinstance(v4l2ctrl.value, int):
-                        v4l2ctrl.value = None
-                    if isinstance(v4l2ctrl.default, int):
-                        v4l2ctrl.default = None
-
-                ctrls.append(v4l2ctrl)
+                qctrls.append(qctrl)
             qctrl = v4l2_queryctrl(qctrl.id | next_flag)
-
-        self.ctrls = ctrls
+        return qctrls
+
+    def update_ctrl_desc(self, desc, qctrl):
+        if qctrl.minimum != desc['min'] or qctrl.maximum != desc['max']:
+            return self.to_ctrl_desc(qctrl)
+        return {**desc, 'step': qctrl.step, 'default': qctrl.default, 'flags': qctrl.flags}
+
+    def to_ctrl_desc(self, qctrl):
+        desc = {
+            'id': qctrl.id,
+            'type': qctrl.type,
+            'name': str(qctrl.name, 'utf-8'),
+            'min': qctrl.minimum,
+            'max': qctrl.maximum,
+            'step': qctrl.step,
+            'default': qctrl.default,
+            'flags': qctrl.flags,
+        }
+        if qctrl.type in [V4L2_CTRL_TYPE_MENU, V4L2_CTRL_TYPE_INTEGER_MENU]:
+            desc['menu'] = []
+            for i in range(qctrl.minimum, qctrl.maximum + 1):
+                try:
+                    qmenu = v4l2_querymenu(qctrl.id, i)
+                    ioctl(self.fd, VIDIOC_QUERYMENU, qmenu)
+                except:
+                    continue
+                if qctrl.type == V4L2_CTRL_TYPE_MENU:
+                    desc['menu'].append([int(qmenu.index), str(qmenu.name, 'utf-8')])
+                else:
+                    desc['menu'].append([int(qmenu.index), int(qmenu.value)])
+        return desc
+
+    def get_ctrl_values(self, descs):
+        values = {}
+        groups = {}
+        for d in descs:
+            groups.setdefault(d['id'] & V4L2_CTRL_CLASS_MASK, []).append(d)
+
+        for ctrl_class, group in groups.items():
+            ext_ctrls = (v4l2_ext_control * len(group))()
+            for i, d in enumerate(group):
+                ext_ctrls[i].id = d['id']
+            ext = v4l2_ext_controls(ctrl_class, len(group))
+            ext.controls = ext_ctrls
+            try:
+                ioctl(self.fd, VIDIOC_G_EXT_CTRLS, ext)
+                for i, d in enumerate(group):
+                    values[d['id']] = int(ext_ctrls[i].value)
+                continue
+            except Exception as e:
+                logging.debug(f'V4L2Ctrls: VIDIOC_G_EXT_CTRLS failed: {e}, falling back to VIDIOC_G_CTRL')
+
+            for d in group:
+                try:
+                    ctrl = v4l2_control(d['id'])
+                    ioctl(self.fd, VIDIOC_G_CTRL, ctrl)
+                    values[d['id']] = int(ctrl.value)
+                except:
+                    logging.warning(f'V4L2Ctrls: Can\'t get ctrl {d["name"]} value')
+        return values
+
+    def to_ctrl(self, d, value):
+        text_id = self.to_text_id(d['name'].encode())
+        text = d['name']
+        ctrl_type = V4L2Ctrls.to_type.get(d['type'])
+        if ctrl_type == 'integer' and d['min'] == 0 and d['max'] == 1 and d['step'] == 1:
+            ctrl_type = 'boolean'
+
+        if ctrl_type != 'button':
+            v4l2ctrl = V4L2Ctrl(d['id'], text_id, text, ctrl_type, value,
+                d['default'], d['min'], d['max'], d['step'])
+        else:
+            v4l2ctrl = V4L2Ctrl(d['id'], text_id, text, ctrl_type, None, menu = [ BaseCtrlMenu(text_id, text, text_id) ])
+
+        v4l2ctrl.inactive = bool(d['flags'] & V4L2_CTRL_FLAG_INACTIVE)
+        v4l2ctrl.readonly = bool(d['flags'] & V4L2_CTRL_FLAG_READ_ONLY)
+        v4l2ctrl.writeonly = bool(d['flags'] & V4L2_CTRL_FLAG_WRITE_ONLY)
+        v4l2ctrl.update = bool(d['flags'] & V4L2_CTRL_FLAG_UPDATE)
+        ctrl_info = V4L2_CTRL_INFO.get(d['id'])
+        if ctrl_info is not None:
+            v4l2ctrl.kernel_id = ctrl_info[0]
+            v4l2ctrl.tooltip = ctrl_info[1]
+
+        if d['id'] in V4L2_CTRL_ZEROERS:
+            v4l2ctrl.zeroer = True
+            v4l2ctrl.default = 0
+
+        if v4l2ctrl.step:
+            v4l2ctrl.step_big = v4l2ctrl.step * 20
+
+        if d['id'] == V4L2_CID_WHITE_BALANCE_TEMPERATURE:
+            v4l2ctrl.scale_class = 'white-balance-temperature'
+            v4l2ctrl.format_value = lambda s,v: f'{v:.0f} K'
+
+        if d['id'] == V4L2_CID_EXPOSURE_ABSOLUTE:
+            v4l2ctrl.scale_class = 'dark-to-light'
+            v4l2ctrl.format_value = lambda s,v: f'{v:.0f}00 µs'
+
+        if d['id'] in [V4L2_CID_GAIN, V4L2_CID_ANALOGUE_GAIN, V4L2_CID_DIGITAL_GAIN]:
+            v4l2ctrl.scale_class = 'dark-to-light'
+
+        if d['type'] in [V4L2_CTRL_TYPE_MENU, V4L2_CTRL_TYPE_INTEGER_MENU]:
+            v4l2ctrl.menu = []
+            for index, item in d['menu']:
+                if d['type'] == V4L2_CTRL_TYPE_MENU:
+                    menu_text = item
+                    menu_text_id = self.to_text_id(item.encode())
+                else:
+                    menu_text_id = str(item)
+                    menu_text = menu_text_id
+                v4l2menu = BaseCtrlMenu(menu_text_id, menu_text, index)
+                v4l2ctrl.menu.append(v4l2menu)
+                if v4l2ctrl.value == index:
+                    v4l2ctrl.value = menu_text_id
+                if v4l2ctrl.default == index:
+                    v4l2ctrl.default = menu_text_id
+
+            # when there is no menu item for the value
+            # it should be None
+            if isinstance(v4l2ctrl.value, int):
+                v4l2ctrl.value = None
+            if isinstance(v4l2ctrl.default, int):
+                v4l2ctrl.default = None
+
+        return v4l2ctrl
 
     def get_ctrls(self):
         return self.ctrls
@@ -1827,25 +2356,57 @@ class V4L2Ctrls:
     def to_text_id(self, text):
         return str(text.lower().translate(V4L2Ctrls.strtrans, delete = b',&(.)/').replace(b'__', b'_'), 'utf-8')
 
+    # the same lookups as CtrlRegistry, the first ctrl of a text_id wins
+    def index_ctrls(self):
+        self.v4l2_ids = {c.v4l2_id: c for c in self.ctrls}
+        self.text_ids = {}
+        for c in self.ctrls:
+            self.text_ids.setdefault(c.text_id, c)
+
     def find_by_v4l2_id(self, v4l2_id):
-        idx = find_idx(self.ctrls, lambda c: hasattr(c, 'v4l2_id') and c.v4l2_id == v4l2_id)
-        if idx is not None:
-            return self.ctrls[idx]
-        else:
-            None
+        return self.v4l2_ids.get(v4l2_id)
+
+    def find_by_text_id(self, text_id):
+        return self.text_ids.get(text_id)
+
+    # the drivers flag the master controls with V4L2_CTRL_FLAG_UPDATE, without a known
+    # relationship all the others can change with them
+    def get_dependents(self):
+        deps = {}
+        for c in self.ctrls:
+            ids = V4L2_CTRL_DEPENDENTS.get(c.v4l2_id)
+            if ids is not None:
+                deps[c] = [d for d in map(self.find_by_v4l2_id, ids) if d is not None]
+            elif c.update:
+                deps[c] = [d for d in self.ctrls if d is not c]
+        return deps
 
 
 class V4L2Listener(Thread):
-    def __init__(self, ctrls, fmt_ctrls, cb, err_cb):
-        super().__init__()
+    # the old implementation queried G_FMT and G_PARM after every 1 s epoll timeout
+    polled_ioctls_per_sec = 2
+
+    def __init__(self, ctrls, fmt_ctrls, cb, err_cb, fmt_check_interval=5.0):
+        # daemon, so an exiting tool isn't held by it, the thread ends when the device is gone
+        super().__init__(daemon=True)
         self.fd = ctrls.fd
         self.ctrls = ctrls
         self.fmt_ctrls = fmt_ctrls
         self.cb = cb
         self.err_cb = err_cb
-        self.epoll = select.epoll() 
+        # the format changes of other processes have no event, they are found by the slow check,
+        # None or 0 disables it, the format is queried only after notify_fmt_change then
+        self.fmt_check_interval = fmt_check_interval
+        self.fmt_ioctls = 0
+        self.events = 0
+        self.batches = 0
+        self.started_at = time.monotonic()
+        self.stopped = False
+        self.wakeup_fd = os.eventfd(0, os.EFD_CLOEXEC | os.EFD_NONBLOCK)
+        self.epoll = select.epoll()
         self.epoll.register(self.fd, select.POLLPRI | select.POLLERR | select.POLLNVAL)
-    
+        self.epoll.register(self.wakeup_fd, select.POLLIN)
+
         sub = v4l2_event_subscription()
         sub.type = V4L2_EVENT_CTRL
         sub.flags = V4L2_EVENT_SUB_FL_ALLOW_FEEDBACK
@@ -1858,6 +2419,8 @@ class V4L2Listener(Thread):
                 self.epoll.close()
                 break
 
+        self.fmt_ctrls.listeners.append(self)
+
     def update_ctrl(self, ctrl, value, updates):
         if ctrl is not None and ctrl.value != value:
             ctrl.value = value
@@ -1871,44 +2434,111 @@ class V4L2Listener(Thread):
             self.update_ctrl(self.fmt_ctrls.res_ctrl, wh2str(fmt.fmt.pix), updates)
 
         self.update_ctrl(self.fmt_ctrls.fps_ctrl, self.fmt_ctrls.get_fps(), updates)
+        self.fmt_ioctls += 2
 
         # these are reopener controls, use only the first to avoid multiple reopenings
         if len(updates):
             ctrl = updates[0]
             logging.info(f'V4L2Listener: {ctrl.text_id}={ctrl.value}')
-            self.cb(ctrl)
+            self.cb([ctrl])
+
+    # an upper estimate, the old implementation skipped the query when an event came within the second
+    def saved_ioctls(self):
+        elapsed = time.monotonic() - self.started_at
+        return max(0, round(elapsed * V4L2Listener.polled_ioctls_per_sec) - self.fmt_ioctls)
+
+    # called by V4L2FmtCtrls after setting a reopener control
+    def notify_fmt_change(self):
+        if self.wakeup_fd < 0:
+            return
+        try:
+            os.eventfd_write(self.wakeup_fd, 1)
+        except OSError:
+            pass
+
+    def read_event(self, event, updates, errs):
+        try:
+            ioctl(self.fd, VIDIOC_DQEVENT, event)
+        except Exception as e:
+            self.err_cb(collect_warning(f'VIDIOC_DQEVENT failed: {e}', []))
+            return False
+        self.events += 1
+        ctrl = self.ctrls.find_by_v4l2_id(event.id)
+        if ctrl is None:
+            return True
+        ctrl.inactive = bool(event.ctrl.flags & V4L2_CTRL_FLAG_INACTIVE)
+        ctrl.readonly = bool(event.ctrl.flags & V4L2_CTRL_FLAG_READ_ONLY)
+        ctrl_errs = []
+        self.ctrls.set_ctrl_int_value(ctrl, int(event.ctrl.value), ctrl_errs)
+        logging.debug(f'VIDIOC_DQEVENT {ctrl.text_id}={ctrl.value} (pending: {event.pending})')
+        if ctrl_errs:
+            errs += ctrl_errs
+            return True
+        updates[ctrl.v4l2_id] = ctrl
+        return True
+
+    # drains the queued events, the ctrls hold the latest value and flags,
+    # so the callback gets every changed ctrl only once per wakeup
+    def read_events(self, event):
+        updates = {}
+        errs = []
+        while True:
+            if not self.read_event(event, updates, errs):
+                return False
+            if event.pending == 0:
+                break
+        if errs:
+            self.err_cb(errs)
+        if updates:
+            self.batches += 1
+            logging.info(f'V4L2Listener: {", ".join(f"{c.text_id}={c.value}" for c in updates.values())}')
+            self.cb(list(updates.values()))
+        return True
 
     # thread start
     def run(self):
         event = v4l2_event()
+        timeout = self.fmt_check_interval if self.fmt_check_interval else -1
         while not self.epoll.closed:
-            p = self.epoll.poll(1)
-            if len(p) == 0:
-                if not self.epoll.closed:
-                    self.query_fmt_changes()
-                continue
-            (fd , v) = p[0]
-            if v == select.POLLNVAL or v == select.POLLERR:
-                break
             try:
-                ioctl(self.fd, VIDIOC_DQEVENT, event)
-            except Exception as e:
-                self.err_cb(collect_warning(f'VIDIOC_DQEVENT failed: {e}', []))
+                p = self.epoll.poll(timeout)
+            except OSError:
                 break
-            ctrl = self.ctrls.find_by_v4l2_id(event.id)
-            ctrl.inactive = bool(event.ctrl.flags & V4L2_CTRL_FLAG_INACTIVE)
-            ctrl.readonly = bool(event.ctrl.flags & V4L2_CTRL_FLAG_READ_ONLY)
-            errs = []
-            self.ctrls.set_ctrl_int_value(ctrl, int(event.ctrl.value), errs)
-            logging.info(f'VIDIOC_DQEVENT {ctrl.text_id}={ctrl.value} (pending: {event.pending})')
-            if errs:
-                self.err_cb(errs)
+            if self.stopped:
+                break
+            if len(p) == 0:
+                self.query_fmt_changes()
                 continue
-            self.cb(ctrl)
+            for (fd, v) in p:
+                if fd == self.wakeup_fd:
+                    try:
+                        os.eventfd_read(self.wakeup_fd)
+                    except OSError:
+                        pass
+                    self.query_fmt_changes()
+                    continue
+                if v & (select.POLLNVAL | select.POLLERR):
+                    self.epoll.close()
+                    break
+                if not self.read_events(event):
+                    self.epoll.close()
+                    break
+
+        if self in self.fmt_ctrls.listeners:
+            self.fmt_ctrls.listeners.remove(self)
+        self.epoll.close()
+        logging.info(f'V4L2Listener: saved {self.saved_ioctls()} format polling ioctls, {self.events} events in {self.batches} callbacks')
 
     # thread stop
     def stop(self):
-        self.epoll.close()
+        if self.stopped:
+            return
+        self.stopped = True
+        self.notify_fmt_change()
+        if self.is_alive():
+            self.join()
+        os.close(self.wakeup_fd)
+        self.wakeup_fd = -1
 
 
 V4L2_CAP_CARD_DESC = 'Name of the device, a NUL-terminated UTF-8 string. For example: “Yoyodyne TV/FM”. One driver may support different brands or models of video hardware. This information is intended for users, for example in a menu of available devices. Since multiple TV cards of the same brand may be installed which are supported by the same driver, this name should be combined with the character device file name (e. g. /dev/video2) or the bus_info string to avoid ambiguities.'
@@ -1917,13 +2547,15 @@ V4L2_PATH_DESC = 'Location of the character device in the system.'
 V4L2_REAL_PATH_DESC = 'The real location of the character device in the system.'
 
 class V4L2FmtCtrls:
-    def __init__(self, device, fd):
+    def __init__(self, device, fd, cache=None):
         self.device = device
         self.fd = fd
+        self.cache = cache or CapabilityCache()
         self.ctrls = []
         self.pxf_ctrl = None
         self.res_ctrl = None
         self.fps_ctrl = None
+        self.listeners = []
         self.get_format_ctrls()
 
     def get_ctrls(self):
@@ -1947,6 +2579,9 @@ class V4L2FmtCtrls:
                 self.set_resolution(ctrl, v, errs)
             elif ctrl.text_id == 'fps':
                 self.set_fps(ctrl, v, errs)
+            # changing the format could change the others (eg: fps after resolution)
+            for l in self.listeners:
+                l.notify_fmt_change()
 
     def get_format_ctrls(self):
         fmt = self.get_fmt()
@@ -1990,6 +2625,21 @@ class V4L2FmtCtrls:
             ]) # fps menu should be dropdown
             self.ctrls.append(self.fps_ctrl)
 
+    # re-queries the format and the menus depending on it (resolutions, fps) into the same ctrls,
+    # returns the changed ones or None if the controls themselves changed
+    def refresh(self):
+        ctrls = self.ctrls
+        pxf_ctrl, res_ctrl, fps_ctrl = self.pxf_ctrl, self.res_ctrl, self.fps_ctrl
+        self.res_ctrl = None
+        self.fps_ctrl = None
+        self.get_format_ctrls()
+        if [c.text_id for c in self.ctrls] != [c.text_id for c in ctrls]:
+            return None
+        new_ctrls = self.ctrls
+        self.ctrls = ctrls
+        self.pxf_ctrl, self.res_ctrl, self.fps_ctrl = pxf_ctrl, res_ctrl, fps_ctrl
+        return [c for c, n in zip(ctrls, new_ctrls) if update_ctrl_from(c, n)]
+
     def set_pixelformat(self, ctrl, pixelformat, errs):
         fmt = v4l2_format()
         fmt.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
@@ -2094,6 +2744,9 @@ class V4L2FmtCtrls:
         ctrl.value = fps
 
     def get_fmts(self):
+        return self.cache.memo('fmts', None, self.query_fmts)
+
+    def query_fmts(self):
         fmts = []
         fmt = v4l2_fmtdesc()
         fmt.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
@@ -2107,6 +2760,9 @@ class V4L2FmtCtrls:
         return fmts
 
     def get_resolutions(self, pixelformat):
+        return self.cache.memo('resolutions', pxf2str(pixelformat), lambda: self.query_resolutions(pixelformat))
+
+    def query_resolutions(self, pixelformat):
         resolutions = []
         frm = v4l2_frmsizeenum()
         frm.pixel_format = pixelformat
@@ -2123,6 +2779,10 @@ class V4L2FmtCtrls:
         return resolutions
 
     def get_framerates(self, pixelformat, width, height):
+        return self.cache.memo('framerates', f'{pxf2str(pixelformat)}_{width}x{height}',
+            lambda: self.query_framerates(pixelformat, width, height))
+
+    def query_framerates(self, pixelformat, width, height):
         framerates = []
         frmi = v4l2_frmivalenum()
         frmi.pixel_format = pixelformat
@@ -2147,6 +2807,17 @@ class V4L2FmtCtrls:
             logging.warning(f'V4L2FmtCtrls: Can\'t get capability: {e}')
         return cap
 
+    # pixelformat -> resolution -> framerates
+    def get_format_tree(self):
+        tree = {}
+        for fmt in self.get_fmts():
+            pixelformat = str2pxf(fmt)
+            tree[fmt] = {}
+            for resolution in self.get_resolutions(pixelformat):
+                width, height = map(int, resolution.split('x'))
+                tree[fmt][resolution] = self.get_framerates(pixelformat, width, height)
+        return tree
+
 def str2pxf(str):
     return ord(str[0]) | (ord(str[1]) << 8) | (ord(str[2]) << 16) | (ord(str[3]) << 24)
 
@@ -2180,6 +2851,8 @@ def resolve_v4l_ids(v4l_ctrls, preset):
     return ret
 
 class ColorPreset:
+    provides = ['color_preset']
+
     def __init__(self, cam_ctrls):
         self.ctrls = []
         self.cam_ctrls = cam_ctrls
@@ -2266,6 +2939,20 @@ class ColorPreset:
                 return False
         return True
 
+    # the preset sets its members, and they decide whether the preset is on default
+    def get_dependents(self):
+        if not self.ctrls:
+            return {}
+        preset = self.ctrls[0]
+        v4l2_ids = list(self.v4l_defaults)
+        for p in self.presets:
+            v4l2_ids += [i for i in p.v4l_presets if i not in v4l2_ids]
+        members = [c for c in map(self.cam_ctrls.v4l_ctrls.find_by_v4l2_id, v4l2_ids) if c is not None]
+        deps = {preset: members}
+        for c in self.default_controls:
+            deps[c] = [preset]
+        return deps
+
     def get_ctrls(self):
         return self.ctrls
 
@@ -2282,6 +2969,8 @@ class ColorPreset:
             self.cam_ctrls.setup_ctrls({**self.defaults, **menu.presets}, errs)
 
 class SystemdSaver:
+    provides = ['systemd_cameractrlsd']
+
     def __init__(self, cam_ctrls):
         self.systemd_user_dir = os.path.expanduser('~/.config/systemd/user')
         self.service_file = 'cameractrlsd.service'
@@ -2362,6 +3051,8 @@ WantedBy=graphical-session.target
 """
 
 class ConfigPreset:
+    provides = ['preset']
+
     def __init__(self, cam_ctrls):
         self.cam_ctrls = cam_ctrls
         self.ctrls = [
@@ -2428,8 +3119,7 @@ class ConfigPreset:
             collect_warning(f'ConfigPreset: {preset} not found in {filename}', errs)
             return
         
-        for ctrl in config[preset]:
-            self.cam_ctrls.setup_ctrls({ctrl: config[preset][ctrl]}, errs)
+        self.cam_ctrls.setup_ctrls(dict(config[preset]), errs)
 
     def save_preset(self, device, preset_num, errs):
         try:
@@ -2490,11 +3180,107 @@ def get_configfilename(device):
 
     return os.path.join(get_configdir(), f'{dev_id}.ini')
 
+CAPABILITY_CACHE_VERSION = 2
+
+def get_capability_cache_key(device, fd):
+    descs = UVCDescriptors.for_device(device)
+    if not descs.usb_ids:
+        return None
+
+    sysdir = f'/sys/class/video4linux/{get_sysfs_device_name(device)}'
+
+    cap = v4l2_capability()
+    try:
+        ioctl(fd, VIDIOC_QUERYCAP, cap)
+    except Exception as e:
+        logging.warning(f'CapabilityCache: Can\'t get capability: {e}')
+        return None
+
+    # the metadata node of the same interface has other controls and formats
+    if not cap.device_caps & V4L2_CAP_VIDEO_CAPTURE:
+        return None
+
+    return {
+        'usb_ids': descs.usb_ids,
+        'bcd_device': descs.bcd_device,
+        'interface': read_usb_id_from_file(f'{sysdir}/../../bInterfaceNumber'),
+        'driver': str(cap.driver, 'utf-8'),
+        'driver_version': cap.version,
+        'device_caps': cap.device_caps,
+    }
+
+# static device metadata (control ranges, menus, format tree, XU availability)
+# the cache is dropped when the version, the firmware (bcdDevice) or the driver changes
+class CapabilityCache:
+    def __init__(self, key=None):
+        self.key = key
+        self.data = {}
+        self.dirty = False
+        if key is None:
+            return
+
+        self.filename = os.path.join(get_configdir(), 'cache',
+            f'{key["usb_ids"].replace(":", "_")}_{key["interface"]}.json')
+        try:
+            with open(self.filename) as f:
+                cache = json.load(f)
+            if cache.get('version') == CAPABILITY_CACHE_VERSION and cache.get('key') == key:
+                self.data = cache.get('data', {})
+            else:
+                logging.info(f'CapabilityCache: {self.filename} is outdated')
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f'CapabilityCache: failed to read {self.filename}: {e}')
+
+    @classmethod
+    def for_device(cls, device, fd):
+        return cls(get_capability_cache_key(device, fd))
+
+    def get(self, section, key=None):
+        value = self.data.get(section)
+        if key is not None and value is not None:
+            value = value.get(key)
+        return value
+
+    def put(self, section, value, key=None):
+        if self.key is None:
+            return
+        if key is not None:
+            self.data.setdefault(section, {})[key] = value
+        else:
+            self.data[section] = value
+        self.dirty = True
+
+    # the empty and False results can come from a busy or failing device, they are queried again next time
+    def memo(self, section, key, fn):
+        value = self.get(section, key)
+        if not value:
+            value = fn()
+            if value:
+                self.put(section, value, key)
+        return value
+
+    def save(self):
+        if self.key is None or not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.filename), mode=0o755, exist_ok=True)
+            tmpfile = f'{self.filename}.{os.getpid()}.{get_ident()}'
+            with open(tmpfile, 'w') as f:
+                json.dump({'version': CAPABILITY_CACHE_VERSION, 'key': self.key, 'data': self.data}, f)
+            os.replace(tmpfile, self.filename)
+            self.dirty = False
+        except Exception as e:
+            logging.warning(f'CapabilityCache: failed to write {self.filename}: {e}')
+
 def set_repeat_interval(ctrl, e2e_ns):
     if ctrl:
         ctrl.repeat = e2e_ns / ((ctrl.max - ctrl.min) / ctrl.step)
 
 class DesktopPortal():
+    provides = ['desktop_portal_cameractrlsd']
+
     def __init__(self, ctrls):
         self.cam_ctrls = ctrls
         if not self.portal_available():
@@ -2563,16 +3349,161 @@ class DesktopPortal():
         except Exception as e:
             collect_warning(f'DesktopPortal: RequestBackground failed: {e}', errs)
 
+# keeps only the latest pending value per control and applies them on its own thread
+# at most max_rate times a second, so a dragged scale or a PTZ input doesn't queue up stale writes,
+# cb gets the applied params, err_cb the errors of them
+class ControlWriter(Thread):
+    # the speed and button writes waiting to be written one after the other,
+    # above this the newer ones are merged, so a burst can't keep the camera moving
+    max_batches = 3
+
+    def __init__(self, ctrls, cb=None, err_cb=None, max_rate=30):
+        # daemon, so an exiting tool isn't held by it, stop() writes the pending values
+        super().__init__(daemon=True)
+        self.ctrls = ctrls
+        self.cb = cb
+        self.err_cb = err_cb
+        self.interval = 1 / max_rate if max_rate else 0
+        self.cond = Condition()
+        # the params to write one after the other
+        self.pending = []
+        self.writing = {}
+        self.stopped = False
+        self.writes = 0
+        self.coalesced = 0
+
+    # the relative, the button and the speed controls act on every write,
+    # a speed returning to zero must not replace the one starting the move
+    def is_coalescable(self, ctrl):
+        return ctrl is None or not (ctrl.zeroer or ctrl.type == 'button' or getattr(ctrl, 'writeonly', False))
+
+    # the relative steps are summed into one within the range
+    def add_steps(self, ctrl, a, b):
+        if ctrl is None or ctrl.type != 'integer' or not getattr(ctrl, 'writeonly', False):
+            return None
+        try:
+            return max(ctrl.min, min(ctrl.max, int(a) + int(b)))
+        except (TypeError, ValueError):
+            return None
+
+    def write(self, text_id, value):
+        ctrl = self.ctrls.get_ctrl_by_text_id(text_id)
+        coalescable = self.is_coalescable(ctrl)
+        with self.cond:
+            if not self.pending:
+                self.pending.append({})
+            elif text_id in self.pending[-1]:
+                steps = self.add_steps(ctrl, self.pending[-1][text_id], value)
+                if steps is not None:
+                    value = steps
+                    self.coalesced += 1
+                elif not coalescable and len(self.pending) < self.max_batches:
+                    self.pending.append({})
+                else:
+                    self.coalesced += 1
+            self.pending[-1][text_id] = value
+            self.cond.notify()
+
+    def is_pending(self, text_id):
+        with self.cond:
+            return any(text_id in p for p in self.pending) or text_id in self.writing
+
+    # the value the control will have after the pending writes
+    def value(self, ctrl):
+        with self.cond:
+            for p in reversed(self.pending):
+                if ctrl.text_id in p:
+                    return p[ctrl.text_id]
+            return self.writing.get(ctrl.text_id, ctrl.value)
+
+    def run(self):
+        last_write = 0
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopped:
+                    self.cond.wait()
+                if not self.pending:
+                    break
+                delay = last_write + self.interval - time.monotonic()
+                if delay > 0 and not self.stopped:
+                    # the writes arriving meanwhile are coalesced
+                    self.cond.wait(delay)
+                    continue
+                self.writing = self.pending.pop(0)
+
+            errs = []
+            self.ctrls.setup_ctrls(self.writing, errs)
+            last_write = time.monotonic()
+            self.writes += 1
+            params = self.writing
+            with self.cond:
+                self.writing = {}
+            if errs and self.err_cb:
+                self.err_cb(errs)
+            if self.cb:
+                self.cb(params)
+
+        logging.info(f'ControlWriter: {self.writes} writes, {self.coalesced} coalesced values')
+
+    # thread stop, the pending values are still written
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        if self.is_alive():
+            self.join()
+
+# runs the device operations (open, enumeration, ioctls, helper processes) one by one on its own thread,
+# the results are handed to post (eg: GLib.idle_add), so a slow or hung camera doesn't block the caller
+class DeviceWorker(Thread):
+    def __init__(self, post):
+        super().__init__(daemon=True)
+        self.post = post
+        self.cond = Condition()
+        self.jobs = deque()
+        self.stopped = False
+
+    def submit(self, fn, cb=None, err_cb=None):
+        with self.cond:
+            self.jobs.append((fn, cb, err_cb))
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.jobs and not self.stopped:
+                    self.cond.wait()
+                if not self.jobs:
+                    break
+                fn, cb, err_cb = self.jobs.popleft()
+            try:
+                result = fn()
+            except Exception as e:
+                logging.warning(f'DeviceWorker: {e}')
+                if err_cb:
+                    self.post(err_cb, e)
+                continue
+            if cb:
+                self.post(cb, result)
+
+    # thread stop, the submitted jobs are still run
+    def stop(self, timeout=None):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        if self.is_alive():
+            self.join(timeout)
+
 class PTZController():
-    def __init__(self, ctrls):
+    def __init__(self, ctrls, writer=None):
         self.ctrls = ctrls
-        v4l_ctrls = ctrls.v4l_ctrls
+        self.writer = writer
 
-        self.zoom_absolute = v4l_ctrls.find_by_v4l2_id(V4L2_CID_ZOOM_ABSOLUTE)
-        self.pan_absolute = v4l_ctrls.find_by_v4l2_id(V4L2_CID_PAN_ABSOLUTE)
-        self.tilt_absolute = v4l_ctrls.find_by_v4l2_id(V4L2_CID_TILT_ABSOLUTE)
-        self.pan_speed = v4l_ctrls.find_by_v4l2_id(V4L2_CID_PAN_SPEED)
-        self.tilt_speed = v4l_ctrls.find_by_v4l2_id(V4L2_CID_TILT_SPEED)
+        self.zoom_absolute = ctrls.get_ctrl_by_v4l2_id(V4L2_CID_ZOOM_ABSOLUTE)
+        self.pan_absolute = ctrls.get_ctrl_by_v4l2_id(V4L2_CID_PAN_ABSOLUTE)
+        self.tilt_absolute = ctrls.get_ctrl_by_v4l2_id(V4L2_CID_TILT_ABSOLUTE)
+        self.pan_speed = ctrls.get_ctrl_by_v4l2_id(V4L2_CID_PAN_SPEED)
+        self.tilt_speed = ctrls.get_ctrl_by_v4l2_id(V4L2_CID_TILT_SPEED)
         self.pantilt_reset = ctrls.get_ctrl_by_text_id('logitech_pantilt_reset')
         self.pantilt_preset = ctrls.get_ctrl_by_text_id('logitech_pantilt_preset')
 
@@ -2586,22 +3517,35 @@ class PTZController():
         self.has_pantilt_speed = self.pan_speed != None and self.tilt_speed != None
         self.has_pantilt_absolute = self.pan_absolute != None and self.tilt_absolute != None
 
+    # with a ControlWriter the values are written asynchronously, its errors go to its err_cb
+    def set_value(self, control, value, errs):
+        if self.writer is not None:
+            self.writer.write(control.text_id, value)
+        else:
+            self.ctrls.setup_ctrls({control.text_id: value}, errs)
+
+    def get_value(self, control):
+        if self.writer is not None:
+            return self.writer.value(control)
+        return control.value
+
     def do_percent(self, percent, errs, control):
         if control is not None:
             control_size = (control.max - control.min) // control.step
             value = control.min + round(percent * control_size) * control.step
-            if value != control.value:
-                self.ctrls.setup_ctrls({control.text_id: value}, errs)
+            if value != self.get_value(control):
+                self.set_value(control, value, errs)
         return 0
 
     def do_step(self, step, errs, control):
         now = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
         if control is not None and control.last_set + control.repeat < now:
             act_step = (control.step or 1) * step
-            des_value = control.value + act_step
+            cur_value = self.get_value(control)
+            des_value = cur_value + act_step
             value = min(max(des_value, control.min), control.max)
-            if value != control.value:
-                self.ctrls.setup_ctrls({control.text_id: value}, errs)
+            if value != cur_value:
+                self.set_value(control, value, errs)
                 control.last_set = now
             if des_value != value:
                 return 1
@@ -2611,8 +3555,8 @@ class PTZController():
         if control is not None:
             cur_step = (control.step or 1) * step
             value = min(max(cur_step, control.min), control.max)
-            if value != control.value:
-                self.ctrls.setup_ctrls({control.text_id: value}, errs)
+            if value != self.get_value(control):
+                self.set_value(control, value, errs)
         return 0
 
     def do_zoom_percent(self, percent, errs):
@@ -2644,18 +3588,18 @@ class PTZController():
 
     def do_reset(self, errs):
         if self.zoom_absolute:
-            self.ctrls.setup_ctrls({self.zoom_absolute.text_id: self.zoom_absolute.default}, errs)
+            self.set_value(self.zoom_absolute, self.zoom_absolute.default, errs)
         if self.pan_absolute:
-            self.ctrls.setup_ctrls({self.pan_absolute.text_id: self.pan_absolute.default}, errs)
+            self.set_value(self.pan_absolute, self.pan_absolute.default, errs)
         if self.tilt_absolute:
-            self.ctrls.setup_ctrls({self.tilt_absolute.text_id: self.tilt_absolute.default}, errs)
+            self.set_value(self.tilt_absolute, self.tilt_absolute.default, errs)
         if self.pantilt_reset:
-            self.ctrls.setup_ctrls({self.pantilt_reset.text_id: 'both'}, errs)
+            self.set_value(self.pantilt_reset, 'both', errs)
         return 0
 
     def do_preset(self, preset_num, errs):
         if self.pantilt_preset:
-            self.ctrls.setup_ctrls({self.pantilt_preset.text_id: f'goto_{preset_num}'}, errs)
+            self.set_value(self.pantilt_preset, f'goto_{preset_num}', errs)
         return 0
 
 class CtrlPage:
@@ -2669,79 +3613,234 @@ class CtrlCategory:
         self.title = title
         self.ctrls = ctrls
 
+# creates the provider only when one of its controls is requested,
+# provides lists the text_ids it can have
+class LazyProvider:
+    def __init__(self, factory, provides, on_load=None):
+        self.factory = factory
+        self.provides = provides
+        self.on_load = on_load
+        self.provider = None
+
+    @property
+    def loaded(self):
+        return self.provider is not None
+
+    def load(self):
+        if self.provider is None:
+            self.provider = self.factory()
+            if self.on_load:
+                self.on_load()
+        return self.provider
+
+    def get_ctrls(self):
+        return self.load().get_ctrls()
+
+    def setup_ctrls(self, params, errs):
+        return self.load().setup_ctrls(params, errs)
+
+class CtrlRegistry:
+    def __init__(self, providers):
+        self.providers = providers
+        self.loaded = []
+        self.lists = []
+        self.ctrls = []
+        self.by_text_id = {}
+        self.by_v4l2_id = {}
+        self.by_provider = {}
+        self.providers_by_text_id = {}
+        self.dependents = {}
+
+    # loads the lazy providers which can have text_id, or all of them without it
+    def load(self, text_id=None):
+        loaded = False
+        for p in self.providers:
+            if getattr(p, 'loaded', True):
+                continue
+            if text_id is None or text_id in p.provides:
+                p.load()
+                loaded = True
+        return loaded
+
+    # the providers replace their lists when they reprobe the device, rebuild only then
+    def sync(self):
+        providers = [p for p in self.providers if getattr(p, 'loaded', True)]
+        lists = [p.get_ctrls() for p in providers]
+        if providers == self.loaded and \
+            all(l is ol and len(l) == n for l, (ol, n) in zip(lists, self.lists)):
+            return
+
+        self.loaded = providers
+        self.lists = [(l, len(l)) for l in lists]
+        self.ctrls = []
+        self.by_text_id = {}
+        self.by_v4l2_id = {}
+        self.by_provider = {}
+        self.providers_by_text_id = {}
+        for p, ctrls in zip(providers, lists):
+            self.by_provider[p] = ctrls
+            self.ctrls += ctrls
+            for c in ctrls:
+                self.by_text_id.setdefault(c.text_id, c)
+                text_id_providers = self.providers_by_text_id.setdefault(c.text_id, [])
+                if p not in text_id_providers:
+                    text_id_providers.append(p)
+                if hasattr(c, 'v4l2_id'):
+                    self.by_v4l2_id.setdefault(c.v4l2_id, c)
+
+        self.dependents = {}
+        for p in self.loaded:
+            provider = getattr(p, 'provider', p)
+            if not hasattr(provider, 'get_dependents'):
+                continue
+            for c, deps in provider.get_dependents().items():
+                ds = self.dependents.setdefault(c, [])
+                ds += [d for d in deps if d not in ds]
+
+    def get_ctrls(self):
+        self.load()
+        self.sync()
+        return self.ctrls
+
+    def get_by_text_id(self, text_id):
+        self.sync()
+        if text_id not in self.by_text_id and self.load(text_id):
+            self.sync()
+        return self.by_text_id.get(text_id)
+
+    def get_by_v4l2_id(self, v4l2_id):
+        self.sync()
+        return self.by_v4l2_id.get(v4l2_id)
+
+    def get_providers(self, text_id):
+        self.sync()
+        if self.load(text_id):
+            self.sync()
+        return self.providers_by_text_id.get(text_id, [])
+
+    # the ctrl and the ctrls whose state can follow its value
+    def get_affected(self, ctrl):
+        self.sync()
+        affected = [ctrl]
+        for c in affected:
+            affected += [d for d in self.dependents.get(c, []) if d not in affected]
+        return affected
+
+    def get_provider_ctrls(self, provider):
+        if not getattr(provider, 'loaded', True):
+            provider.load()
+        self.sync()
+        return self.by_provider.get(provider, [])
+
+# profile='core' has only the V4L2 controls, the others are created on first use
 class CameraCtrls:
-    def __init__(self, device, fd):
+    def __init__(self, device, fd, profile='full'):
         self.device = device
         self.fd = fd
-        self.v4l_ctrls = V4L2Ctrls(device, fd)
-        self.fmt_ctrls = V4L2FmtCtrls(device, fd)
+        self.cache = CapabilityCache.for_device(device, fd)
+        self.v4l_ctrls = V4L2Ctrls(device, fd, self.cache)
+        self.fmt_ctrls = V4L2FmtCtrls(device, fd, self.cache)
         self.ctrls = [
             self.v4l_ctrls,
             self.fmt_ctrls,
-            KiyoProCtrls(device, fd),
-            LogitechCtrls(device, fd),
-            SystemdSaver(self),
-            ColorPreset(self),
-            ConfigPreset(self),
-            DesktopPortal(self),
         ]
+        if profile != 'core':
+            self.ctrls += [
+                LazyProvider(lambda: KiyoProCtrls(device, self.fd), KiyoProCtrls.provides),
+                LazyProvider(lambda: LogitechCtrls(device, self.fd, self.cache), LogitechCtrls.provides, self.cache.save),
+                LazyProvider(lambda: SystemdSaver(self), SystemdSaver.provides),
+                LazyProvider(lambda: ColorPreset(self), ColorPreset.provides),
+                LazyProvider(lambda: ConfigPreset(self), ConfigPreset.provides),
+                LazyProvider(lambda: DesktopPortal(self), DesktopPortal.provides),
+            ]
+        self.registry = CtrlRegistry(self.ctrls)
+        # the GUI, the ControlWriter and the presets set the controls from different threads
+        self.lock = RLock()
+        self.cache.save()
+
+    # the reopener controls lock the device until the fd is closed, this takes the new fd
+    # and re-queries only what can change, returns the changed ctrls or None if a full rebuild is needed
+    def reopen(self, fd):
+        self.set_fd(fd)
+        v4l_changed = self.v4l_ctrls.refresh()
+        fmt_changed = self.fmt_ctrls.refresh()
+        if v4l_changed is None or fmt_changed is None:
+            return None
+        return v4l_changed + fmt_changed
+
+    # passes a new fd of the same device to the providers without querying anything
+    def set_fd(self, fd):
+        self.fd = fd
+        for p in self.ctrls:
+            provider = getattr(p, 'provider', p)
+            if provider is not None and hasattr(provider, 'fd'):
+                provider.fd = fd
+
+    # the values changed by other processes, with one VIDIOC_G_EXT_CTRLS
+    def read_values(self):
+        self.v4l_ctrls.read_back(self.v4l_ctrls.get_ctrls())
 
     def has_ptz(self):
         return any([
-            self.v4l_ctrls.find_by_v4l2_id(V4L2_CID_ZOOM_ABSOLUTE),
-            self.v4l_ctrls.find_by_v4l2_id(V4L2_CID_PAN_ABSOLUTE),
-            self.v4l_ctrls.find_by_v4l2_id(V4L2_CID_TILT_ABSOLUTE),
-            self.v4l_ctrls.find_by_v4l2_id(V4L2_CID_PAN_SPEED),
-            self.v4l_ctrls.find_by_v4l2_id(V4L2_CID_TILT_SPEED),
+            self.get_ctrl_by_v4l2_id(V4L2_CID_ZOOM_ABSOLUTE),
+            self.get_ctrl_by_v4l2_id(V4L2_CID_PAN_ABSOLUTE),
+            self.get_ctrl_by_v4l2_id(V4L2_CID_TILT_ABSOLUTE),
+            self.get_ctrl_by_v4l2_id(V4L2_CID_PAN_SPEED),
+            self.get_ctrl_by_v4l2_id(V4L2_CID_TILT_SPEED),
         ])
 
     def print_ctrls(self):
-        for page in self.get_ctrl_pages():
-            for cat in page.categories:
-                print(f'{page.title} / {cat.title}')
-                for c in cat.ctrls:
-                    print(f' {c.text_id}', end = '')
-                    if c.type == 'menu':
-                        print(f' = {c.value}\t( ', end = '')
-                        if c.default:
-                            print(f'default: {c.default} ', end = '')
-                        print('values:', end = ' ')
-                        print(', '.join([m.text_id for m in c.menu]), end = ' )')
-                    elif c.type == 'button':
-                        print('\t\t( buttons: ', end = '')
-                        print(', '.join([m.text_id for m in c.menu]), end = ' )')
-                    elif c.type == 'info':
-                        print(f' = {c.value}', end = '')
-                    elif c.type in ['integer', 'boolean']:
-                        print(f' = {c.value}\t( default: {c.default} min: {c.min} max: {c.max}', end = '')
-                        if c.step and c.step != 1:
-                            print(f' step: {c.step}', end = '')
-                        print(' )', end = '')
-                    if c.inactive:
-                        print(' | inactive', end = '')
-                    if c.readonly:
-                        print(' | readonly', end = '')
-                    print()
+        print_ctrl_pages(ctrl_pages_to_dicts(self.get_ctrl_pages()))
+
+    # the controls and the formats in one structure for the --json output and the ControlServer
+    def get_snapshot(self):
+        snapshot = {
+            'device': self.device,
+            'pages': ctrl_pages_to_dicts(self.get_ctrl_pages()),
+            'formats': self.fmt_ctrls.get_format_tree(),
+        }
+        self.cache.save()
+        return snapshot
 
+    # returns the keys which failed, the providers which don't report them
+    # per control fail with all of their keys when they add an error
     def setup_ctrls(self, params, errs):
         logging.debug(f'CameraCtrls.setup_ctrls: {params}')
-        for c in self.ctrls:
-            c.setup_ctrls(params, errs)
-        unknown_ctrls = list(set(params.keys()) - set([c.text_id for c in self.get_ctrls()]))
+        provider_params = {}
+        unknown_ctrls = []
+        failed = []
+        with self.lock:
+            for k, v in params.items():
+                providers = self.registry.get_providers(k)
+                if not providers:
+                    unknown_ctrls.append(k)
+                for p in providers:
+                    provider_params.setdefault(p, {})[k] = v
+            for c in self.ctrls:
+                if c in provider_params:
+                    n = len(errs)
+                    c_failed = c.setup_ctrls(provider_params[c], errs)
+                    if c_failed is None:
+                        c_failed = list(provider_params[c]) if len(errs) > n else []
+                    failed += [k for k in c_failed if k not in failed]
         if len(unknown_ctrls) > 0:
             collect_warning(f'CameraCtrls: can\'t find {unknown_ctrls} controls', errs)
+        return failed + unknown_ctrls
 
     def get_ctrls(self):
-        ctrls = []
-        for c in self.ctrls:
-            ctrls += c.get_ctrls()
-        return ctrls
+        return self.registry.get_ctrls()
 
     def get_ctrl_by_text_id(self, text_id):
-        return find_by_text_id(self.get_ctrls(), text_id)
+        return self.registry.get_by_text_id(text_id)
+
+    def get_ctrl_by_v4l2_id(self, v4l2_id):
+        return self.registry.get_by_v4l2_id(v4l2_id)
+
+    def get_affected_ctrls(self, ctrl):
+        return self.registry.get_affected(ctrl)
 
     def get_ctrl_pages(self):
-        ctrls = self.get_ctrls()
+        ctrls = list(self.get_ctrls())
         pages = [
             CtrlPage('Basic', [
                 CtrlCategory('Crop',
@@ -2861,27 +3960,507 @@ class CameraCtrls:
 
         return pages
 
-    def subscribe_events(self, cb, err_cb):
-        thread = V4L2Listener(self.v4l_ctrls, self.fmt_ctrls, cb, err_cb)
+    def subscribe_events(self, cb, err_cb, fmt_check_interval=5.0):
+        thread = V4L2Listener(self.v4l_ctrls, self.fmt_ctrls, cb, err_cb, fmt_check_interval)
         thread.start()
         return thread
 
+    def control_writer(self, cb=None, err_cb=None, max_rate=30):
+        thread = ControlWriter(self, cb, err_cb, max_rate)
+        thread.start()
+        return thread
+
+def ctrl_to_dict(c):
+    d = {'text_id': c.text_id, 'name': c.name, 'type': c.type, 'value': c.value}
+    for k in ['default', 'min', 'max', 'step']:
+        if getattr(c, k) is not None:
+            d[k] = getattr(c, k)
+    if c.menu:
+        d['menu'] = [m.text_id for m in c.menu]
+    d['flags'] = ctrl_flags(c)
+    return d
+
+def ctrl_flags(c):
+    return [f for f in ['inactive', 'readonly', 'writeonly', 'update', 'reopener'] if getattr(c, f, False)]
+
+def ctrl_pages_to_dicts(pages):
+    return [{
+        'title': page.title,
+        'categories': [{
+            'title': cat.title,
+            'ctrls': [ctrl_to_dict(c) for c in cat.ctrls],
+        } for cat in page.categories],
+    } for page in pages]
+
+# prints the pages of ctrl_pages_to_dicts, which can come from the ControlServer too
+def print_ctrl_pages(pages):
+    for page in pages:
+        for cat in page['categories']:
+            print(f'{page["title"]} / {cat["title"]}')
+            for c in cat['ctrls']:
+                print(f' {c["text_id"]}', end = '')
+                if c['type'] == 'menu':
+                    print(f' = {c["value"]}\t( ', end = '')
+                    if c.get('default'):
+                        print(f'default: {c["default"]} ', end = '')
+                    print('values:', end = ' ')
+                    print(', '.join(c['menu']), end = ' )')
+                elif c['type'] == 'button':
+                    print('\t\t( buttons: ', end = '')
+                    print(', '.join(c['menu']), end = ' )')
+                elif c['type'] == 'info':
+                    print(f' = {c["value"]}', end = '')
+                elif c['type'] in ['integer', 'boolean']:
+                    print(f' = {c["value"]}\t( default: {c.get("default")} min: {c.get("min")} max: {c.get("max")}', end = '')
+                    if c.get('step') and c['step'] != 1:
+                        print(f' step: {c["step"]}', end = '')
+                    print(' )', end = '')
+                if 'inactive' in c['flags']:
+                    print(' | inactive', end = '')
+                if 'readonly' in c['flags']:
+                    print(' | readonly', end = '')
+                print()
+
+def get_device_snapshot(device):
+    try:
+        fd = os.open(device, os.O_RDWR, 0)
+    except Exception as e:
+        return {'device': device, 'errors': [f'os.open({device}, os.O_RDWR, 0) failed: {e}']}
+    try:
+        return CameraCtrls(device, fd).get_snapshot()
+    finally:
+        os.close(fd)
+
+# the devices are opened in parallel, a slow one doesn't hold up the others
+# the snapshots are taken on one thread per device, locally or through the server
+def get_device_snapshots(devices, get_snapshot=get_device_snapshot):
+    results = [None] * len(devices)
+
+    def snapshot(i, device):
+        try:
+            results[i] = get_snapshot(device)
+        except Exception as e:
+            results[i] = {'device': device, 'errors': [f'{e}']}
+
+    threads = [Thread(target=snapshot, args=(i, d)) for i, d in enumerate(devices)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+def print_snapshots(snapshots, output):
+    if output == 'ndjson':
+        for s in snapshots:
+            print(json.dumps(s))
+    elif len(snapshots) == 1:
+        print(json.dumps(snapshots[0], indent=2))
+    else:
+        print(json.dumps(snapshots, indent=2))
+
+# prints the control changes of the devices as JSON lines, the changes of a control
+# within the window are merged into one line with the first old and the last new value
+class ControlWatcher:
+    def __init__(self, window=0):
+        self.window = window
+        self.lock = Lock()
+        self.values = {}
+        self.pending = {}
+
+    def watch(self, device, camera):
+        for c in camera.get_ctrls():
+            self.values[(device, c.text_id)] = c.value
+        return camera.subscribe_events(lambda ctrls: self.changed(device, ctrls),
+            lambda errs: [logging.warning(e) for e in errs])
+
+    # called from the listener threads
+    def changed(self, device, ctrls):
+        ts = time.monotonic()
+        with self.lock:
+            for c in ctrls:
+                key = (device, c.text_id)
+                change = self.pending.get(key)
+                if change is None:
+                    change = self.pending[key] = {
+                        'ts': ts,
+                        'device': device,
+                        'control': c.text_id,
+                        'old': self.values.get(key),
+                        'new': None,
+                        'flags': [],
+                        'count': 0,
+                    }
+                change['ts'] = ts
+                change['new'] = c.value
+                change['flags'] = ctrl_flags(c)
+                change['count'] += 1
+                self.values[key] = c.value
+            if not self.window:
+                self.flush_locked()
+
+    def flush(self):
+        with self.lock:
+            self.flush_locked()
+
+    def flush_locked(self):
+        for change in self.pending.values():
+            if not self.window:
+                del change['count']
+            print(json.dumps(change), flush=True)
+        self.pending = {}
+
+    # blocks until interrupted or all the devices are gone, the listener of a
+    # disconnected device ends, returns the number of the gone devices
+    def run(self, listeners):
+        alive = dict(listeners)
+        while alive:
+            time.sleep(self.window or 1)
+            if self.window:
+                self.flush()
+            for device, l in list(alive.items()):
+                if not l.is_alive():
+                    logging.error(f'ControlWatcher: {device} is gone')
+                    del alive[device]
+        return len(listeners)
+
+def run_watch(devices, window):
+    watcher = ControlWatcher(window)
+    fds = []
+    listeners = []
+    for device in devices:
+        try:
+            fd = os.open(device, os.O_RDWR, 0)
+        except Exception as e:
+            logging.error(f'os.open({device}, os.O_RDWR, 0) failed: {e}')
+            continue
+        fds.append(fd)
+        # only the V4L2 controls have events
+        listeners.append((device, watcher.watch(device, CameraCtrls(device, fd, profile='core'))))
+
+    if not listeners:
+        return 2
+
+    gone = 0
+    try:
+        gone = watcher.run(listeners)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for device, l in listeners:
+            l.stop()
+        watcher.flush()
+        for fd in fds:
+            os.close(fd)
+    return 1 if gone else 0
+
+# a device of the ControlServer, opened on the first request and kept open
+class ServedDevice:
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.fd = -1
+        self.ino = None
+        self.camera = None
+        self.listener = None
+        self.subscribers = []
+
+    # reopens the device when it was reconnected, the node gets a new inode then
+    def open(self):
+        st = os.stat(self.path)
+        if self.camera is not None and st.st_ino == self.ino:
+            return self.camera
+        self.close()
+        self.fd = os.open(self.path, os.O_RDWR, 0)
+        self.ino = st.st_ino
+        self.camera = CameraCtrls(self.path, self.fd)
+        if self.subscribers:
+            self.start_listener()
+        return self.camera
+
+    # the reopener controls lock the device until the fd is closed
+    def reopen(self):
+        self.stop_listener()
+        os.close(self.fd)
+        self.fd = os.open(self.path, os.O_RDWR, 0)
+        if self.camera.reopen(self.fd) is None:
+            self.camera = CameraCtrls(self.path, self.fd)
+        if self.subscribers:
+            self.start_listener()
+
+    def start_listener(self):
+        if self.listener is None:
+            self.listener = self.camera.subscribe_events(self.notify, lambda errs: None)
+
+    def stop_listener(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def notify(self, ctrls):
+        msg = {'event': 'ctrls', 'device': self.path, 'controls': {c.text_id: c.value for c in ctrls}}
+        for s in list(self.subscribers):
+            if not s.send(msg):
+                # stopping the listener waits for this thread, it can't hold the lock
+                Thread(target=self.drop_subscriber, args=(s,), daemon=True).start()
+
+    def drop_subscriber(self, subscriber):
+        with self.lock:
+            self.unsubscribe(subscriber)
+
+    def subscribe(self, subscriber):
+        self.start_listener()
+        if subscriber not in self.subscribers:
+            self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+        if not self.subscribers:
+            self.stop_listener()
+
+    def close(self):
+        self.stop_listener()
+        if self.fd != -1:
+            os.close(self.fd)
+            self.fd = -1
+        self.camera = None
+
+class ControlRequestHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.wlock = Lock()
+        self.subscriptions = []
+
+    # the events are sent from the listener threads, returns False if the client is gone
+    def send(self, msg):
+        try:
+            with self.wlock:
+                self.wfile.write((json.dumps(msg) + '\n').encode())
+        except OSError:
+            return False
+        return True
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                req = json.loads(line)
+            except ValueError as e:
+                self.send({'ok': False, 'errors': [f'invalid request: {e}']})
+                continue
+            self.send(self.server.dispatch(req, self))
+
+    def finish(self):
+        for device in self.subscriptions:
+            device.drop_subscriber(self)
+        super().finish()
+
+# the client module is imported only on the code paths using the server
+def connect_server(path=None):
+    from cameractrlsclient import ControlClient
+    return ControlClient.connect(path)
+
+# holds the opened CameraCtrls of many devices for the scripts, see cameractrlsclient.py
+class ControlServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        self.path = path
+        self.devices = {}
+        self.devices_lock = Lock()
+        super().__init__(path, ControlRequestHandler)
+
+    # only the user can connect, the umask of the process is restored right after the bind
+    def server_bind(self):
+        umask = os.umask(0o077)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def get_device(self, path):
+        real_path = os.path.realpath(path)
+        with self.devices_lock:
+            device = self.devices.get(real_path)
+            if device is None:
+                device = self.devices[real_path] = ServedDevice(path)
+        return device
+
+    def dispatch(self, req, handler):
+        cmd = req.get('cmd')
+        if cmd == 'devices':
+            return {'ok': True, 'devices': [{
+                'name': d.name,
+                'path': d.path,
+                'real_path': d.real_path,
+                'driver': d.driver,
+                'usb_ids': d.usb_ids,
+            } for d in get_devices(v4ldirs)]}
+
+        if cmd not in ['get', 'set', 'list', 'snapshot', 'subscribe']:
+            return {'ok': False, 'errors': [f'unknown command: {cmd}']}
+
+        device = self.get_device(req.get('device') or '/dev/video0')
+        errs = []
+        res = {}
+        try:
+            with device.lock:
+                camera = device.open()
+                if cmd in ['get', 'list', 'snapshot']:
+                    camera.read_values()
+                if cmd == 'get':
+                    res['controls'] = {}
+                    text_ids = req.get('controls') or [c.text_id for c in camera.get_ctrls()]
+                    for text_id in text_ids:
+                        c = camera.get_ctrl_by_text_id(text_id)
+                        if c is None:
+                            collect_warning(f'ControlServer: can\'t find {text_id} control', errs)
+                            continue
+                        res['controls'][text_id] = c.value
+                elif cmd == 'set':
+                    params = req.get('controls') or {}
+                    camera.setup_ctrls(params, errs)
+                    if any(c is not None and c.reopener for c in map(camera.get_ctrl_by_text_id, params)):
+                        device.reopen()
+                elif cmd == 'list':
+                    res['pages'] = ctrl_pages_to_dicts(camera.get_ctrl_pages())
+                elif cmd == 'snapshot':
+                    res['snapshot'] = camera.get_snapshot()
+                elif cmd == 'subscribe':
+                    device.subscribe(handler)
+                    handler.subscriptions.append(device)
+        except Exception as e:
+            collect_warning(f'ControlServer: {cmd} {device.path} failed: {e}', errs)
+            return {'ok': False, 'errors': errs}
+
+        return {'ok': not errs, 'errors': errs, **res}
+
+    def server_close(self):
+        super().server_close()
+        with self.devices_lock:
+            for device in self.devices.values():
+                device.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+def run_server(path):
+    # the fallback path is in /tmp, don't take over a socket of another user
+    try:
+        st = os.lstat(path)
+        if st.st_uid != os.getuid():
+            logging.error(f'ControlServer: {path} is owned by another user')
+            return 1
+    except FileNotFoundError:
+        pass
+
+    # a socket left by a crashed server can be replaced, a running one not
+    if os.path.exists(path):
+        if connect_server(path) is not None:
+            logging.error(f'ControlServer: already running at {path}')
+            return 1
+        os.unlink(path)
+
+    server = ControlServer(path)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logging.info(f'ControlServer: listening at {path}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
 
 def usage():
-    print(f'usage: {sys.argv[0]} [--help] [-d DEVICE] [--list] [-c CONTROLS]\n')
+    print(f'usage: {sys.argv[0]} [--help] [-d DEVICE]... [--list] [--json|--ndjson] [-c CONTROLS] [--watch [--window SECONDS]]\n')
     print(f'optional arguments:')
     print(f'  -h, --help         show this help message and exit')
-    print(f'  -d DEVICE          use DEVICE, default /dev/video0')
+    print(f'  -d DEVICE          use DEVICE, default /dev/video0, can be repeated')
     print(f'  -l, --list         list the controls and values')
+    print(f'  --json             list the controls and the formats of the devices as JSON, implies --list')
+    print(f'  --ndjson           list the controls and the formats as one JSON line per device, implies --list')
     print(f'  -L, --list-devices list capture devices')
     print(f'  -c CONTROLS        set CONTROLS (eg.: hdr=on,fov=wide)')
+    print(f'  -w, --watch        print the control changes as JSON lines until interrupted')
+    print(f'  --window SECONDS   merge the changes of a control within SECONDS in --watch')
+    print(f'  --server           keep the devices open and serve the requests on $XDG_RUNTIME_DIR/cameractrls.sock')
+    print()
+    print(f'The requests go through the server when it is running.')
     print()
     print(f'example:')
     print(f'  {sys.argv[0]} -c brightness=128,kiyo_pro_hdr=on,kiyo_pro_fov=wide')
+    print(f'  {sys.argv[0]} -d /dev/video0 -d /dev/video2 --list --ndjson')
+    print(f'  {sys.argv[0]} -d /dev/video0 -d /dev/video2 --watch --window 0.5')
+
+# the server has the devices opened and enumerated already
+# one connection per device, so the server handles them in parallel
+def get_served_snapshot(device):
+    client = connect_server()
+    if client is None:
+        raise ConnectionError('can\'t connect to the server')
+    try:
+        res = client.snapshot(device)
+    finally:
+        client.close()
+    return res.get('snapshot', {'device': device, 'errors': res.get('errors', [])})
+
+def run_client(client, devices, list_controls, output, ctrlsmap):
+    ret = 0
+    if list_controls and output is not None:
+        print_snapshots(get_device_snapshots(devices, get_served_snapshot), output)
+        list_controls = False
+
+    for device in devices:
+        if list_controls:
+            res = client.list(device)
+            for e in res.get('errors', []):
+                logging.warning(e)
+            if 'pages' not in res:
+                ret = 2
+                continue
+            print_ctrl_pages(res['pages'])
+
+        if ctrlsmap:
+            res = client.set(device, ctrlsmap)
+            for e in res.get('errors', []):
+                logging.warning(e)
+
+    client.close()
+    return ret
+
+def run_local(devices, list_controls, output, ctrlsmap):
+    if list_controls and output is not None:
+        print_snapshots(get_device_snapshots(devices), output)
+        list_controls = False
+
+    ret = 0
+    for device in devices:
+        if not list_controls and not ctrlsmap:
+            break
+
+        try:
+            fd = os.open(device, os.O_RDWR, 0)
+        except Exception as e:
+            logging.error(f'os.open({device}, os.O_RDWR, 0) failed: {e}')
+            ret = 2
+            continue
+
+        camera_ctrls = CameraCtrls(device, fd)
+
+        if list_controls:
+            camera_ctrls.print_ctrls()
+
+        if ctrlsmap:
+            camera_ctrls.setup_ctrls(ctrlsmap, [])
+
+        os.close(fd)
+
+    return ret
 
 def main():
     try:
-        arguments, values = getopt.getopt(sys.argv[1:], 'hd:lLc:', ['help', 'list', 'list-devices'])
+        arguments, values = getopt.getopt(sys.argv[1:], 'hd:lLc:w', ['help', 'list', 'list-devices', 'json', 'ndjson', 'watch', 'window=', 'server'])
     except getopt.error as err:
         print(err)
         usage()
@@ -2893,48 +4472,74 @@ def main():
 
     list_controls = False
     list_devices = False
-    device = '/dev/video0'
+    devices = []
     controls = ''
+    output = None
+    watch = False
+    window = 0
+    server = False
 
     for current_argument, current_value in arguments:
         if current_argument in ('-h', '--help'):
             usage()
             sys.exit(0)
         elif current_argument in ('-d', '--device'):
-            device = current_value
+            devices.append(current_value)
         elif current_argument in ('-l', '--list'):
             list_controls = True
         elif current_argument in ('-L', '--list-devices'):
             list_devices = True
         elif current_argument in ('-c'):
             controls = current_value
+        elif current_argument in ('--json', '--ndjson'):
+            output = current_argument[2:]
+            list_controls = True
+        elif current_argument in ('-w', '--watch'):
+            watch = True
+        elif current_argument in ('--window',):
+            try:
+                window = float(current_value)
+                if not math.isfinite(window) or window < 0:
+                    raise ValueError('it must be a finite, non-negative number')
+            except ValueError:
+                print(f'invalid window: {current_value}')
+                usage()
+                sys.exit(2)
+        elif current_argument in ('--server',):
+            server = True
+
+    if server:
+        from cameractrlsclient import get_socket_path
+        sys.exit(run_server(get_socket_path()))
 
     if list_devices:
         for d in get_devices(v4ldirs):
             print(d)
         sys.exit(0)
 
-    try:
-        fd = os.open(device, os.O_RDWR, 0)
-    except Exception as e:
-        logging.error(f'os.open({device}, os.O_RDWR, 0) failed: {e}')
-        sys.exit(2)
+    if not devices:
+        devices = ['/dev/video0']
 
-    camera_ctrls = CameraCtrls(device, fd)
+    ctrlsmap = {}
+    for control in controls.split(',') if controls != '' else []:
+        kv = control.split('=', maxsplit=1)
+        if len(kv) != 2:
+            logging.warning(f'invalid value: {control}')
+            continue
+        ctrlsmap[kv[0]]=kv[1]
 
-    if list_controls:
-        camera_ctrls.print_ctrls()
+    ret = 0
+    if list_controls or ctrlsmap:
+        client = connect_server()
+        if client is not None:
+            ret = run_client(client, devices, list_controls, output, ctrlsmap)
+        else:
+            ret = run_local(devices, list_controls, output, ctrlsmap)
 
-    if controls != '':
-        ctrlsmap = {}
-        for control in controls.split(','):
-            kv = control.split('=', maxsplit=1)
-            if len(kv) != 2:
-                logging.warning(f'invalid value: {control}')
-                continue
-            ctrlsmap[kv[0]]=kv[1]
+    if watch:
+        ret = run_watch(devices, window) or ret
 
-        camera_ctrls.setup_ctrls(ctrlsmap, [])
+    sys.exit(ret)
 
 if __name__ == '__main__':
     main()
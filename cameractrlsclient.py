@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import sys, os, socket, struct, json, logging, getopt
+
+# the client imports only the standard library, so a request costs
+# a round trip to the server instead of the enumeration of the device
+
+def get_socket_path():
+    runtime_dir = os.getenv('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'cameractrls.sock')
+    return f'/tmp/cameractrls-{os.getuid()}.sock'
+
+# one JSON object per line in both directions, the events of the subscribed
+# devices come between the responses
+class ControlClient:
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+        self.events = []
+
+    # returns None if the server is not running
+    @classmethod
+    def connect(cls, path=None):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path or get_socket_path())
+            # the fallback path is in /tmp, the server has to be run by the same user
+            pid, uid, gid = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+        except OSError:
+            sock.close()
+            return None
+        if uid != os.getuid():
+            logging.warning(f'ControlClient: the server at {path or get_socket_path()} is run by another user ({uid})')
+            sock.close()
+            return None
+        return cls(sock)
+
+    def read(self):
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError('the server closed the connection')
+        return json.loads(line)
+
+    def request(self, cmd, **params):
+        self.sock.sendall((json.dumps({'cmd': cmd, **params}) + '\n').encode())
+        while True:
+            msg = self.read()
+            if 'event' not in msg:
+                return msg
+            self.events.append(msg)
+
+    def devices(self):
+        return self.request('devices').get('devices', [])
+
+    def get(self, device, controls=None):
+        return self.request('get', device=device, controls=controls)
+
+    def set(self, device, controls):
+        return self.request('set', device=device, controls=controls)
+
+    def list(self, device):
+        return self.request('list', device=device)
+
+    def snapshot(self, device):
+        return self.request('snapshot', device=device)
+
+    def subscribe(self, device):
+        return self.request('subscribe', device=device)
+
+    # yields the events of the subscribed devices
+    def read_events(self):
+        while True:
+            while self.events:
+                yield self.events.pop(0)
+            self.events.append(self.read())
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+def usage():
+    print(f'usage: {sys.argv[0]} [--help] [-d DEVICE] [-g CONTROLS] [-c CONTROLS] [--subscribe]\n')
+    print(f'optional arguments:')
+    print(f'  -h, --help         show this help message and exit')
+    print(f'  -d DEVICE          use DEVICE, default /dev/video0')
+    print(f'  -g CONTROLS        get CONTROLS (eg.: brightness,contrast)')
+    print(f'  -c CONTROLS        set CONTROLS (eg.: hdr=on,fov=wide)')
+    print(f'  -s, --subscribe    print the control changes as JSON lines')
+    print()
+    print(f'The requests are sent to the server started with: cameractrls.py --server')
+
+def main():
+    try:
+        arguments, values = getopt.getopt(sys.argv[1:], 'hd:g:c:s', ['help', 'subscribe'])
+    except getopt.error as err:
+        print(err)
+        usage()
+        return 2
+
+    device = '/dev/video0'
+    get_controls = None
+    set_controls = None
+    subscribe = False
+
+    for current_argument, current_value in arguments:
+        if current_argument in ('-h', '--help'):
+            usage()
+            return 0
+        elif current_argument in ('-d', '--device'):
+            device = current_value
+        elif current_argument in ('-g'):
+            get_controls = current_value
+        elif current_argument in ('-c'):
+            set_controls = current_value
+        elif current_argument in ('-s', '--subscribe'):
+            subscribe = True
+
+    client = ControlClient.connect()
+    if client is None:
+        logging.error(f'can\'t connect to {get_socket_path()}, is cameractrls.py --server running?')
+        return 1
+
+    ret = 0
+    if set_controls is not None:
+        ctrlsmap = {}
+        for control in set_controls.split(','):
+            kv = control.split('=', maxsplit=1)
+            if len(kv) != 2:
+                logging.warning(f'invalid value: {control}')
+                continue
+            ctrlsmap[kv[0]] = kv[1]
+        res = client.set(device, ctrlsmap)
+        for e in res.get('errors', []):
+            logging.warning(e)
+
+    if get_controls is not None:
+        res = client.get(device, get_controls.split(','))
+        for e in res.get('errors', []):
+            logging.warning(e)
+        for k, v in res.get('controls', {}).items():
+            print(f'{k}={v}')
+        if not res.get('ok'):
+            ret = 1
+
+    if subscribe:
+        res = client.subscribe(device)
+        if not res.get('ok'):
+            for e in res.get('errors', []):
+                logging.error(e)
+            return 1
+        try:
+            for e in client.read_events():
+                print(json.dumps(e), flush=True)
+        except (KeyboardInterrupt, ConnectionError):
+            pass
+
+    client.close()
+    return ret
+
+if __name__ == '__main__':
+    sys.exit(main())
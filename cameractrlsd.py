@@ -1,118 +1,211 @@
 #!/usr/bin/env python3
 
-import sys, os, ctypes, ctypes.util, logging, getopt, time
-from collections import namedtuple
-from struct import unpack_from, calcsize
-from cameractrls import CameraCtrls, find_symlink_in, get_configfilename
-
-clib = ctypes.util.find_library('c')
-if clib is None:
-    logging.error('libc not found, please install the libc package!')
-    sys.exit(2)
-c = ctypes.CDLL(clib)
+import sys, os, logging, getopt, time, select, configparser
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from cameractrls import CameraCtrls, get_configfilename, get_configdir
+from cameractrls import inotify_init1, inotify_add_watch, parse_inotify_events, INOTIFY_EVENT_SIZE, NAME_MAX
+from cameractrls import IN_CREATE, IN_DELETE, IN_CLOSE_WRITE, IN_MOVED_TO, IN_IGNORED
 
 logging.getLogger().setLevel(logging.INFO)
 
-inotify_init1 = c.inotify_init1
-inotify_init1.restype = ctypes.c_int
-inotify_init1.argtypes = [ctypes.c_int]
-# int inotify_init1(int flags);
-
-inotify_add_watch = c.inotify_add_watch
-inotify_add_watch.restype = ctypes.c_int
-inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
-# int inotify_add_watch(int fd, const char *pathname, uint32_t mask);
-
-inotify_rm_watch = c.inotify_rm_watch
-inotify_rm_watch.restypes = ctypes.c_int
-inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
-# int inotify_rm_watch(int fd, int wd);
-
-IN_CLOEXEC = os.O_CLOEXEC
-IN_NONBLOCK = os.O_NONBLOCK
-
-IN_ACCESS =	0x00000001 # File was accessed
-IN_MODIFY =	0x00000002 # File was modified
-IN_ATTRIB =	0x00000004 # Metadata changed
-IN_CLOSE_WRITE = 0x00000008 # Writable file was closed
-IN_CLOSE_NOWRITE = 0x00000010 # Unwritable file closed
-IN_OPEN	= 0x00000020 # File was opened
-IN_MOVED_FROM = 0x00000040 # File was moved from X
-IN_MOVED_TO = 0x00000080 # File was moved to Y
-IN_CREATE = 0x00000100 # Subfile was created
-IN_DELETE = 0x00000200 # Subfile was deleted
-IN_DELETE_SELF = 0x00000400 # Self was deleted
-IN_MOVE_SELF = 0x00000800 # Self was moved
-
-IN_ALL_EVENTS = ( \
-    IN_ACCESS | IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | \
-    IN_CLOSE_NOWRITE | IN_OPEN | IN_MOVED_FROM | \
-    IN_MOVED_TO | IN_DELETE | IN_CREATE | IN_DELETE_SELF | \
-    IN_MOVE_SELF \
-)
-
-IN_UNMOUNT = 0x00002000 # Backing fs was unmounted
-IN_Q_OVERFLOW = 0x00004000 # Event queued overflowed
-IN_IGNORED = 0x00008000 # File was ignored
-
-IN_CLOSE = (IN_CLOSE_WRITE | IN_CLOSE_NOWRITE)
-IN_MOVE	= (IN_MOVED_FROM | IN_MOVED_TO)
-
-IN_ONLYDIR = 0x01000000 # only watch the path if it is a directory
-IN_DONT_FOLLOW = 0x02000000 # don't follow a sym link
-IN_EXCL_UNLINK = 0x04000000 # exclude events on unlinked objects
-IN_MASK_CREATE = 0x10000000 # only create watches
-IN_MASK_ADD = 0x20000000 # add to the mask of an already existing watch
-IN_ISDIR = 0x40000000 # event occurred against dir
-IN_ONESHOT = 0x80000000 # only send event once
-
-NAME_MAX = 255
+# the presets of the different cameras are applied in parallel
+PRESET_WORKERS = 4
+# udev creates the symlinks right after the device node, this is only the fallback
+UDEV_TIMEOUT = 5.0
 
 def usage():
     print(f'usage: {sys.argv[0]} [--help]\n')
     print(f'optional arguments:')
     print(f'  -h, --help         show this help message and exit')
 
-def preset_device(device):
-    logging.debug(f'trying to preset_device: {device}')
-
-    configfile = get_configfilename(device)
-
-    # if config file does not exists, we should not open the device
-    if not os.path.exists(configfile):
-        logging.debug(f'preset_device: {configfile} does not exists')
-        return
-
-    logging.info(f'preset_device: {device}')
-
-    try:
-        fd = os.open(device, os.O_RDWR, 0)
-    except Exception as e:
-        logging.warning(f'os.open({device}, os.O_RDWR, 0) failed: {e}')
-        return
-
-    errs = []
-
-    camera_ctrls = CameraCtrls(device, fd)
-    camera_ctrls.setup_ctrls({'preset': 'load_1'}, errs)
-    if errs:
-        logging.warning(f'preset_device: failed to load_1: {errs}')
-
-    os.close(fd)
-
-Event = namedtuple('Event', ['wd', 'mask', 'cookie', 'namesize', 'name'])
-EVENT_FMT = 'iIII'
-EVENT_SIZE = calcsize(EVENT_FMT)
-
-def parse_events(data):
-    pos = 0
-    events = []
-    while pos < len(data):
-        wd, mask, cookie, namesize = unpack_from(EVENT_FMT, data, pos)
-        pos += EVENT_SIZE + namesize
-        name = data[pos - namesize : pos].split(b'\x00', 1)[0]
-        events.append(Event(wd, mask, cookie, namesize, name.decode()))
-    return events
+# the warm state of a connected camera: the controls with their cached capabilities
+# and the applied preset, the device is opened only while applying the changed keys
+class CameraState:
+    def __init__(self, device, links):
+        self.device = device
+        self.link = links[0]
+        # the preset is read from the first symlink which has a config file
+        self.configfiles = [get_configfilename(l) for l in links]
+        self.camera = None
+        self.preset = {}
+        # the values of the applied keys as the device reported them
+        self.values = {}
+        self.lock = Lock()
+
+    def load_preset(self):
+        for filename in self.configfiles:
+            if not os.path.exists(filename):
+                continue
+            config = configparser.ConfigParser()
+            try:
+                config.read(filename)
+            except configparser.Error as e:
+                logging.warning(f'CameraState: can\'t parse {filename}: {e}')
+                return None
+            if 'preset_1' not in config:
+                return {}
+            return dict(config['preset_1'])
+        return {}
+
+    def apply(self):
+        with self.lock:
+            preset = self.load_preset()
+            if preset is None:
+                return
+            changed = {k: v for k, v in preset.items() if self.preset.get(k) != v}
+            # if the config file does not exist, we should not open the device
+            if not changed:
+                logging.debug(f'CameraState: nothing to apply to {self.link}')
+                return
+
+            try:
+                fd = os.open(self.device, os.O_RDWR, 0)
+            except Exception as e:
+                logging.warning(f'os.open({self.device}, os.O_RDWR, 0) failed: {e}')
+                return
+
+            if self.camera is None:
+                self.camera = CameraCtrls(self.link, fd)
+            else:
+                self.camera.set_fd(fd)
+                # the device can lose the applied values meanwhile (eg: set by another app)
+                self.camera.read_values()
+                for k, v in self.values.items():
+                    ctrl = self.camera.get_ctrl_by_text_id(k)
+                    if k in preset and ctrl is not None and ctrl.value != v:
+                        changed.setdefault(k, preset[k])
+
+            logging.info(f'CameraState: applying {", ".join(changed)} to {self.link}')
+            errs = []
+            failed = self.camera.setup_ctrls(changed, errs)
+            if errs:
+                logging.warning(f'CameraState: failed to apply preset_1 to {self.link}: {errs}')
+            # the failed keys are left out of the applied preset, so the next change retries them
+            for k in changed:
+                ctrl = self.camera.get_ctrl_by_text_id(k)
+                if k in failed:
+                    del preset[k]
+                    self.values.pop(k, None)
+                elif ctrl is not None:
+                    self.values[k] = ctrl.value
+            os.close(fd)
+            self.preset = preset
+            self.values = {k: v for k, v in self.values.items() if k in preset}
+
+    def watches(self, filename):
+        return any(os.path.basename(f) == filename for f in self.configfiles)
+
+# returns the symlinks by the real device path, in the order of v4l_paths
+def find_symlinks(v4l_paths):
+    links = {}
+    for v4l_path in v4l_paths:
+        if not os.path.isdir(v4l_path):
+            continue
+        for p in os.scandir(v4l_path):
+            if p.is_symlink():
+                links.setdefault(os.path.realpath(p.path), []).append(p.path)
+    return links
+
+def submit_apply(pool, state):
+    pool.submit(state.apply).add_done_callback(lambda f: log_apply_error(state, f))
+
+def log_apply_error(state, future):
+    e = future.exception()
+    if e is not None:
+        logging.error(f'CameraState.apply({state.link}) failed: {e}')
+
+# the saved presets are picked up without restarting the daemon
+class ConfigWatcher:
+    def __init__(self, configdir):
+        self.configdir = configdir
+        self.fd = inotify_init1(0)
+        if self.fd == -1:
+            logging.warning(f'ConfigWatcher: inotify_init1 failed')
+            return
+        try:
+            os.makedirs(configdir, mode=0o755, exist_ok=True)
+        except Exception as e:
+            logging.warning(f'ConfigWatcher: can\'t create {configdir}: {e}')
+        if inotify_add_watch(self.fd, configdir.encode(), IN_CLOSE_WRITE | IN_MOVED_TO) == -1:
+            logging.warning(f'ConfigWatcher: inotify_add_watch failed {configdir}')
+
+    # returns the names of the changed .ini files
+    def read_events(self):
+        data = os.read(self.fd, 64 * (INOTIFY_EVENT_SIZE + NAME_MAX + 1))
+        return {e.name for e in parse_inotify_events(data) if e.name.endswith('.ini')}
+
+# waits for the udev symlinks of the new video nodes with inotify instead of sleeping
+class SymlinkWatcher:
+    def __init__(self, dev_path, v4l_path, v4l_paths):
+        self.dev_path = dev_path
+        self.v4l_path = v4l_path
+        self.v4l_paths = v4l_paths
+        self.wds = {}
+        self.pending = {}
+        self.fd = inotify_init1(0)
+        if self.fd == -1:
+            return
+        for path in [dev_path, v4l_path] + v4l_paths:
+            self.watch(path)
+
+    def watch(self, path):
+        path = path.rstrip('/')
+        if path in self.wds.values() or not os.path.isdir(path):
+            return
+        mask = IN_CREATE | IN_DELETE if path == self.dev_path else IN_CREATE
+        wd = inotify_add_watch(self.fd, path.encode(), mask)
+        if wd == -1:
+            logging.error(f'inotify_add_watch failed {path}')
+            return
+        self.wds[wd] = path
+
+    def timeout(self):
+        if not self.pending:
+            return None
+        return max(0, min(self.pending.values()) - time.monotonic())
+
+    # returns the removed video nodes
+    def read_events(self):
+        removed = []
+        data = os.read(self.fd, 64 * (INOTIFY_EVENT_SIZE + NAME_MAX + 1))
+        for e in parse_inotify_events(data):
+            logging.debug(f'event: {e}')
+            path = self.wds.get(e.wd)
+            # udev removes the dirs with the last camera
+            if e.mask & IN_IGNORED:
+                self.wds.pop(e.wd, None)
+            elif path == self.dev_path and e.name.startswith('video') and e.mask & IN_DELETE:
+                device = os.path.join(self.dev_path, e.name)
+                self.pending.pop(device, None)
+                removed.append(device)
+            elif path == self.dev_path and e.name.startswith('video'):
+                self.pending[os.path.join(self.dev_path, e.name)] = time.monotonic() + UDEV_TIMEOUT
+            elif path == self.dev_path and e.name == os.path.basename(self.v4l_path) or path == self.v4l_path:
+                # the dirs are created with the first camera
+                for p in [self.v4l_path] + self.v4l_paths:
+                    self.watch(p)
+        return removed
+
+    # returns the video nodes with their symlinks when they have one in every v4l_paths dir,
+    # or when they timed out
+    def take_ready(self):
+        if not self.pending:
+            return []
+        links = find_symlinks(self.v4l_paths)
+        dirs = {p.rstrip('/') for p in self.v4l_paths if os.path.isdir(p)}
+        now = time.monotonic()
+        ready = []
+        for device, deadline in list(self.pending.items()):
+            dev_links = links.get(device, [])
+            if (not dev_links or not dirs <= {os.path.dirname(l) for l in dev_links}) and now < deadline:
+                continue
+            del self.pending[device]
+            if not dev_links:
+                logging.warning(f'can\'t find {device} in {self.v4l_paths}')
+                continue
+            ready.append((device, dev_links))
+        return ready
 
 def main():
     try:
@@ -128,34 +221,47 @@ def main():
             return 0
 
     dev_path = '/dev'
+    v4l_path = '/dev/v4l'
     v4l_paths = ['/dev/v4l/by-id/', '/dev/v4l/by-path/']
 
-    for v4l_path in v4l_paths:
-        for dirpath, dirs, files in os.walk(v4l_path):
-            for device in files:
-                preset_device(os.path.join(v4l_path, device))
-
-    fd = inotify_init1(0)
-    if fd == -1:
+    # watching before the first scan, so no camera is missed in between
+    watcher = SymlinkWatcher(dev_path, v4l_path, v4l_paths)
+    if watcher.fd == -1:
         logging.error(f'inotify_init1 failed')
         return 1
-
-    wd = inotify_add_watch(fd, dev_path.encode(), IN_CREATE)
-    if wd == -1:
+    if dev_path not in watcher.wds.values():
         logging.error(f'inotify_add_watch failed {dev_path}')
         return 1
 
+    config_watcher = ConfigWatcher(get_configdir())
+    pool = ThreadPoolExecutor(max_workers=PRESET_WORKERS)
+    states = {}
+
+    def add_camera(device, links):
+        states[device] = CameraState(device, links)
+        submit_apply(pool, states[device])
+
+    for device, links in find_symlinks(v4l_paths).items():
+        add_camera(device, links)
+
+    poll = select.poll()
+    poll.register(watcher.fd, select.POLLIN)
+    if config_watcher.fd != -1:
+        poll.register(config_watcher.fd, select.POLLIN)
     while True:
-        data = os.read(fd, EVENT_SIZE + NAME_MAX + 1)
-        for e in parse_events(data):
-            logging.debug(f'event: {e}')
-            if e.name.startswith('video'):
-                time.sleep(2) # waiting for udev to create dirs
-                path = find_symlink_in(os.path.join(dev_path, e.name), v4l_paths)
-                if path is None:
-                    logging.warning(f'can\'t find {e.name} in {v4l_paths}')
-                    continue
-                preset_device(path.path)
+        timeout = watcher.timeout()
+        for fd, event in poll.poll(None if timeout is None else timeout * 1000):
+            if fd == watcher.fd:
+                for device in watcher.read_events():
+                    states.pop(device, None)
+            elif fd == config_watcher.fd:
+                for filename in config_watcher.read_events():
+                    logging.debug(f'config changed: {filename}')
+                    for state in states.values():
+                        if state.watches(filename):
+                            submit_apply(pool, state)
+        for device, links in watcher.take_ready():
+            add_camera(device, links)
 
 if __name__ == '__main__':
     sys.exit(main())
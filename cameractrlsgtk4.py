@@ -3,6 +3,7 @@
 import os, sys, logging, subprocess
 import gi
 from cameractrls import CameraCtrls, PTZHWControllers, find_by_text_id, get_devices, v4ldirs, find_idx
+from cameractrls import DeviceMonitor, DeviceWorker, diff_devices, apply_device_diff
 from cameractrls import version, ghurl
 
 gi.require_version('Gtk', '4.0')
@@ -15,15 +16,22 @@ class CameraCtrlsWindow(Gtk.ApplicationWindow):
         super().__init__(*args, **kwargs)
         self.devices = []
         
-        self.fd = 0
+        self.opened = None
         self.device = None
         self.camera = None
         self.listener = None
+        self.writer = None
         self.ptz_controllers = None
+        self.updating_widgets = False
+        self.worker = DeviceWorker(GLib.idle_add)
+        self.worker.start()
+        self.pending_jobs = 0
+        self.open_seq = 0
 
         self.grid = None
         self.frame = None
         self.device_dd = None
+        self.updating_devices = False
 
         self.zoom_absolute_sc = None
         self.pan_speed_sc = None
@@ -33,6 +41,7 @@ class CameraCtrlsWindow(Gtk.ApplicationWindow):
 
         self.init_window()
         self.refresh_devices()
+        self.init_device_monitor()
 
     def init_window(self):
         css_provider = Gtk.CssProvider()
@@ -136,8 +145,11 @@ class CameraCtrlsWindow(Gtk.ApplicationWindow):
         refresh_button = Gtk.Button(icon_name='view-refresh-symbolic', has_frame=False, tooltip_text='Refresh')
         refresh_button.connect('clicked', lambda e: self.refresh_devices())
 
+        self.spinner = Gtk.Spinner(tooltip_text='Waiting for the camera')
+
         headerbar = Gtk.HeaderBar(show_title_buttons=True)
         headerbar.pack_start(refresh_button)
+        headerbar.pack_start(self.spinner)
         headerbar.pack_end(about_button)
         headerbar.pack_end(self.open_cam_button)
         headerbar.pack_end(self.ptz_sw)
@@ -185,7 +197,7 @@ class CameraCtrlsWindow(Gtk.ApplicationWindow):
 
         self.set_child(overlay)
 
-        self.connect('close-request', lambda w: self.close_device())
+        self.connect('close-request', lambda w: self.close_window())
 
     def refresh_devices(self):
         logging.info('refresh_devices')
@@ -204,6 +216,9 @@ class CameraCtrlsWindow(Gtk.ApplicationWindow):
                 idx = self.devices.index(self.device)
             self.device_dd.set_selected(idx)
 
+        self.update_devices_visibility()
+
+    def update_devices_visibility(self):
         if len(self.devices) == 0:
             self.zero_box.set_visible(True)
             self.device_dd.set_visible(False)
@@ -213,42 +228,171 @@ class CameraCtrlsWindow(Gtk.ApplicationWindow):
             self.device_dd.set_visible(True)
             self.open_cam_button.set_visible(True)
 
+    def init_device_monitor(self):
+        self.hotplug_timeout = None
+        self.device_monitor = DeviceMonitor()
+        if self.device_monitor.fileno() != -1:
+            GLib.unix_fd_add_full(GLib.PRIORITY_DEFAULT, self.device_monitor.fileno(), GLib.IOCondition.IN, lambda fd, cond: self.on_device_events())
+
+    def on_device_events(self):
+        if self.device_monitor.read_events():
+            # udev creates the by-id links a bit later, wait for it to settle
+            if self.hotplug_timeout:
+                GLib.source_remove(self.hotplug_timeout)
+            self.hotplug_timeout = GLib.timeout_add(500, self.update_devices)
+        return GLib.SOURCE_CONTINUE
+
+    # applies only the added and removed cameras, the open one is left alone
+    def update_devices(self):
+        self.hotplug_timeout = None
+        removed, added = diff_devices(self.devices, get_devices(v4ldirs))
+        if len(removed) == 0 and len(added) == 0:
+            return GLib.SOURCE_REMOVE
+
+        logging.info(f'update_devices: removed: {len(removed)}, added: {len(added)}')
+        device_removed = self.device in removed
+        model = self.device_dd.get_model()
+        # the dropdown moves its selection along, it must not reopen the device
+        self.updating_devices = True
+        apply_device_diff(self.devices, removed, added,
+            lambda i: model.remove(i),
+            lambda i, d: model.splice(i, 0, [d.name]),
+        )
+
+        if device_removed:
+            self.close_device()
+            if len(self.devices):
+                self.device_dd.set_selected(0)
+                self.updating_devices = False
+                self.gui_open_device(0)
+            else:
+                self.init_gui_device()
+        elif self.device:
+            self.device_dd.set_selected(self.devices.index(self.device))
+        self.updating_devices = False
+
+        self.update_devices_visibility()
+        return GLib.SOURCE_REMOVE
+
     def gui_open_device(self, id):
         logging.info('gui_open_device')
-        # if the selection is empty
-        if id == Gtk.INVALID_LIST_POSITION:
+        # if the selection is empty or it is moved by update_devices
+        if id == Gtk.INVALID_LIST_POSITION or self.updating_devices:
             return
 
         self.close_device()
-        self.open_device(self.devices[id])
         self.init_gui_device()
+        device = self.devices[id]
+        opened = {'fd': None, 'listener': None, 'writer': None, 'ptz_controllers': None}
+        self.opened = opened
+        self.run_job(lambda: self.load_device(device, opened), lambda camera: self.open_device(device, camera))
 
+    # the fd must be reopened after the reopener controls, but the widgets are only rebuilt
+    # if the controls themselves changed, otherwise only the changed ones are updated
     def reopen_device(self):
-        opened_page = self.stack.get_visible_child_name()
-        device = self.device
-        self.close_device()
-        self.open_device(device)
-        self.init_gui_device()
-        self.stack.set_visible_child_full(opened_page, Gtk.StackTransitionType.NONE)
+        if self.camera is None:
+            return
+        if self.frame:
+            self.frame.set_sensitive(False)
+        device, camera, opened = self.device, self.camera, self.opened
+        self.run_job(lambda: self.reopen_fd(device, camera, opened), self.device_reopened, self.reopen_failed)
 
-    def open_device(self, device):
-        logging.info(f'opening device: {device.path}')
+    # on the device worker
+    def reopen_fd(self, device, camera, opened):
+        fd = os.open(device.path, os.O_RDWR, 0)
         try:
-            self.fd = os.open(device.path, os.O_RDWR, 0)
-        except Exception as e:
-            logging.error(f'os.open({device.path}, os.O_RDWR, 0) failed: {e}')
+            opened['listener'].stop()
+            opened['writer'].stop()
+            os.close(opened['fd'])
+            opened['fd'] = fd
+            return camera.reopen(fd)
+        finally:
+            if opened['fd'] != fd:
+                os.close(fd)
+            # the controls must work also after a failed re-query
+            opened['listener'] = self.subscribe_events(camera)
+            opened['writer'] = self.control_writer(camera)
+
+    def device_reopened(self, changed):
+        self.listener = self.opened['listener']
+        self.writer = self.opened['writer']
+        self.frame.set_sensitive(True)
+
+        if changed is None or not self.update_ctrl_widgets(changed):
+            logging.info('reopen_device: rebuilding the controls')
+            self.init_gui_device(self.stack.get_visible_child_name())
+            return
+
+        self.update_ctrls_state()
+
+    def reopen_failed(self, e):
+        self.listener = self.opened['listener']
+        self.writer = self.opened['writer']
+        self.frame.set_sensitive(True)
+        self.notify(f'Can\'t reopen {self.device.path}: {e}')
+
+    # runs job on the device worker, cb gets its result on the main loop unless the device is closed meanwhile
+    def run_job(self, job, cb, err_cb=None):
+        self.pending_jobs += 1
+        self.spinner.start()
+        seq = self.open_seq
+        self.worker.submit(job,
+            lambda result: self.job_done(seq, cb, result),
+            lambda e: self.job_done(seq, err_cb or self.job_failed, e),
+        )
+
+    def job_done(self, seq, cb, result):
+        self.pending_jobs -= 1
+        if self.pending_jobs == 0:
+            self.spinner.stop()
+        if seq == self.open_seq:
+            cb(result)
+        return GLib.SOURCE_REMOVE
+
+    def job_failed(self, e):
+        self.notify(str(e))
+
+    def close_window(self):
+        self.close_device()
+        # a hung camera must not keep the app open
+        self.worker.stop(2)
+        return False
 
-        self.camera = CameraCtrls(device.path, self.fd)
-        self.listener = self.camera.subscribe_events(
-            lambda c: GLib.idle_add(self.update_ctrl_value, c),
+    def subscribe_events(self, camera):
+        return camera.subscribe_events(
+            lambda ctrls: GLib.idle_add(self.update_ctrl_values, ctrls),
             lambda errs: GLib.idle_add(self.notify, '\n'.join(errs)),
         )
-        self.device = device
-        self.ptz_controllers = PTZHWControllers(self.device.path,
+
+    def control_writer(self, camera):
+        return camera.control_writer(
+            lambda params: GLib.idle_add(self.update_written_ctrls, params),
+            lambda errs: GLib.idle_add(self.notify, '\n'.join(errs)),
+        )
+
+    # on the device worker, opened holds what close_device has to release
+    def load_device(self, device, opened):
+        logging.info(f'opening device: {device.path}')
+        opened['fd'] = os.open(device.path, os.O_RDWR, 0)
+        camera = CameraCtrls(device.path, opened['fd'])
+        # enumerates the controls and loads the lazy providers here
+        camera.get_ctrl_pages()
+        opened['listener'] = self.subscribe_events(camera)
+        opened['writer'] = self.control_writer(camera)
+        # runs the PTZ helpers with -l
+        opened['ptz_controllers'] = PTZHWControllers(device.path,
             lambda check, p, i: GLib.timeout_add(300, check, p, i),
             lambda err: self.notify(err),
             lambda i: self.ptz_lb.get_row_at_index(i).get_child().set_active(False),
         )
+        return camera
+
+    def open_device(self, device, camera):
+        self.device = device
+        self.camera = camera
+        self.listener = self.opened['listener']
+        self.writer = self.opened['writer']
+        self.ptz_controllers = self.opened['ptz_controllers']
         self.ptz_model.splice(0, self.ptz_model.get_n_items(), self.ptz_controllers.get_names())
         for i in range(self.ptz_model.get_n_items()):
             row = self.ptz_lb.get_row_at_index(i)
@@ -258,20 +402,35 @@ class CameraCtrlsWindow(Gtk.ApplicationWindow):
         self.ptz_sw.set_visible(self.camera.has_ptz())
         self.ptz_sw.set_sensitive(self.ptz_model.get_n_items() != 0)
         self.open_cam_button.set_action_target_value(GLib.Variant('s', self.device.path))
+        self.init_gui_device()
 
     def close_device(self):
-        if self.fd:
-            logging.info('close_device')    
-            self.device = None
-            self.camera = None
-            self.listener.stop()
-            self.listener = None
-            self.ptz_controllers.terminate_all()
-            self.ptz_controllers = None
-            os.close(self.fd)
-            self.fd = 0
-
-    def init_gui_device(self):
+        if self.opened is None:
+            return
+        logging.info('close_device')
+        # the results of the pending jobs are dropped
+        self.open_seq += 1
+        opened = self.opened
+        self.opened = None
+        self.device = None
+        self.camera = None
+        self.listener = None
+        self.writer = None
+        self.ptz_controllers = None
+        self.worker.submit(lambda: self.release_device(opened))
+
+    # on the device worker
+    def release_device(self, opened):
+        if opened['listener']:
+            opened['listener'].stop()
+        if opened['writer']:
+            opened['writer'].stop()
+        if opened['ptz_controllers']:
+            opened['ptz_controllers'].terminate_all()
+        if opened['fd'] is not None:
+            os.close(opened['fd'])
+
+    def init_gui_device(self, opened_page=None):
         if self.frame:
             self.grid.remove(self.frame)
             self.frame = None
@@ -296,215 +455,257 @@ class CameraCtrlsWindow(Gtk.ApplicationWindow):
         self.frame.attach(stack_box, 0, 1, 1, 1)
         self.stack = stack
 
+        # the main pages are built on their first display, until then their ctrls have no widgets
+        self.unbuilt_pages = {}
+        for c in self.camera.get_ctrls():
+            self.init_gui_ctrl(c)
+        self.zoom_absolute_sc = None
+        self.pan_speed_sc = None
+        self.tilt_speed_sc = None
+        self.pan_absolute_sc = None
+        self.tilt_absolute_sc = None
+
         for page_n, page in enumerate(self.camera.get_ctrl_pages()):
             page_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
             if page.target == 'main':
                 stack.add_titled(page_box, str(page_n), page.title)
+                self.unbuilt_pages[str(page_n)] = (page_box, page)
             elif page.target == 'footer':
                 sep = Gtk.Separator(margin_bottom=10)
                 footer.append(sep)
                 footer.append(page_box)
+                self.init_gui_page(page_box, page)
 
-            for cat in page.categories:
-                if page.target != 'footer':
-                    c_label = Gtk.Label(xalign=0, margin_bottom=10, margin_top=10)
-                    c_label.set_markup(f'<b>{cat.title}</b>')
-                    page_box.append(c_label)
-                
-                ctrls_frame = Gtk.Frame()
-                page_box.append(ctrls_frame)
-
-                ctrls_listbox = Gtk.ListBox(selection_mode=Gtk.SelectionMode.NONE)
-                ctrls_listbox.set_header_func(lambda row, before: row.set_header(Gtk.Separator()) if before is not None else None)
-                ctrls_frame.set_child(ctrls_listbox)
-
-                for c in cat.ctrls:
-                    ctrl_row = Gtk.ListBoxRow()
-                    ctrls_listbox.append(ctrl_row)
-
-                    ctrl_box = Gtk.Box(margin_start=5, margin_end=5, height_request=45)
-                    ctrl_row.set_child(ctrl_box)
-
-                    label = Gtk.Label(label=c.name, xalign=0, margin_end=5)
-                    tooltip_markup = f'<b>{c.text_id}</b>'
-                    if c.kernel_id:
-                        tooltip_markup += f'  <b>({c.kernel_id})</b>'
-                    if c.tooltip:
-                        tooltip_markup += f'\n\n{c.tooltip}'
-                    label.set_tooltip_markup(tooltip_markup)
-                    ctrl_box.append(label)
-
-                    c.gui_ctrls = [label]
-                    c.gui_value_set = None
-
-                    if c.type == 'integer':
-                        adjustment = Gtk.Adjustment(lower=c.min, upper=c.max, value=c.value, step_increment=1)
-                        adjustment.connect('value-changed', lambda a,c=c: self.update_ctrl(c, a.get_value()))
-                        scale = Gtk.Scale(orientation=Gtk.Orientation.HORIZONTAL, hexpand=True, halign=Gtk.Align.END,
-                            digits=0, has_origin=False, draw_value=True, value_pos=Gtk.PositionType.LEFT, adjustment=adjustment, width_request=264)
-                        if c.zeroer:
-                            for controller in scale.observe_controllers():
-                                if isinstance(controller, gi.repository.Gtk.GestureClick):
-                                    controller.connect('released', lambda c, n, x, y, sc=scale: sc.set_value(0))
-                                if isinstance(controller, gi.repository.Gtk.EventControllerKey):
-                                    controller.connect('key-pressed', self.handle_ptz_speed_key_pressed)
-                                    controller.connect('key-released', self.handle_ptz_speed_key_released)
-                        if c.step and c.step != 1:
-                            adjustment_step = Gtk.Adjustment(lower=c.min, upper=c.max, value=c.value, step_increment=c.step)
-                            adjustment_step.connect('value-changed', lambda a,c=c,a1=adjustment: [a.set_value(a.get_value() - a.get_value() % c.step),a1.set_value(a.get_value())])
-                            scale.set_adjustment(adjustment_step)
-                        if c.step_big:
-                            scale.get_adjustment().set_page_increment(c.step_big)
-                        if c.scale_class:
-                            scale.add_css_class(c.scale_class)
-                        if c.format_value:
-                            scale.set_format_value_func(c.format_value)
-
-                        if c.default is not None:
-                            scale.add_mark(value=c.default, position=Gtk.PositionType.BOTTOM, markup=None)
-
-                        if c.text_id == 'zoom_absolute':
-                            self.zoom_absolute_sc = scale
-
-                        if c.text_id == 'pan_speed':
-                            self.pan_speed_sc = scale
-
-                        if c.text_id == 'tilt_speed':
-                            self.tilt_speed_sc = scale
-
-                        if c.text_id == 'pan_absolute':
-                            self.pan_absolute_sc = scale
-
-                        if c.text_id == 'tilt_absolute':
-                            self.tilt_absolute_sc = scale
+        self.update_ctrls_state()
+        if opened_page is not None:
+            stack.set_visible_child_full(opened_page, Gtk.StackTransitionType.NONE)
+        self.init_visible_page()
+        stack.connect('notify::visible-child', lambda s, _: self.init_visible_page())
+        self.resize_to_content()
 
-                        if c.text_id in ['pan_absolute', 'tilt_absolute']:
-                            for controller in scale.observe_controllers():
-                                if isinstance(controller, gi.repository.Gtk.EventControllerKey):
-                                    controller.connect('key-pressed', self.handle_ptz_absolute_key_pressed)
+    def resize_to_content(self):
+        _, natsize = self.get_preferred_size()
+        self.set_default_size(natsize.width, natsize.height)
 
-                        refresh = Gtk.Button(icon_name='edit-undo-symbolic', valign=Gtk.Align.CENTER, halign=Gtk.Align.START, has_frame=False)
-                        refresh.connect('clicked', lambda e, c=c, sc=scale: sc.get_adjustment().set_value(c.default))
-                        ctrl_box.append(refresh)
-                        scale_stack = Gtk.Stack(transition_type=Gtk.StackTransitionType.SLIDE_LEFT_RIGHT, transition_duration=500)
-                        scale_box = Gtk.Box(halign=Gtk.Align.END)
-                        spin_box = Gtk.Box(halign=Gtk.Align.END)
-                        prev_button = Gtk.Button(icon_name='go-previous-symbolic', has_frame=False, opacity=0.2)
-                        prev_button.connect('clicked', lambda e, st=scale_stack, sc=scale_box: st.set_visible_child(sc))
-                        next_button = Gtk.Button(icon_name='go-next-symbolic', has_frame=False, opacity=0.2)
-                        next_button.connect('clicked', lambda e, st=scale_stack, sp=spin_box: st.set_visible_child(sp))
-                        scale_box.append(scale)
-                        scale_box.append(next_button)
-                        spin = Gtk.SpinButton(adjustment=scale.get_adjustment())
-                        spin_box.append(spin)
-                        spin_box.append(prev_button)
-                        scale_stack.add_child(scale_box)
-                        scale_stack.add_child(spin_box)
-                        ctrl_box.append(scale_stack)
-                        c.gui_value_set = scale.set_value
-                        c.gui_ctrls += [scale, spin, refresh]
-                        c.gui_default_btn = refresh
+    def init_visible_page(self):
+        name = self.stack.get_visible_child_name()
+        if name not in self.unbuilt_pages:
+            return
+        page_box, page = self.unbuilt_pages.pop(name)
+        self.init_gui_page(page_box, page)
+        for cat in page.categories:
+            for c in cat.ctrls:
+                self.update_ctrl_state(c)
+        self.resize_to_content()
+
+    def init_gui_ctrl(self, c):
+        c.gui_ctrls = []
+        c.gui_value_set = None
+        c.gui_range_set = None
+        c.gui_menu_set = None
+        c.gui_menu = None
+        c.gui_default_btn = None
+
+    def init_gui_page(self, page_box, page):
+        for cat in page.categories:
+            if page.target != 'footer':
+                c_label = Gtk.Label(xalign=0, margin_bottom=10, margin_top=10)
+                c_label.set_markup(f'<b>{cat.title}</b>')
+                page_box.append(c_label)
+                
+            ctrls_frame = Gtk.Frame()
+            page_box.append(ctrls_frame)
+
+            ctrls_listbox = Gtk.ListBox(selection_mode=Gtk.SelectionMode.NONE)
+            ctrls_listbox.set_header_func(lambda row, before: row.set_header(Gtk.Separator()) if before is not None else None)
+            ctrls_frame.set_child(ctrls_listbox)
+
+            for c in cat.ctrls:
+                ctrl_row = Gtk.ListBoxRow()
+                ctrls_listbox.append(ctrl_row)
+
+                ctrl_box = Gtk.Box(margin_start=5, margin_end=5, height_request=45)
+                ctrl_row.set_child(ctrl_box)
+
+                label = Gtk.Label(label=c.name, xalign=0, margin_end=5)
+                tooltip_markup = f'<b>{c.text_id}</b>'
+                if c.kernel_id:
+                    tooltip_markup += f'  <b>({c.kernel_id})</b>'
+                if c.tooltip:
+                    tooltip_markup += f'\n\n{c.tooltip}'
+                label.set_tooltip_markup(tooltip_markup)
+                ctrl_box.append(label)
+
+                c.gui_ctrls = [label]
+                c.gui_menu = [m.text_id for m in c.menu] if c.menu else None
+
+                if c.type == 'integer':
+                    adjustment = Gtk.Adjustment(lower=c.min, upper=c.max, value=c.value, step_increment=1)
+                    adjustment.connect('value-changed', lambda a,c=c: self.update_ctrl(c, a.get_value()))
+                    scale = Gtk.Scale(orientation=Gtk.Orientation.HORIZONTAL, hexpand=True, halign=Gtk.Align.END,
+                        digits=0, has_origin=False, draw_value=True, value_pos=Gtk.PositionType.LEFT, adjustment=adjustment, width_request=264)
+                    if c.zeroer:
+                        for controller in scale.observe_controllers():
+                            if isinstance(controller, gi.repository.Gtk.GestureClick):
+                                controller.connect('released', lambda c, n, x, y, sc=scale: sc.set_value(0))
+                            if isinstance(controller, gi.repository.Gtk.EventControllerKey):
+                                controller.connect('key-pressed', self.handle_ptz_speed_key_pressed)
+                                controller.connect('key-released', self.handle_ptz_speed_key_released)
+                    if c.step and c.step != 1:
+                        adjustment_step = Gtk.Adjustment(lower=c.min, upper=c.max, value=c.value, step_increment=c.step)
+                        adjustment_step.connect('value-changed', lambda a,c=c,a1=adjustment: [a.set_value(a.get_value() - a.get_value() % c.step),a1.set_value(a.get_value())])
+                        scale.set_adjustment(adjustment_step)
+                    c.gui_range_set = lambda c, scale=scale, adjustments=[adjustment, scale.get_adjustment()]: \
+                        self.update_scale_range(c, scale, adjustments)
+                    if c.step_big:
+                        scale.get_adjustment().set_page_increment(c.step_big)
+                    if c.scale_class:
+                        scale.add_css_class(c.scale_class)
+                    if c.format_value:
+                        scale.set_format_value_func(c.format_value)
+
+                    if c.default is not None:
+                        scale.add_mark(value=c.default, position=Gtk.PositionType.BOTTOM, markup=None)
+
+                    if c.text_id == 'zoom_absolute':
+                        self.zoom_absolute_sc = scale
+
+                    if c.text_id == 'pan_speed':
+                        self.pan_speed_sc = scale
+
+                    if c.text_id == 'tilt_speed':
+                        self.tilt_speed_sc = scale
+
+                    if c.text_id == 'pan_absolute':
+                        self.pan_absolute_sc = scale
+
+                    if c.text_id == 'tilt_absolute':
+                        self.tilt_absolute_sc = scale
+
+                    if c.text_id in ['pan_absolute', 'tilt_absolute']:
+                        for controller in scale.observe_controllers():
+                            if isinstance(controller, gi.repository.Gtk.EventControllerKey):
+                                controller.connect('key-pressed', self.handle_ptz_absolute_key_pressed)
+
+                    refresh = Gtk.Button(icon_name='edit-undo-symbolic', valign=Gtk.Align.CENTER, halign=Gtk.Align.START, has_frame=False)
+                    refresh.connect('clicked', lambda e, c=c, sc=scale: sc.get_adjustment().set_value(c.default))
+                    ctrl_box.append(refresh)
+                    scale_stack = Gtk.Stack(transition_type=Gtk.StackTransitionType.SLIDE_LEFT_RIGHT, transition_duration=500)
+                    scale_box = Gtk.Box(halign=Gtk.Align.END)
+                    spin_box = Gtk.Box(halign=Gtk.Align.END)
+                    prev_button = Gtk.Button(icon_name='go-previous-symbolic', has_frame=False, opacity=0.2)
+                    prev_button.connect('clicked', lambda e, st=scale_stack, sc=scale_box: st.set_visible_child(sc))
+                    next_button = Gtk.Button(icon_name='go-next-symbolic', has_frame=False, opacity=0.2)
+                    next_button.connect('clicked', lambda e, st=scale_stack, sp=spin_box: st.set_visible_child(sp))
+                    scale_box.append(scale)
+                    scale_box.append(next_button)
+                    spin = Gtk.SpinButton(adjustment=scale.get_adjustment())
+                    spin_box.append(spin)
+                    spin_box.append(prev_button)
+                    scale_stack.add_child(scale_box)
+                    scale_stack.add_child(spin_box)
+                    ctrl_box.append(scale_stack)
+                    c.gui_value_set = scale.set_value
+                    c.gui_ctrls += [scale, spin, refresh]
+                    c.gui_default_btn = refresh
+
+                elif c.type == 'boolean':
+                    switch = Gtk.Switch(valign=Gtk.Align.CENTER, active=c.value, margin_end=5, hexpand=True, halign=Gtk.Align.END)
+                    switch.connect('state-set', lambda w,state,c=c: self.update_ctrl(c, state))
+                    refresh = Gtk.Button(icon_name='edit-undo-symbolic', valign=Gtk.Align.CENTER, halign=Gtk.Align.START, has_frame=False)
+                    if c.default is not None:
+                        refresh.connect('clicked', lambda e,switch=switch,c=c: switch.set_active(c.default))
+                    ctrl_box.append(refresh)
+                    ctrl_box.append(switch)
+                    c.gui_value_set = switch.set_active
+                    c.gui_ctrls += [switch, refresh]
+                    c.gui_default_btn = refresh
+
+                elif c.type == 'button':
+                    filtered_menu = [m for m in c.menu if m.value is not None and not m.gui_hidden]
+                    children_per_line = min(len(filtered_menu), 4)
+                    box = Gtk.FlowBox(orientation=Gtk.Orientation.HORIZONTAL, homogeneous=True,
+                                    min_children_per_line=children_per_line, max_children_per_line=children_per_line,
+                                    selection_mode=Gtk.SelectionMode.NONE, hexpand=True,
+                                    # halign=Gtk.Align.END
+                                    # GTK4 workaround
+                                    halign=Gtk.Align.FILL if len(filtered_menu) > 4 else Gtk.Align.END)
+                    box.set_filter_func(lambda child: child.set_focusable(False) or True)
+                    refresh = Gtk.Button(icon_name='edit-undo-symbolic', valign=Gtk.Align.CENTER, halign=Gtk.Align.START, has_frame=False)
+                    ctrl_box.append(refresh)
+                    ctrl_box.append(box)
+                    for m in filtered_menu:
+                        b = Gtk.Button(label=m.name, valign=Gtk.Align.CENTER)
+                        b.connect('clicked', lambda e, c=c, m=m: self.update_ctrl(c, m.text_id))
+                        if c.child_tooltip:
+                            b.set_tooltip_markup(c.child_tooltip)
+                        if m.lp_text_id is not None:
+                            lp = Gtk.GestureLongPress(propagation_phase=Gtk.PropagationPhase.CAPTURE)
+                            lp.connect('pressed', lambda lp, x, y, c=c, m=m, b=b: [
+                                lp.set_state(Gtk.EventSequenceState.CLAIMED),
+                                self.update_ctrl(c, m.lp_text_id)
+                            ])
+                            b.add_controller(lp)
+                        box.append(b)
+                        c.gui_ctrls += b
+                    if c.default is not None:
+                        refresh.connect('clicked', lambda e,c=c: self.update_ctrl(c, c.default))
+                    c.gui_ctrls += [refresh]
+                    c.gui_default_btn = refresh
+
+                elif c.type == 'info':
+                    label = Gtk.Label(label=c.value, selectable=True, justify=Gtk.Justification.RIGHT, hexpand=True,
+                                        halign=Gtk.Align.END, wrap=True, wrap_mode=Pango.WrapMode.CHAR,
+                                        max_width_chars=48, width_chars=32, xalign=1,
+                                        natural_wrap_mode=Gtk.NaturalWrapMode.INHERIT)
+                    ctrl_box.append(label)
+                    c.gui_value_set = label.set_label
+                    c.gui_default_btn = None
+
+                elif c.type == 'menu':
+                    if len(c.menu) < 4 and not c.menu_dd:
+                        box = Gtk.Box(valign=Gtk.Align.CENTER, hexpand=True, halign=Gtk.Align.END)
+                        box.add_css_class('linked')
+                        rb = None
+                        for m in c.menu:
+                            rb = Gtk.ToggleButton(group=rb, label=m.name)
+                            rb.set_active(m.text_id == c.value)
+                            rb.connect('toggled', lambda b, c=c, m=m: self.update_ctrl(c, m.text_id) if b.get_active() else None)
+                            box.append(rb)
+                            m.gui_rb = rb
 
-                    elif c.type == 'boolean':
-                        switch = Gtk.Switch(valign=Gtk.Align.CENTER, active=c.value, margin_end=5, hexpand=True, halign=Gtk.Align.END)
-                        switch.connect('state-set', lambda w,state,c=c: self.update_ctrl(c, state))
                         refresh = Gtk.Button(icon_name='edit-undo-symbolic', valign=Gtk.Align.CENTER, halign=Gtk.Align.START, has_frame=False)
                         if c.default is not None:
-                            refresh.connect('clicked', lambda e,switch=switch,c=c: switch.set_active(c.default))
+                            refresh.connect('clicked', lambda e,c=c: find_by_text_id(c.menu, c.default).gui_rb.set_active(True))
                         ctrl_box.append(refresh)
-                        ctrl_box.append(switch)
-                        c.gui_value_set = switch.set_active
-                        c.gui_ctrls += [switch, refresh]
+                        ctrl_box.append(box)
+                        c.gui_value_set = lambda ctext, c=c: find_by_text_id(c.menu, ctext).gui_rb.set_active(True)
+                        c.gui_ctrls += [m.gui_rb for m in c.menu] + [refresh]
                         c.gui_default_btn = refresh
-
-                    elif c.type == 'button':
-                        filtered_menu = [m for m in c.menu if m.value is not None and not m.gui_hidden]
-                        children_per_line = min(len(filtered_menu), 4)
-                        box = Gtk.FlowBox(orientation=Gtk.Orientation.HORIZONTAL, homogeneous=True,
-                                        min_children_per_line=children_per_line, max_children_per_line=children_per_line,
-                                        selection_mode=Gtk.SelectionMode.NONE, hexpand=True,
-                                        # halign=Gtk.Align.END
-                                        # GTK4 workaround
-                                        halign=Gtk.Align.FILL if len(filtered_menu) > 4 else Gtk.Align.END)
-                        box.set_filter_func(lambda child: child.set_focusable(False) or True)
+                    else:
+                        wb_dd = Gtk.DropDown(model=Gtk.StringList(), valign=Gtk.Align.CENTER, hexpand=True, halign=Gtk.Align.END)
+                        for m in c.menu:
+                            wb_dd.get_model().append(m.name)
+                        if c.value:
+                            idx = find_idx(c.menu, lambda m: m.text_id == c.value)
+                            if idx is not None:
+                                wb_dd.set_selected(idx)
+                            else:
+                                wb_dd.set_selected(Gtk.INVALID_LIST_POSITION)
+                                err = f'Control {c.text_id}: Can\'t find {c.value} in {[m.text_id for m in c.menu]}'
+                                logging.warning(err)
+                                self.notify(err)
+                        wb_dd.connect('notify::selected', lambda e,_,c=c: None if self.updating_widgets else GLib.idle_add(self.update_ctrl, c, c.menu[e.get_selected()].text_id))
                         refresh = Gtk.Button(icon_name='edit-undo-symbolic', valign=Gtk.Align.CENTER, halign=Gtk.Align.START, has_frame=False)
-                        ctrl_box.append(refresh)
-                        ctrl_box.append(box)
-                        for m in filtered_menu:
-                            b = Gtk.Button(label=m.name, valign=Gtk.Align.CENTER)
-                            b.connect('clicked', lambda e, c=c, m=m: self.update_ctrl(c, m.text_id))
-                            if c.child_tooltip:
-                                b.set_tooltip_markup(c.child_tooltip)
-                            if m.lp_text_id is not None:
-                                lp = Gtk.GestureLongPress(propagation_phase=Gtk.PropagationPhase.CAPTURE)
-                                lp.connect('pressed', lambda lp, x, y, c=c, m=m, b=b: [
-                                    lp.set_state(Gtk.EventSequenceState.CLAIMED),
-                                    self.update_ctrl(c, m.lp_text_id)
-                                ])
-                                b.add_controller(lp)
-                            box.append(b)
-                            c.gui_ctrls += b
                         if c.default is not None:
-                            refresh.connect('clicked', lambda e,c=c: self.update_ctrl(c, c.default))
-                        c.gui_ctrls += [refresh]
+                            refresh.connect('clicked', lambda e,c=c,wb_dd=wb_dd: wb_dd.set_selected(find_idx(c.menu, lambda m: m.text_id == c.default)))
+                        ctrl_box.append(refresh)
+                        ctrl_box.append(wb_dd)
+                        c.gui_value_set = lambda ctext, c=c, wb_dd=wb_dd: wb_dd.set_selected(find_idx(c.menu, lambda m: m.text_id == ctext))
+                        c.gui_menu_set = lambda menu, wb_dd=wb_dd: wb_dd.get_model().splice(0, wb_dd.get_model().get_n_items(), [m.name for m in menu])
+                        c.gui_ctrls += [wb_dd, refresh]
                         c.gui_default_btn = refresh
 
-                    elif c.type == 'info':
-                        label = Gtk.Label(label=c.value, selectable=True, justify=Gtk.Justification.RIGHT, hexpand=True,
-                                            halign=Gtk.Align.END, wrap=True, wrap_mode=Pango.WrapMode.CHAR,
-                                            max_width_chars=48, width_chars=32, xalign=1,
-                                            natural_wrap_mode=Gtk.NaturalWrapMode.INHERIT)
-                        ctrl_box.append(label)
-                        c.gui_value_set = label.set_label
-                        c.gui_default_btn = None
-
-                    elif c.type == 'menu':
-                        if len(c.menu) < 4 and not c.menu_dd:
-                            box = Gtk.Box(valign=Gtk.Align.CENTER, hexpand=True, halign=Gtk.Align.END)
-                            box.add_css_class('linked')
-                            rb = None
-                            for m in c.menu:
-                                rb = Gtk.ToggleButton(group=rb, label=m.name)
-                                rb.set_active(m.text_id == c.value)
-                                rb.connect('toggled', lambda b, c=c, m=m: self.update_ctrl(c, m.text_id) if b.get_active() else None)
-                                box.append(rb)
-                                m.gui_rb = rb
-
-                            refresh = Gtk.Button(icon_name='edit-undo-symbolic', valign=Gtk.Align.CENTER, halign=Gtk.Align.START, has_frame=False)
-                            if c.default is not None:
-                                refresh.connect('clicked', lambda e,c=c: find_by_text_id(c.menu, c.default).gui_rb.set_active(True))
-                            ctrl_box.append(refresh)
-                            ctrl_box.append(box)
-                            c.gui_value_set = lambda ctext, c=c: find_by_text_id(c.menu, ctext).gui_rb.set_active(True)
-                            c.gui_ctrls += [m.gui_rb for m in c.menu] + [refresh]
-                            c.gui_default_btn = refresh
-                        else:
-                            wb_dd = Gtk.DropDown(model=Gtk.StringList(), valign=Gtk.Align.CENTER, hexpand=True, halign=Gtk.Align.END)
-                            for m in c.menu:
-                                wb_dd.get_model().append(m.name)
-                            if c.value:
-                                idx = find_idx(c.menu, lambda m: m.text_id == c.value)
-                                if idx is not None:
-                                    wb_dd.set_selected(idx)
-                                else:
-                                    wb_dd.set_selected(Gtk.INVALID_LIST_POSITION)
-                                    err = f'Control {c.text_id}: Can\'t find {c.value} in {[m.text_id for m in c.menu]}'
-                                    logging.warning(err)
-                                    self.notify(err)
-                            wb_dd.connect('notify::selected', lambda e,_,c=c: GLib.idle_add(self.update_ctrl, c, c.menu[e.get_selected()].text_id))
-                            refresh = Gtk.Button(icon_name='edit-undo-symbolic', valign=Gtk.Align.CENTER, halign=Gtk.Align.START, has_frame=False)
-                            if c.default is not None:
-                                refresh.connect('clicked', lambda e,c=c,wb_dd=wb_dd: wb_dd.set_selected(find_idx(c.menu, lambda m: m.text_id == c.default)))
-                            ctrl_box.append(refresh)
-                            ctrl_box.append(wb_dd)
-                            c.gui_value_set = lambda ctext, c=c, wb_dd=wb_dd: wb_dd.set_selected(find_idx(c.menu, lambda m: m.text_id == ctext))
-                            c.gui_ctrls += [wb_dd, refresh]
-                            c.gui_default_btn = refresh
-
-        self.update_ctrls_state()
-        _, natsize = self.get_preferred_size()
-        self.set_default_size(natsize.width, natsize.height)
-
     def close_notify(self):
         self._revealer.set_reveal_child(False)
         self._notify_timeout = None
@@ -522,16 +723,34 @@ class CameraCtrlsWindow(Gtk.ApplicationWindow):
             self._notify_timeout = GLib.timeout_add_seconds(timeout, self.close_notify)
 
     def update_ctrl(self, ctrl, value):
+        # the widgets follow the device in update_ctrl_widgets
+        if self.updating_widgets:
+            return
+        # a dragged scale fires for every pixel, the writer keeps only the latest value
+        if ctrl.type == 'integer' and not ctrl.reopener:
+            if ctrl.value != value or self.writer.is_pending(ctrl.text_id):
+                self.writer.write(ctrl.text_id, value)
+            return
         # only update if out of sync (when new value comes from the gui)
         if ctrl.value != value:
-            errs = []
-            self.camera.setup_ctrls({ctrl.text_id: value}, errs)
-            if errs:
-                self.notify('\n'.join(errs))
-                GLib.idle_add(self.update_ctrl_value, ctrl),
-                return
+            camera = self.camera
+            self.run_job(lambda: self.setup_ctrl(camera, ctrl, value), lambda errs: self.ctrl_updated(ctrl, errs))
+            return
+        self.ctrl_updated(ctrl, [])
+
+    # on the device worker
+    def setup_ctrl(self, camera, ctrl, value):
+        errs = []
+        camera.setup_ctrls({ctrl.text_id: value}, errs)
+        return errs
+
+    def ctrl_updated(self, ctrl, errs):
+        if errs:
+            self.notify('\n'.join(errs))
+            GLib.idle_add(self.update_ctrl_value, ctrl)
+            return
 
-        self.update_ctrls_state()
+        self.update_affected_state([ctrl])
         if ctrl.reopener:
             GLib.idle_add(self.reopen_device)
 
@@ -539,6 +758,14 @@ class CameraCtrlsWindow(Gtk.ApplicationWindow):
         for c in self.camera.get_ctrls():
             self.update_ctrl_state(c)
 
+    # a change refreshes only the controls which follow the changed ones
+    def update_affected_state(self, ctrls):
+        affected = []
+        for c in ctrls:
+            affected += [a for a in self.camera.get_affected_ctrls(c) if a not in affected]
+        for c in affected:
+            self.update_ctrl_state(c)
+
     def update_ctrl_state(self, c):
         for gui_ctrl in c.gui_ctrls:
             gui_ctrl.set_sensitive(not c.inactive and not c.readonly)
@@ -550,13 +777,64 @@ class CameraCtrlsWindow(Gtk.ApplicationWindow):
             c.gui_default_btn.set_opacity(visible)
             c.gui_default_btn.set_can_focus(visible)
 
+    # the widgets are set back to the device value (when clamped or failed) only if no newer value is pending
+    def update_written_ctrls(self, params):
+        if self.camera is None or self.writer is None:
+            return
+        self.updating_widgets = True
+        ctrls = []
+        for text_id in params:
+            c = self.camera.get_ctrl_by_text_id(text_id)
+            if c is None:
+                continue
+            ctrls.append(c)
+            if c.gui_value_set and not self.writer.is_pending(text_id):
+                c.gui_value_set(c.value)
+        self.updating_widgets = False
+        self.update_affected_state(ctrls)
+
+    # returns False if a menu changed which can't be updated in place
+    def update_ctrl_widgets(self, ctrls):
+        # the ctrls on the unbuilt pages get their widgets from the updated state later
+        ctrls = [c for c in ctrls if c.gui_ctrls]
+        if any(c.gui_menu_set is None and c.menu and [m.text_id for m in c.menu] != c.gui_menu for c in ctrls):
+            return False
+
+        self.updating_widgets = True
+        for c in ctrls:
+            if c.menu and [m.text_id for m in c.menu] != c.gui_menu:
+                c.gui_menu_set(c.menu)
+                c.gui_menu = [m.text_id for m in c.menu]
+            if c.gui_range_set:
+                c.gui_range_set(c)
+            if c.gui_value_set:
+                c.gui_value_set(c.value)
+        self.updating_widgets = False
+        return True
+
+    def update_scale_range(self, c, scale, adjustments):
+        for a in adjustments:
+            a.configure(c.value, c.min, c.max, a.get_step_increment(), a.get_page_increment(), a.get_page_size())
+        scale.clear_marks()
+        if c.default is not None:
+            scale.add_mark(value=c.default, position=Gtk.PositionType.BOTTOM, markup=None)
+
+    # the listener delivers the events of a wakeup together
+    def update_ctrl_values(self, ctrls):
+        for c in ctrls:
+            self.update_ctrl_value(c)
+
     def update_ctrl_value(self, c):
+        # the events can come from a closed or a not yet shown device
+        if self.camera is None or self.camera.get_ctrl_by_text_id(c.text_id) is not c:
+            return
         if c.reopener:
             self.reopen_device()
             return
-        if c.gui_value_set:
+        # the events of the older writes must not move back a dragged scale
+        if c.gui_value_set and (self.writer is None or not self.writer.is_pending(c.text_id)):
             c.gui_value_set(c.value)
-        self.update_ctrl_state(c)
+        self.update_affected_state([c])
 
     def handle_ptz_speed_key_pressed(self, c, keyval, keycode, state):
         pan_lower = self.pan_speed_sc.get_adjustment().get_lower()
@@ -242,7 +242,8 @@ def main():
         logging.error(f'camera {device} cannot do PTZ')
         sys.exit(1)
 
-    ptz = PTZController(camera_ctrls)
+    writer = camera_ctrls.control_writer()
+    ptz = PTZController(camera_ctrls, writer)
 
     running = True
     event = SDL_Event()
@@ -295,6 +296,7 @@ def main():
 
         time.sleep(0.050)
 
+    writer.stop()
     SDL_GameControllerClose(controller)
 
 if __name__ == '__main__':
@@ -428,7 +428,8 @@ def main():
         logging.error(f'camera {device} cannot do PTZ')
         sys.exit(1)
 
-    ptz = PTZController(camera_ctrls)
+    writer = camera_ctrls.control_writer()
+    ptz = PTZController(camera_ctrls, writer)
 
     for i in range(npfd):
         loop.add_reader(pfd[i].fd, process_midi, seq, ptz, loop)
@@ -437,6 +438,7 @@ def main():
         loop.run_forever()
     finally:
         loop.close()
+        writer.stop()
 
 if __name__ == '__main__':
     sys.exit(main())
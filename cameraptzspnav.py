@@ -142,7 +142,8 @@ def main():
         logging.error(f'camera {device} cannot do PTZ')
         sys.exit(1)
 
-    ptz = PTZController(camera_ctrls)
+    writer = camera_ctrls.control_writer()
+    ptz = PTZController(camera_ctrls, writer)
 
     epoll = select.epoll()
     epoll.register(spnav_fd(), select.POLLIN | select.POLLERR | select.POLLNVAL)
@@ -180,6 +181,7 @@ def main():
             if event.button.bnum == 1 and event.button.press == 0:
                 ptz.do_reset([])
 
+    writer.stop()
     spnav_close()
 
 if __name__ == '__main__':
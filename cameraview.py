@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 
-import os, sys, ctypes, ctypes.util, logging, mmap, struct, getopt, select
+import os, sys, ctypes, ctypes.util, logging, mmap, struct, getopt, select, time, json, statistics
 from fcntl import ioctl
-from threading import Thread
+from threading import Thread, Lock, Condition, Event
+from collections import deque
 from operator import lt, gt
 
 from cameractrls import CameraCtrls, PTZController
@@ -91,6 +92,11 @@ SDL_GetWindowSize.restype = None
 SDL_GetWindowSize.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)]
 #void SDL_GetWindowSize(SDL_Window * window, int *w, int *h);
 
+SDL_GetRendererOutputSize = sdl2.SDL_GetRendererOutputSize
+SDL_GetRendererOutputSize.restype = ctypes.c_int
+SDL_GetRendererOutputSize.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)]
+#int SDL_GetRendererOutputSize(SDL_Renderer * renderer, int *w, int *h);
+
 SDL_SetWindowSize = sdl2.SDL_SetWindowSize
 SDL_SetWindowSize.restype = None
 SDL_SetWindowSize.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
@@ -106,6 +112,11 @@ SDL_UpdateTexture.restype = ctypes.c_int
 SDL_UpdateTexture.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int]
 # int SDL_UpdateTexture(SDL_Texture * texture, const SDL_Rect * rect, const void *pixels, int pitch);
 
+SDL_UpdateYUVTexture = sdl2.SDL_UpdateYUVTexture
+SDL_UpdateYUVTexture.restype = ctypes.c_int
+SDL_UpdateYUVTexture.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+# int SDL_UpdateYUVTexture(SDL_Texture * texture, const SDL_Rect * rect, const Uint8 *Yplane, int Ypitch, const Uint8 *Uplane, int Upitch, const Uint8 *Vplane, int Vpitch);
+
 SDL_RenderClear = sdl2.SDL_RenderClear
 SDL_RenderClear.restype = ctypes.c_int
 SDL_RenderClear.argtypes = [ctypes.c_void_p]
@@ -124,6 +135,11 @@ SDL_CreateRGBSurfaceFrom.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int
 #SDL_Surface* SDL_CreateRGBSurfaceFrom(void *pixels, int width, int height, int depth, int pitch,
 # Uint32 Rmask, Uint32 Gmask, Uint32 Bmask, Uint32 Amask);
 
+SDL_FreeSurface = sdl2.SDL_FreeSurface
+SDL_FreeSurface.restype = None
+SDL_FreeSurface.argtypes = [ctypes.POINTER(SDL_Surface)]
+#void SDL_FreeSurface(SDL_Surface * surface);
+
 SDL_ConvertPixels = sdl2.SDL_ConvertPixels
 SDL_ConvertPixels.restype = ctypes.c_int
 SDL_ConvertPixels.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_uint32, ctypes.c_void_p, ctypes.c_int, ctypes.c_uint32, ctypes.c_void_p, ctypes.c_int]
@@ -182,6 +198,8 @@ SDL_ShowSimpleMessageBox.argtypes = [ctypes.c_uint32, ctypes.c_char_p, ctypes.c_
 
 SDL_INIT_VIDEO = 0x00000020
 SDL_QUIT = 0x100
+SDL_WINDOWEVENT = 0x200
+SDL_WINDOWEVENT_SIZE_CHANGED = 6
 SDL_KEYDOWN = 0x300
 SDL_KEYUP = 0x301
 SDL_MOUSEBUTTONUP = 0x402
@@ -408,6 +426,7 @@ SDL_PIXELFORMAT_RGB24 = 386930691
 SDL_PIXELFORMAT_BGR24 = 390076419
 SDL_PIXELFORMAT_BGR888 = 374740996 #XBGR8888
 SDL_PIXELFORMAT_RGB565 = 353701890
+SDL_PIXELFORMAT_INDEX8 = 318769153
 SDL_TEXTUREACCESS_STREAMING = 1
 
 SDL_Keycode = ctypes.c_int32
@@ -448,6 +467,19 @@ class SDL_MouseButtonEvent(ctypes.Structure):
         ('y', ctypes.c_int32),
     ]
 
+class SDL_WindowEvent(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_uint32),
+        ('timestamp', ctypes.c_uint32),
+        ('windowID', ctypes.c_uint32),
+        ('event', ctypes.c_uint8),
+        ('padding1', ctypes.c_uint8),
+        ('padding2', ctypes.c_uint8),
+        ('padding3', ctypes.c_uint8),
+        ('data1', ctypes.c_int32),
+        ('data2', ctypes.c_int32),
+    ]
+
 class SDL_UserEvent(ctypes.Structure):
     _fields_ = [
         ('type', ctypes.c_uint32),
@@ -462,6 +494,7 @@ class SDL_UserEvent(ctypes.Structure):
 class SDL_Event(ctypes.Union):
     _fields_ = [
         ('type', ctypes.c_uint32),
+        ('window', SDL_WindowEvent),
         ('key', SDL_KeyboardEvent),
         ('button', SDL_MouseButtonEvent),
         ('user', SDL_UserEvent),
@@ -474,8 +507,8 @@ tj_init_decompress.restype = ctypes.c_void_p
 
 tj_decompress = turbojpeg.tjDecompress2
 tj_decompress.argtypes = [ctypes.c_void_p,
-    ctypes.POINTER(ctypes.c_ubyte), ctypes.c_ulong,
-    ctypes.POINTER(ctypes.c_ubyte),
+    ctypes.c_void_p, ctypes.c_ulong,
+    ctypes.c_void_p,
     ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
     ctypes.c_int]
 tj_decompress.restype = ctypes.c_int
@@ -485,6 +518,45 @@ tj_decompress.restype = ctypes.c_int
 #                  int width, int pitch, int height, int pixelFormat,
 #                  int flags);
 
+tj_decompress_header = turbojpeg.tjDecompressHeader3
+tj_decompress_header.argtypes = [ctypes.c_void_p,
+    ctypes.c_void_p, ctypes.c_ulong,
+    ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int),
+    ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)]
+tj_decompress_header.restype = ctypes.c_int
+#int tjDecompressHeader3(tjhandle handle,
+#                        const unsigned char *jpegBuf, unsigned long jpegSize,
+#                        int *width, int *height, int *jpegSubsamp,
+#                        int *jpegColorspace);
+
+tj_decompress_to_yuv_planes = turbojpeg.tjDecompressToYUVPlanes
+tj_decompress_to_yuv_planes.argtypes = [ctypes.c_void_p,
+    ctypes.c_void_p, ctypes.c_ulong,
+    ctypes.POINTER(ctypes.c_void_p),
+    ctypes.c_int, ctypes.POINTER(ctypes.c_int), ctypes.c_int,
+    ctypes.c_int]
+tj_decompress_to_yuv_planes.restype = ctypes.c_int
+#int tjDecompressToYUVPlanes(tjhandle handle,
+#                            const unsigned char *jpegBuf,
+#                            unsigned long jpegSize,
+#                            unsigned char **dstPlanes,
+#                            int width, int *strides, int height,
+#                            int flags);
+
+class tjscalingfactor(ctypes.Structure):
+    _fields_ = [
+        ('num', ctypes.c_int),
+        ('denom', ctypes.c_int),
+    ]
+
+tj_get_scaling_factors = turbojpeg.tjGetScalingFactors
+tj_get_scaling_factors.argtypes = [ctypes.POINTER(ctypes.c_int)]
+tj_get_scaling_factors.restype = ctypes.POINTER(tjscalingfactor)
+#tjscalingfactor *tjGetScalingFactors(int *numScalingFactors);
+
+def tj_scaled(dim, num, denom):
+    return (dim * num + denom - 1) // denom
+
 tj_get_error_str = turbojpeg.tjGetErrorStr
 tj_get_error_str.restype = ctypes.c_char_p
 #char* tjGetErrorStr()
@@ -496,8 +568,13 @@ tj_destroy.restype = ctypes.c_int
 
 TJPF_RGB = 0
 
+TJSAMP_444 = 0
+TJSAMP_422 = 1
+TJSAMP_420 = 2
+TJSAMP_GRAY = 3
+
 class V4L2Camera(Thread):
-    def __init__(self, device):
+    def __init__(self, device, num_cap_bufs=6):
         super().__init__()
         self.device = device
         self.width = 0
@@ -506,8 +583,10 @@ class V4L2Camera(Thread):
         self.bytesperline = 0
         self.stopped = False
         self.pipe = None
-        self.num_cap_bufs = 6
+        self.num_cap_bufs = num_cap_bufs
         self.cap_bufs = []
+        self.streaming = False
+        self.lock = Lock()
 
         try:
             self.fd = os.open(self.device, os.O_RDWR, 0)
@@ -596,8 +675,10 @@ class V4L2Camera(Thread):
             self.pipe.write_buf(None)
             return
 
-        for buf in self.cap_bufs:
-            ioctl(self.fd, VIDIOC_QBUF, buf)
+        with self.lock:
+            for buf in self.cap_bufs:
+                ioctl(self.fd, VIDIOC_QBUF, buf)
+            self.streaming = True
 
         qbuf = v4l2_buffer()
         qbuf.type = V4L2_BUF_TYPE_VIDEO_CAPTURE
@@ -629,15 +710,26 @@ class V4L2Camera(Thread):
             buf = self.cap_bufs[qbuf.index]
             buf.bytesused = qbuf.bytesused
             buf.timestamp = qbuf.timestamp
+            buf.sequence = qbuf.sequence
 
+            # the pipe owns the buffer until it gives it back with requeue_buf
             self.pipe.write_buf(buf)
 
-            ioctl(self.fd, VIDIOC_QBUF, buf)
+        with self.lock:
+            self.streaming = False
+            try:
+                ioctl(self.fd, VIDIOC_STREAMOFF, struct.pack('I', V4L2_BUF_TYPE_VIDEO_CAPTURE))
+            except Exception as e:
+                logging.error(f'VIDIOC_STREAMOFF failed {self.device}: {e}')
 
-        try:
-            ioctl(self.fd, VIDIOC_STREAMOFF, struct.pack('I', V4L2_BUF_TYPE_VIDEO_CAPTURE))
-        except Exception as e:
-            logging.error(f'VIDIOC_STREAMOFF failed {self.device}: {e}')
+    def requeue_buf(self, buf):
+        with self.lock:
+            if not self.streaming:
+                return
+            try:
+                ioctl(self.fd, VIDIOC_QBUF, buf)
+            except Exception as e:
+                logging.warning(f'VIDIOC_QBUF failed {self.device}: {e}')
 
     def stop_capturing(self):
         self.stopped = True
@@ -652,7 +744,255 @@ class V4L2Camera(Thread):
         self.join()
 
 
-def V4L2Format2SDL(format):
+# the release callback is called when the last reference is dropped,
+# it gives back the capture or the decode buffer
+# fmt is an SDL pixelformat, INDEX8 means a grey image shown with a colormap,
+# planes are the [(ptr, pitch)] of the Y, U, V planes for IYUV frames
+class Frame():
+    def __init__(self, data, width, height, pitch, fmt, release=None, planes=None):
+        self.data = ctypes.cast(data, ctypes.c_void_p)
+        self.width = width
+        self.height = height
+        self.pitch = pitch
+        self.fmt = fmt
+        self.planes = planes
+        self.release = release
+        self.refs = 1
+        self.lock = Lock()
+
+    def ref(self):
+        with self.lock:
+            self.refs += 1
+        return self
+
+    def unref(self):
+        with self.lock:
+            self.refs -= 1
+            last = self.refs == 0
+        if last and self.release is not None:
+            self.release()
+
+# fixed size buffers for the decoded and converted frames, the frame in the mailbox,
+# the one being rendered and the one being written need 3 of them
+class BufferPool():
+    def __init__(self, size, count=3):
+        self.lock = Lock()
+        self.free = [(ctypes.c_uint8 * size)() for i in range(count)]
+
+    def get(self):
+        with self.lock:
+            return self.free.pop() if self.free else None
+
+    def put(self, buf):
+        with self.lock:
+            self.free.append(buf)
+
+# latest frame wins, the renderer is woken up only once for the frames arriving while it is busy
+class FrameMailbox():
+    def __init__(self):
+        self.lock = Lock()
+        self.frame = None
+        self.dropped = 0
+        self.shown = 0
+
+    # returns the replaced frame, if it is None the reader has to be woken up
+    def put(self, frame):
+        with self.lock:
+            old = self.frame
+            if old is not None:
+                self.dropped += 1
+            self.frame = frame
+        return old
+
+    def take(self):
+        with self.lock:
+            frame = self.frame
+            self.frame = None
+            if frame is not None:
+                self.shown += 1
+        return frame
+
+    # empties the mailbox without showing, the next put has to wake the reader up
+    def drop(self):
+        with self.lock:
+            frame = self.frame
+            self.frame = None
+            if frame is not None:
+                self.dropped += 1
+        return frame
+
+DECODE_DROP_POLICIES = ['oldest', 'newest']
+
+# nearest-rank percentile of sorted values
+def percentile(values, p):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+# decodes the JPEG frames on worker threads, each with its own turbojpeg handle.
+# When all the workers are busy, at most one frame per worker waits in the queue,
+# the rest is dropped by the policy. Frames are delivered in capture order,
+# a frame finished later than a newer one is dropped as stale.
+# 4:2:0 and 4:2:2 JPEGs are decoded to YUV planes without color conversion,
+# the others to RGB. With a scale set, the DCT scaling of turbojpeg makes smaller frames.
+class DecodePool():
+    def __init__(self, width, height, deliver, workers=2, policy='oldest', stats_window=1000):
+        self.width = width
+        self.height = height
+        self.scale = (1, 1)
+        self.deliver = deliver
+        self.policy = policy
+        self.max_pending = workers
+        self.pending = deque()
+        self.cond = Condition()
+        self.stopped = False
+        self.seq = 0
+        self.delivered_seq = -1
+        self.order_lock = Lock()
+        # every worker writes one, one is in the mailbox, one is being rendered
+        self.num_outbuffers = workers + 2
+        self.outbuffers = {}
+
+        self.decoded = 0
+        self.dropped = 0
+        self.errors = 0
+        self.stale = 0
+        self.decode_times = deque(maxlen=stats_window)
+        self.depth_sum = 0
+        self.depth_max = 0
+        self.submitted = 0
+
+        self.threads = [Thread(target=self.work) for i in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, frame, size):
+        with self.cond:
+            self.submitted += 1
+            if len(self.pending) >= self.max_pending:
+                self.dropped += 1
+                if self.policy == 'newest':
+                    frame.unref()
+                    return
+                self.pending.popleft()[1].unref()
+            self.pending.append((self.seq, frame, size))
+            self.seq += 1
+            self.depth_sum += len(self.pending)
+            self.depth_max = max(self.depth_max, len(self.pending))
+            self.cond.notify()
+
+    def get_outbuffers(self, size):
+        with self.cond:
+            if size not in self.outbuffers:
+                self.outbuffers[size] = BufferPool(size, self.num_outbuffers)
+            return self.outbuffers[size]
+
+    def set_scale(self, num, denom):
+        with self.cond:
+            if self.scale != (num, denom):
+                logging.info(f'decode scale: {num}/{denom}')
+            self.scale = (num, denom)
+
+    def decode(self, tj, frame, size, subsamp, w, h):
+        if subsamp in [TJSAMP_420, TJSAMP_422]:
+            cw = (w + 1) // 2
+            ch = (h + 1) // 2 if subsamp == TJSAMP_420 else h
+            pool = self.get_outbuffers(w * h + 2 * cw * ch)
+            outbuffer = pool.get()
+            if outbuffer is None:
+                return None
+            addr = ctypes.addressof(outbuffer)
+            planes = (ctypes.c_void_p * 3)(addr, addr + w * h, addr + w * h + cw * ch)
+            strides = (ctypes.c_int * 3)(w, cw, cw)
+            tj_decompress_to_yuv_planes(tj, frame.data, size, planes, w, strides, h, 0)
+            # 4:2:2 chroma planes have every line, skipping every second makes them 4:2:0
+            cpitch = cw if subsamp == TJSAMP_420 else cw * 2
+            return Frame(outbuffer, w, h, w, SDL_PIXELFORMAT_IYUV, lambda: pool.put(outbuffer),
+                [(planes[0], w), (planes[1], cpitch), (planes[2], cpitch)])
+
+        pool = self.get_outbuffers(w * h * 3)
+        outbuffer = pool.get()
+        if outbuffer is None:
+            return None
+        tj_decompress(tj, frame.data, size, outbuffer, w, w * 3, h, TJPF_RGB, 0)
+        return Frame(outbuffer, w, h, w * 3, SDL_PIXELFORMAT_RGB24, lambda: pool.put(outbuffer))
+
+    def work(self):
+        tj = tj_init_decompress()
+        width = ctypes.c_int()
+        height = ctypes.c_int()
+        subsamp = ctypes.c_int()
+        colorspace = ctypes.c_int()
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    break
+                seq, frame, size = self.pending.popleft()
+                num, denom = self.scale
+
+            if tj_decompress_header(tj, frame.data, size, width, height, subsamp, colorspace) != 0 or \
+                width.value != self.width or height.value != self.height:
+                frame.unref()
+                with self.cond:
+                    self.errors += 1
+                continue
+
+            start = time.perf_counter()
+            # ignore decode errors, some cameras only send imperfect frames
+            out = self.decode(tj, frame, size, subsamp.value, tj_scaled(self.width, num, denom), tj_scaled(self.height, num, denom))
+            elapsed = time.perf_counter() - start
+            frame.unref()
+
+            if out is None:
+                with self.cond:
+                    self.dropped += 1
+                continue
+
+            with self.cond:
+                self.decoded += 1
+                self.decode_times.append(elapsed)
+
+            with self.order_lock:
+                if seq < self.delivered_seq:
+                    self.stale += 1
+                    out.unref()
+                    continue
+                self.delivered_seq = seq
+                self.deliver(out)
+        tj_destroy(tj)
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            for seq, frame, size in self.pending:
+                frame.unref()
+            self.pending.clear()
+            self.cond.notify_all()
+        for t in self.threads:
+            t.join()
+
+    def stats(self):
+        with self.cond:
+            times = sorted(self.decode_times)
+            return {
+                'decoded': self.decoded,
+                'dropped': self.dropped,
+                'stale': self.stale,
+                'errors': self.errors,
+                'decode_ms_avg': sum(times) / len(times) * 1000 if times else 0,
+                'decode_ms_p50': percentile(times, 50) * 1000,
+                'decode_ms_p90': percentile(times, 90) * 1000,
+                'decode_ms_p99': percentile(times, 99) * 1000,
+                'decode_ms_max': times[-1] * 1000 if times else 0,
+                'queue_depth_avg': self.depth_sum / self.submitted if self.submitted else 0,
+                'queue_depth_max': self.depth_max,
+            }
+
+
+# the message box is shown only with gui, the headless modes have no display
+def V4L2Format2SDL(format, gui=True):
     if format == V4L2_PIX_FMT_YUYV:
         return SDL_PIXELFORMAT_YUY2
     elif format == V4L2_PIX_FMT_YVYU:
@@ -676,23 +1016,176 @@ def V4L2Format2SDL(format):
     elif format == V4L2_PIX_FMT_RX24:
         return SDL_PIXELFORMAT_BGR888
     elif format in [V4L2_PIX_FMT_MJPEG, V4L2_PIX_FMT_JPEG]:
-        return SDL_PIXELFORMAT_RGB24
+        # RGB24 for the JPEGs not in 4:2:0 or 4:2:2
+        return SDL_PIXELFORMAT_IYUV
     # handling with surface+palette+texture, not here
     #elif format == V4L2_PIX_FMT_GREY:
     #    return SDL_PIXELFORMAT_INDEX8
 
     formats = 'Sorry, only YUYV, YVYU, UYVY, NV12, NV21, YU12, RGBP, RGB3, BGR3, RX24, MJPG, JPEG, GREY are supported yet.'
     logging.error(f'Invalid pixel format: {formats}')
-    SDL_ShowSimpleMessageBox(SDL_MESSAGEBOX_ERROR, b'Invalid pixel format', bytes(formats, 'utf-8'), None)
+    if gui:
+        SDL_ShowSimpleMessageBox(SDL_MESSAGEBOX_ERROR, b'Invalid pixel format', bytes(formats, 'utf-8'), None)
     sys.exit(3)
 
-class SDLCameraWindow():
-    def __init__(self, device, win_width, win_height, angle, flip, colormap):
-        self.returncode = 0
-        self.cam = V4L2Camera(device)
+# the decoding and the colormap conversion of the captured frames,
+# the results go to put_frame
+class FramePipe():
+    gui = True
+
+    def __init__(self, device, decode_threads=2, decode_drop='oldest', stats_window=1000):
+        # the decode queue and the workers hold capture buffers also
+        self.cam = V4L2Camera(device, max(6, 2 * decode_threads + 2))
         self.cam.pipe = self
+        self.decoder = None
+        # the colormapped frames as NV12, only the Y is used,
+        # one for every decode worker and one more for the mailbox
+        self.surfbuffers = BufferPool(self.cam.width * self.cam.height * 2, decode_threads + 1)
+        self.colormap = 'none'
+
+        self.sdl_format = SDL_PIXELFORMAT_INDEX8
+        if self.cam.pixelformat != V4L2_PIX_FMT_GREY:
+            self.sdl_format = V4L2Format2SDL(self.cam.pixelformat, self.gui)
+
+        if self.cam.pixelformat in [V4L2_PIX_FMT_MJPEG, V4L2_PIX_FMT_JPEG]:
+            self.decoder = DecodePool(self.cam.width, self.cam.height, self.write_frame, decode_threads, decode_drop, stats_window)
+
+    def write_buf(self, buf):
+        if buf is None:
+            self.camera_error()
+            return
+
+        ptr = (ctypes.c_uint8 * buf.bytesused).from_buffer(buf.buffer)
+        frame = Frame(ptr, self.cam.width, self.cam.height, self.cam.bytesperline, self.sdl_format, lambda: self.cam.requeue_buf(buf))
+
+        if self.decoder is not None:
+            self.decoder.submit(frame, buf.bytesused)
+        else:
+            self.write_frame(frame)
+
+    def write_frame(self, frame):
+        if frame.fmt != SDL_PIXELFORMAT_INDEX8 and self.colormap != 'none':
+            # the Y plane of the planar formats is the grey image itself
+            if frame.fmt in [SDL_PIXELFORMAT_IYUV, SDL_PIXELFORMAT_YV12, SDL_PIXELFORMAT_NV12, SDL_PIXELFORMAT_NV21] and \
+                frame.pitch == frame.width:
+                frame = Frame(frame.data, frame.width, frame.height, frame.pitch, SDL_PIXELFORMAT_INDEX8, frame.unref)
+                self.put_frame(frame)
+                return
+            surfbuffers = self.surfbuffers
+            surfbuffer = surfbuffers.get()
+            if surfbuffer is None:
+                frame.unref()
+                return
+            SDL_ConvertPixels(frame.width, frame.height, frame.fmt, frame.data, frame.pitch, SDL_PIXELFORMAT_NV12, surfbuffer, frame.width)
+            frame.unref()
+            frame = Frame(surfbuffer, frame.width, frame.height, frame.width, SDL_PIXELFORMAT_INDEX8, lambda: surfbuffers.put(surfbuffer))
+
+        self.put_frame(frame)
+
+    def put_frame(self, frame):
+        frame.unref()
+
+    def camera_error(self):
+        pass
+
+    def stop_decoding(self):
+        if self.decoder is None:
+            return
+        self.decoder.stop()
+        st = self.decoder.stats()
+        logging.info(f'frames decoded: {st["decoded"]}, dropped: {st["dropped"]}, stale: {st["stale"]}, errors: {st["errors"]}, '
+            f'decode time avg: {st["decode_ms_avg"]:.2f} ms, max: {st["decode_ms_max"]:.2f} ms, '
+            f'queue depth avg: {st["queue_depth_avg"]:.2f}, max: {st["queue_depth_max"]}')
+
+
+# runs the capture and the decoding without rendering, for measurements
+class BenchSink(FramePipe):
+    gui = False
+
+    def __init__(self, device, frames, colormap='none', decode_threads=2, decode_drop='oldest'):
+        super().__init__(device, decode_threads, decode_drop, frames)
+        self.frames = frames
+        self.colormap = colormap if colormap in SDL_PALS else 'none'
+        self.timestamps = []
+        self.sequences = []
+        self.delivered = 0
+        self.failed = False
+        self.lock = Lock()
+        self.done = Event()
+
+    def write_buf(self, buf):
+        if buf is not None:
+            if self.done.is_set():
+                self.cam.requeue_buf(buf)
+                return
+            self.timestamps.append(buf.timestamp.secs + buf.timestamp.usecs / 1000000)
+            self.sequences.append(buf.sequence)
+
+        super().write_buf(buf)
+
+        if len(self.timestamps) >= self.frames:
+            self.done.set()
+
+    def put_frame(self, frame):
+        with self.lock:
+            self.delivered += 1
+        frame.unref()
+
+    def camera_error(self):
+        self.failed = True
+        self.done.set()
+
+    def run(self):
+        cpu_start = time.process_time()
+        self.cam.start()
+        self.done.wait()
+        self.cam.stop()
+        self.stop_decoding()
+        cpu = time.process_time() - cpu_start
+        return self.report(cpu)
+
+    def report(self, cpu):
+        ts = self.timestamps
+        intervals = [(b - a) * 1000 for a, b in zip(ts, ts[1:])]
+        seqs = self.sequences
+        st = self.decoder.stats() if self.decoder is not None else None
+
+        return {
+            'device': self.cam.device,
+            'width': self.cam.width,
+            'height': self.cam.height,
+            'pixelformat': struct.pack('<I', self.cam.pixelformat).decode(errors='replace'),
+            'frames': len(ts),
+            'delivered': self.delivered,
+            'fps': len(intervals) / (ts[-1] - ts[0]) if len(ts) > 1 and ts[-1] > ts[0] else 0,
+            'interval_ms_avg': statistics.mean(intervals) if intervals else 0,
+            'interval_ms_jitter': statistics.pstdev(intervals) if intervals else 0,
+            'dropped': sum(max(0, b - a - 1) for a, b in zip(seqs, seqs[1:])),
+            'decode': st,
+            'cpu_ms_per_frame': cpu / len(ts) * 1000 if ts else 0,
+        }
+
+def print_bench_report(r):
+    print(f'device:           {r["device"]} {r["width"]}x{r["height"]} {r["pixelformat"]}')
+    print(f'frames:           {r["frames"]} captured, {r["delivered"]} delivered')
+    print(f'fps:              {r["fps"]:.2f}')
+    print(f'frame interval:   {r["interval_ms_avg"]:.2f} ms, jitter: {r["interval_ms_jitter"]:.2f} ms')
+    print(f'dropped:          {r["dropped"]} (sequence gaps)')
+    st = r['decode']
+    if st is not None:
+        print(f'decode time:      p50 {st["decode_ms_p50"]:.2f} ms, p90 {st["decode_ms_p90"]:.2f} ms, p99 {st["decode_ms_p99"]:.2f} ms, max {st["decode_ms_max"]:.2f} ms')
+        print(f'decode dropped:   {st["dropped"]}, stale: {st["stale"]}, errors: {st["errors"]}')
+    print(f'cpu per frame:    {r["cpu_ms_per_frame"]:.2f} ms')
+
+
+class SDLCameraWindow(FramePipe):
+    def __init__(self, device, win_width, win_height, angle, flip, colormap, decode_threads=2, decode_drop='oldest'):
+        super().__init__(device, decode_threads, decode_drop)
+        self.returncode = 0
         self.ctrls = CameraCtrls(device, self.cam.fd)
-        self.ptz = PTZController(self.ctrls)
+        # the key repeat would queue up the PTZ writes on slow cameras
+        self.writer = self.ctrls.control_writer()
+        self.ptz = PTZController(self.ctrls, self.writer)
         width = self.cam.width
         height = self.cam.height
 
@@ -706,37 +1199,35 @@ class SDLCameraWindow():
         win_height = rheight if win_height == 0 else min(int(win_width * (rheight/rwidth)), win_height, rheight)
 
         self.fullscreen = False
-        self.tj = None
-        self.outbuffer = None
-        self.bytesperline = self.cam.bytesperline
+        self.texture = None
+        self.texture_fmt = None
+        self.texture_size = None
         self.surface = None
-        self.surfbuffer = None
+        self.scaling_factors = []
 
         self.angle = 0
         self.flip = 0
         self.dstrect = None
         self.colormap = None
 
-        if self.cam.pixelformat in [V4L2_PIX_FMT_MJPEG, V4L2_PIX_FMT_JPEG]:
-            self.tj = tj_init_decompress()
-            # create rgb buffer
-            self.outbuffer = (ctypes.c_uint8 * (width * height * 3))()
-            self.bytesperline = width * 3
+        if self.decoder is not None:
+            num = ctypes.c_int()
+            factors = tj_get_scaling_factors(num)
+            # only downscaling, from the smallest
+            self.scaling_factors = sorted([(f.num, f.denom) for f in factors[:num.value] if f.num <= f.denom], key=lambda f: f[0] / f[1])
 
         if SDL_Init(SDL_INIT_VIDEO) != 0:
             logging.error(f'SDL_Init failed: {SDL_GetError()}')
             sys.exit(1)
 
-        # create a new sdl user event type for new image events
-        self.sdl_new_image_event = SDL_RegisterEvents(1)
-        self.sdl_new_grey_image_event = SDL_RegisterEvents(1)
-        self.sdl_camera_error_event = SDL_RegisterEvents(1)
+        self.mailbox = FrameMailbox()
 
-        self.new_image_event = SDL_Event()
-        self.new_image_event.type = self.sdl_new_image_event
+        # create a new sdl user event type for new frame events
+        self.sdl_new_frame_event = SDL_RegisterEvents(1)
+        self.sdl_camera_error_event = SDL_RegisterEvents(1)
 
-        self.new_grey_image_event = SDL_Event()
-        self.new_grey_image_event.type = self.sdl_new_grey_image_event
+        self.new_frame_event = SDL_Event()
+        self.new_frame_event.type = self.sdl_new_frame_event
 
         self.camera_error_event = SDL_Event()
         self.camera_error_event.type = self.sdl_camera_error_event
@@ -754,14 +1245,10 @@ class SDLCameraWindow():
         self.mirror(flip)
 
         if self.cam.pixelformat != V4L2_PIX_FMT_GREY:
-            self.texture = SDL_CreateTexture(self.renderer, V4L2Format2SDL(self.cam.pixelformat), SDL_TEXTUREACCESS_STREAMING, width, height)
-            if self.texture is None:
-                logging.error(f'SDL_CreateTexture failed: {SDL_GetError()}')
+            if not self.create_texture(self.sdl_format, width, height):
                 sys.exit(1)
 
-        self.surface = SDL_CreateRGBSurfaceFrom(self.surfbuffer, self.cam.width, self.cam.height, 8, self.cam.width, 0, 0, 0, 0)
-        if not bool(self.surface):
-            logging.error(f'SDL_CreateRGBSurfaceFrom failed: {SDL_GetError()}')
+        if not self.create_surface(width, height, width):
             sys.exit(1)
 
         self.colormaps = SDL_PALS
@@ -770,30 +1257,89 @@ class SDLCameraWindow():
 
         self.set_colormap(colormap)
 
-    def write_buf(self, buf):
-        if buf is None:
-            SDL_PushEvent(ctypes.byref(self.camera_error_event))
-            return
+    def camera_error(self):
+        SDL_PushEvent(ctypes.byref(self.camera_error_event))
 
-        ptr = (ctypes.c_uint8 * buf.bytesused).from_buffer(buf.buffer)
-        event = self.new_image_event if self.cam.pixelformat != V4L2_PIX_FMT_GREY else self.new_grey_image_event
+    def put_frame(self, frame):
+        old = self.mailbox.put(frame)
+        if old is not None:
+            old.unref()
+            return
 
-        if self.cam.pixelformat == V4L2_PIX_FMT_MJPEG or self.cam.pixelformat == V4L2_PIX_FMT_JPEG:
-            tj_decompress(self.tj, ptr, buf.bytesused, self.outbuffer, self.cam.width, self.bytesperline, self.cam.height, TJPF_RGB, 0)
-            # ignore decode errors, some cameras only send imperfect frames
-            ptr = self.outbuffer
-
-        if self.cam.pixelformat != V4L2_PIX_FMT_GREY and self.colormap != 'none':
-            if self.surfbuffer is None:
-                # create surface buffer as NV12, but use only the Y
-                self.surfbuffer = (ctypes.c_uint8 * (self.cam.width * self.cam.height * 2))()
-            SDL_ConvertPixels(self.cam.width, self.cam.height, V4L2Format2SDL(self.cam.pixelformat), ptr, self.bytesperline, SDL_PIXELFORMAT_NV12, self.surfbuffer, self.cam.width)
-            ptr = self.surfbuffer
-            event = self.new_grey_image_event
-
-        event.user.data1 = ctypes.cast(ptr, ctypes.c_void_p)
-        if SDL_PushEvent(ctypes.byref(event)) < 0:
+        if SDL_PushEvent(ctypes.byref(self.new_frame_event)) < 0:
             logging.warning(f'SDL_PushEvent failed: {SDL_GetError()}')
+            # without the event nobody takes this frame, the later puts would only replace it
+            frame = self.mailbox.drop()
+            if frame is not None:
+                frame.unref()
+
+    def create_texture(self, fmt, width, height):
+        if self.texture is not None:
+            SDL_DestroyTexture(self.texture)
+        self.texture_fmt = None
+        self.texture_size = None
+        self.texture = SDL_CreateTexture(self.renderer, fmt, SDL_TEXTUREACCESS_STREAMING, width, height)
+        if self.texture is None:
+            logging.error(f'SDL_CreateTexture failed: {SDL_GetError()}')
+            return False
+        self.texture_fmt = fmt
+        self.texture_size = (width, height)
+        return True
+
+    def create_surface(self, width, height, pitch):
+        if self.surface is not None:
+            SDL_FreeSurface(self.surface)
+        self.surface = SDL_CreateRGBSurfaceFrom(None, width, height, 8, pitch, 0, 0, 0, 0)
+        if not bool(self.surface):
+            logging.error(f'SDL_CreateRGBSurfaceFrom failed: {SDL_GetError()}')
+            self.surface = None
+            return False
+        if self.colormap is not None:
+            self.set_colormap(self.colormap)
+        return True
+
+    def render_frame(self, frame):
+        if frame.fmt == SDL_PIXELFORMAT_INDEX8:
+            self.render_grey_image(frame)
+        else:
+            self.render_image(frame)
+
+    def render_image(self, frame):
+        if (frame.fmt != self.texture_fmt or (frame.width, frame.height) != self.texture_size) and \
+            not self.create_texture(frame.fmt, frame.width, frame.height):
+            frame.unref()
+            return
+        if frame.planes is not None:
+            (y, ypitch), (u, upitch), (v, vpitch) = frame.planes
+            if SDL_UpdateYUVTexture(self.texture, None, y, ypitch, u, upitch, v, vpitch) != 0:
+                logging.warning(f'SDL_UpdateYUVTexture failed: {SDL_GetError()}')
+        elif SDL_UpdateTexture(self.texture, None, frame.data, frame.pitch) != 0:
+            logging.warning(f'SDL_UpdateTexture failed: {SDL_GetError()}')
+        # the texture has its own copy, the buffer can go back
+        frame.unref()
+        if SDL_RenderClear(self.renderer) != 0:
+            logging.warning(f'SDL_RenderClear failed: {SDL_GetError()}')
+        if SDL_RenderCopyEx(self.renderer, self.texture, None, self.dstrect, self.angle, None, self.flip) != 0:
+            logging.warning(f'SDL_RenderCopy failed: {SDL_GetError()}')
+        SDL_RenderPresent(self.renderer)
+
+    def render_grey_image(self, frame):
+        if (self.surface is None or (self.surface[0].w, self.surface[0].h, self.surface[0].pitch) != (frame.width, frame.height, frame.pitch)) and \
+            not self.create_surface(frame.width, frame.height, frame.pitch):
+            frame.unref()
+            return
+        self.surface[0].pixels = frame.data
+        texture = SDL_CreateTextureFromSurface(self.renderer, self.surface)
+        frame.unref()
+        if texture is None:
+            logging.warning(f'SDL_CreateTextureFromSurface failed: {SDL_GetError()}')
+            return
+        if SDL_RenderClear(self.renderer) != 0:
+            logging.warning(f'SDL_RenderClear failed: {SDL_GetError()}')
+        if SDL_RenderCopyEx(self.renderer, texture, None, self.dstrect, self.angle, None, self.flip) != 0:
+            logging.warning(f'SDL_RenderCopy failed: {SDL_GetError()}')
+        SDL_RenderPresent(self.renderer)
+        SDL_DestroyTexture(texture)
 
     def event_loop(self):
         event = SDL_Event()
@@ -814,30 +1360,16 @@ class SDLCameraWindow():
                     self.mirror(1 if not shift else -1)
                 elif event.key.keysym.sym == SDLK_c:
                     self.step_colormap(1 if not shift else -1)
+            elif event.type == SDL_WINDOWEVENT and event.window.event == SDL_WINDOWEVENT_SIZE_CHANGED:
+                self.update_decode_scale()
             elif event.type == SDL_MOUSEBUTTONUP and \
                 event.button.button == SDL_BUTTON_LEFT and \
                 event.button.clicks == 2:
                     self.toggle_fullscreen()
-            elif event.type == self.sdl_new_image_event:
-                if SDL_UpdateTexture(self.texture, None, event.user.data1, self.bytesperline) != 0:
-                    logging.warning(f'SDL_UpdateTexture failed: {SDL_GetError()}')
-                if SDL_RenderClear(self.renderer) != 0:
-                    logging.warning(f'SDL_RenderClear failed: {SDL_GetError()}')
-                if SDL_RenderCopyEx(self.renderer, self.texture, None, self.dstrect, self.angle, None, self.flip) != 0:
-                    logging.warning(f'SDL_RenderCopy failed: {SDL_GetError()}')
-                SDL_RenderPresent(self.renderer)
-            elif event.type == self.sdl_new_grey_image_event:
-                self.surface[0].pixels = event.user.data1
-                texture = SDL_CreateTextureFromSurface(self.renderer, self.surface)
-                if texture is None:
-                    logging.warning(f'SDL_CreateTextureFromSurface failed: {SDL_GetError()}')
-                    return
-                if SDL_RenderClear(self.renderer) != 0:
-                    logging.warning(f'SDL_RenderClear failed: {SDL_GetError()}')
-                if SDL_RenderCopyEx(self.renderer, texture, None, self.dstrect, self.angle, None, self.flip) != 0:
-                    logging.warning(f'SDL_RenderCopy failed: {SDL_GetError()}')
-                SDL_RenderPresent(self.renderer)
-                SDL_DestroyTexture(texture)
+            elif event.type == self.sdl_new_frame_event:
+                frame = self.mailbox.take()
+                if frame is not None:
+                    self.render_frame(frame)
             elif event.type == self.sdl_camera_error_event:
                 self.stop_capturing()
                 self.returncode = 4
@@ -915,6 +1447,7 @@ class SDLCameraWindow():
         self.fullscreen = not self.fullscreen
         SDL_SetWindowFullscreen(self.window, SDL_WINDOW_FULLSCREEN_DESKTOP if self.fullscreen else 0)
         self.match_window_to_logical()
+        self.update_decode_scale()
 
     def rotate(self, angle):
         self.angle += angle
@@ -933,7 +1466,32 @@ class SDLCameraWindow():
             if SDL_RenderSetLogicalSize(self.renderer, self.cam.height, self.cam.width) != 0:
                 logging.warning(f'SDL_RenderSetlogicalSize failed: {SDL_GetError()}')
         self.match_window_to_logical()
-    
+        self.update_decode_scale()
+
+    # decode only as many pixels as the window can show
+    def update_decode_scale(self):
+        if self.decoder is None or not self.scaling_factors:
+            return
+
+        out_w = ctypes.c_int()
+        out_h = ctypes.c_int()
+        if SDL_GetRendererOutputSize(self.renderer, out_w, out_h) != 0:
+            logging.warning(f'SDL_GetRendererOutputSize failed: {SDL_GetError()}')
+            return
+
+        cam_w = self.cam.width
+        cam_h = self.cam.height
+        if self.angle % 180 != 0:
+            cam_w, cam_h = cam_h, cam_w
+        shown = min(out_w.value / cam_w, out_h.value / cam_h)
+
+        num, denom = self.scaling_factors[-1]
+        for f in self.scaling_factors:
+            if f[0] / f[1] >= shown:
+                num, denom = f
+                break
+        self.decoder.set_scale(num, denom)
+
     def match_window_to_logical(self):
         if self.fullscreen:
             return
@@ -980,14 +1538,16 @@ class SDLCameraWindow():
         self.cam.stop()
 
     def close(self):
-        tj_destroy(self.tj)
+        self.writer.stop()
+        self.stop_decoding()
+        logging.info(f'frames shown: {self.mailbox.shown}, dropped for display: {self.mailbox.dropped}')
         SDL_DestroyWindow(self.window)
         SDL_Quit()
         return self.returncode
 
 
 def usage():
-    print(f'usage: {sys.argv[0]} [--help] [-d DEVICE] [-s SIZE] [-r ANGLE] [-m FLIP] [-c COLORMAP]\n')
+    print(f'usage: {sys.argv[0]} [--help] [-d DEVICE] [-s SIZE] [-r ANGLE] [-m FLIP] [-c COLORMAP] [--decode-threads N] [--decode-drop POLICY] [--bench N] [--json]\n')
     print(f'optional arguments:')
     print(f'  -h, --help         show this help message and exit')
     print(f'  -d DEVICE          use DEVICE, default /dev/video0')
@@ -996,6 +1556,11 @@ def usage():
     print(f'  -m FLIP            mirror the image by FLIP, default no, (no, h, v, hv)')
     print(f'  -c COLORMAP        set colormap, default none')
     print(f'                    (none, grayscale, inferno, viridis, ironblack, rainbow)')
+    print(f'  --decode-threads N MJPEG decoder threads, default 2')
+    print(f'  --decode-drop POLICY')
+    print(f'                     frame to drop when the decoders are busy, default oldest (oldest, newest)')
+    print(f'  --bench N          capture N frames without a window and print statistics')
+    print(f'  --json             print the --bench statistics as JSON')
     print()
     print(f'example:')
     print(f'  {sys.argv[0]} -d /dev/video2')
@@ -1006,10 +1571,21 @@ def usage():
     print(f'  m: FLIP next (shift+m prev)')
     print(f'  c: COLORMAP next (shift+c prev)')
 
+# the counts exit with the usage, a wrong value would change the mode or the load silently
+def to_positive_int(value):
+    try:
+        n = int(value)
+    except ValueError:
+        n = 0
+    if n <= 0:
+        logging.warning(f'invalid N value: {value}')
+        usage()
+        sys.exit(2)
+    return n
 
 def main():
     try:
-        arguments, values = getopt.getopt(sys.argv[1:], 'hd:s:r:m:c:', ['help'])
+        arguments, values = getopt.getopt(sys.argv[1:], 'hd:s:r:m:c:', ['help', 'decode-threads=', 'decode-drop=', 'bench=', 'json'])
     except getopt.error as err:
         print(err)
         usage()
@@ -1021,6 +1597,10 @@ def main():
     angle = 0
     flip = 0
     colormap = 'none'
+    decode_threads = 2
+    decode_drop = 'oldest'
+    bench = 0
+    as_json = False
 
     for current_argument, current_value in arguments:
         if current_argument in ('-h', '--help'):
@@ -1050,12 +1630,32 @@ def main():
                 logging.warning(f'invalid FLIP value: {current_value}')
         elif current_argument == '-c':
             colormap = current_value
+        elif current_argument == '--decode-threads':
+            decode_threads = to_positive_int(current_value)
+        elif current_argument == '--decode-drop':
+            if current_value in DECODE_DROP_POLICIES:
+                decode_drop = current_value
+            else:
+                logging.warning(f'invalid POLICY value: {current_value}')
+        elif current_argument == '--bench':
+            bench = to_positive_int(current_value)
+        elif current_argument == '--json':
+            as_json = True
+
+    if bench > 0:
+        sink = BenchSink(device, bench, colormap, decode_threads, decode_drop)
+        report = sink.run()
+        if as_json:
+            print(json.dumps(report))
+        else:
+            print_bench_report(report)
+        return 4 if sink.failed else 0
 
 
     os.environ['SDL_VIDEO_X11_WMCLASS'] = 'hu.irl.cameractrls'
     os.environ['SDL_VIDEO_WAYLAND_WMCLASS'] = 'hu.irl.cameractrls'
 
-    win = SDLCameraWindow(device, width, height, angle, flip, colormap)
+    win = SDLCameraWindow(device, width, height, angle, flip, colormap, decode_threads, decode_drop)
     win.start_capturing()
     return win.close()
 
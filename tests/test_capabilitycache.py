@@ -0,0 +1,47 @@
+import os, tempfile, unittest
+from unittest import mock
+
+from cameractrls import CapabilityCache
+
+KEY = {'usb_ids': '046d:085e', 'bcd_device': '0317', 'interface': '00', 'driver': 'uvcvideo',
+    'driver_version': 0x60800, 'device_caps': 0x84200001}
+
+
+class CapabilityCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        patcher = mock.patch.dict(os.environ, {'XDG_CONFIG_HOME': self.tmpdir.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def test_saved_and_loaded(self):
+        cache = CapabilityCache(KEY)
+        self.assertEqual(cache.memo('fmts', None, lambda: [['MJPG', 'Motion-JPEG']]), [['MJPG', 'Motion-JPEG']])
+        cache.save()
+
+        cache = CapabilityCache(KEY)
+        self.assertEqual(cache.memo('fmts', None, lambda: self.fail('queried again')), [['MJPG', 'Motion-JPEG']])
+
+    def test_failed_probes_not_stored(self):
+        cache = CapabilityCache(KEY)
+        self.assertEqual(cache.memo('fmts', None, lambda: []), [])
+        self.assertFalse(cache.memo('logitech_xu', '9_1', lambda: False))
+        self.assertIsNone(cache.memo('logitech_ranges', '9_1_0', lambda: None))
+        self.assertFalse(cache.dirty)
+
+        self.assertTrue(cache.memo('logitech_xu', '9_1', lambda: True))
+        self.assertTrue(cache.dirty)
+
+    def test_other_key_is_outdated(self):
+        cache = CapabilityCache(KEY)
+        cache.put('fmts', [['YUYV', 'YUYV 4:2:2']])
+        cache.save()
+
+        with self.assertLogs(level='INFO'):
+            cache = CapabilityCache({**KEY, 'bcd_device': '0318'})
+        self.assertIsNone(cache.get('fmts'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import io, json, unittest
+from contextlib import redirect_stdout
+
+from cameractrls import BaseCtrl, ControlWatcher
+
+
+class FinishedListener:
+    def is_alive(self):
+        return False
+
+
+class ControlWatcherTest(unittest.TestCase):
+    def changes(self, watcher, *updates):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            for device, ctrl, value in updates:
+                ctrl.value = value
+                watcher.changed(device, [ctrl])
+            watcher.flush()
+        return [json.loads(l) for l in out.getvalue().splitlines()]
+
+    def test_every_change_without_window(self):
+        watcher = ControlWatcher()
+        ctrl = BaseCtrl('brightness', 'Brightness', 'integer', 0)
+        watcher.values[('/dev/video0', 'brightness')] = 0
+
+        changes = self.changes(watcher, ('/dev/video0', ctrl, 1), ('/dev/video0', ctrl, 2))
+
+        self.assertEqual([(c['old'], c['new']) for c in changes], [(0, 1), (1, 2)])
+        self.assertNotIn('count', changes[0])
+
+    def test_changes_merged_within_window(self):
+        watcher = ControlWatcher(60)
+        ctrl = BaseCtrl('brightness', 'Brightness', 'integer', 0)
+        other = BaseCtrl('brightness', 'Brightness', 'integer', 0)
+        watcher.values[('/dev/video0', 'brightness')] = 0
+
+        changes = self.changes(watcher, ('/dev/video0', ctrl, 1), ('/dev/video2', other, 5), ('/dev/video0', ctrl, 3))
+
+        self.assertEqual([(c['device'], c['old'], c['new'], c['count']) for c in changes],
+            [('/dev/video0', 0, 3, 2), ('/dev/video2', None, 5, 1)])
+
+    def test_run_ends_when_the_devices_are_gone(self):
+        watcher = ControlWatcher(0.01)
+
+        with self.assertLogs(level='ERROR') as logs:
+            gone = watcher.run([('/dev/video0', FinishedListener())])
+
+        self.assertEqual(gone, 1)
+        self.assertIn('/dev/video0 is gone', logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from cameractrls import BaseCtrl, ControlWriter
+
+
+class FakeCamera:
+    def __init__(self, ctrls):
+        self.ctrls = {c.text_id: c for c in ctrls}
+        self.written = []
+
+    def get_ctrl_by_text_id(self, text_id):
+        return self.ctrls.get(text_id)
+
+    def setup_ctrls(self, params, errs):
+        self.written.append(dict(params))
+
+
+def relative_ctrl(text_id):
+    ctrl = BaseCtrl(text_id, text_id, 'integer', 0, 0, -10, 10, 1)
+    ctrl.writeonly = True
+    return ctrl
+
+
+class ControlWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.camera = FakeCamera([
+            BaseCtrl('brightness', 'Brightness', 'integer', 0, 0, 0, 255, 1),
+            BaseCtrl('pan_speed', 'Pan Speed', 'integer', 0, 0, -1, 1, 1, zeroer=True),
+            relative_ctrl('pan_relative'),
+        ])
+        # not started, the writes stay pending
+        self.writer = ControlWriter(self.camera, max_rate=0)
+
+    def test_absolute_values_coalesced(self):
+        for v in [1, 2, 3]:
+            self.writer.write('brightness', v)
+
+        self.assertEqual(self.writer.pending, [{'brightness': 3}])
+        self.assertEqual(self.writer.coalesced, 2)
+        self.assertEqual(self.writer.value(self.camera.ctrls['brightness']), 3)
+
+    def test_relative_steps_summed_within_range(self):
+        for v in [4, 4, 4]:
+            self.writer.write('pan_relative', v)
+
+        self.assertEqual(self.writer.pending, [{'pan_relative': 10}])
+
+    def test_speed_batches_capped(self):
+        for v in [1, 0, 1, 0, 1, 0]:
+            self.writer.write('pan_speed', v)
+
+        self.assertEqual(len(self.writer.pending), ControlWriter.max_batches)
+        self.assertEqual(self.writer.pending[:2], [{'pan_speed': 1}, {'pan_speed': 0}])
+        self.assertEqual(self.writer.pending[-1], {'pan_speed': 0})
+
+    def test_stop_writes_the_pending_batches(self):
+        self.writer.write('pan_speed', 1)
+        self.writer.write('brightness', 10)
+        self.writer.write('pan_speed', 0)
+        self.writer.start()
+        self.writer.stop()
+
+        self.assertEqual(self.camera.written, [{'pan_speed': 1, 'brightness': 10}, {'pan_speed': 0}])
+        self.assertFalse(self.writer.is_pending('pan_speed'))
+
+
+if __name__ == '__main__':
+    unittest.main()
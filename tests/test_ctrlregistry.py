@@ -0,0 +1,155 @@
+import unittest
+
+from threading import RLock
+
+from cameractrls import BaseCtrl, CameraCtrls, CtrlRegistry, LazyProvider, V4L2Ctrls, collect_warning
+
+
+class FakeProvider:
+    def __init__(self, ctrls, dependents=None):
+        self.ctrls = ctrls
+        self.dependents = dependents or {}
+
+    def get_ctrls(self):
+        return self.ctrls
+
+    def get_dependents(self):
+        return self.dependents
+
+
+# fails the values named 'bad', like the providers reporting no per-control result
+class FailingProvider(FakeProvider):
+    def setup_ctrls(self, params, errs):
+        for k, v in params.items():
+            if v == 'bad':
+                collect_warning(f'FailingProvider: can\'t set {k}', errs)
+
+
+def fake_ctrl(text_id, v4l2_id=None):
+    ctrl = BaseCtrl(text_id, text_id, 'integer', 0)
+    if v4l2_id is not None:
+        ctrl.v4l2_id = v4l2_id
+    return ctrl
+
+
+def fake_camera(providers):
+    camera = CameraCtrls.__new__(CameraCtrls)
+    camera.ctrls = providers
+    camera.registry = CtrlRegistry(providers)
+    camera.lock = RLock()
+    return camera
+
+
+class LookupTest(unittest.TestCase):
+    def test_by_text_id_and_v4l2_id(self):
+        brightness, contrast = fake_ctrl('brightness', 0x980900), fake_ctrl('contrast', 0x980901)
+        hdr = fake_ctrl('kiyo_pro_hdr')
+        v4l2, kiyo = FakeProvider([brightness, contrast]), FakeProvider([hdr])
+        registry = CtrlRegistry([v4l2, kiyo])
+
+        self.assertIs(registry.get_by_text_id('contrast'), contrast)
+        self.assertIs(registry.get_by_text_id('kiyo_pro_hdr'), hdr)
+        self.assertIsNone(registry.get_by_text_id('gamma'))
+        self.assertIs(registry.get_by_v4l2_id(0x980900), brightness)
+        self.assertIsNone(registry.get_by_v4l2_id(0x980902))
+        self.assertEqual(registry.get_providers('brightness'), [v4l2])
+        self.assertEqual(registry.get_provider_ctrls(kiyo), [hdr])
+        self.assertEqual(registry.get_ctrls(), [brightness, contrast, hdr])
+
+    def test_first_provider_wins(self):
+        first, second = fake_ctrl('preset'), fake_ctrl('preset')
+        p1, p2 = FakeProvider([first]), FakeProvider([second])
+        registry = CtrlRegistry([p1, p2])
+
+        self.assertIs(registry.get_by_text_id('preset'), first)
+        self.assertEqual(registry.get_providers('preset'), [p1, p2])
+
+    def test_lazy_provider_loaded_on_lookup(self):
+        created = []
+        def factory():
+            created.append(True)
+            return FakeProvider([fake_ctrl('logitech_led1_mode')])
+        lazy = LazyProvider(factory, ['logitech_led1_mode'])
+        registry = CtrlRegistry([FakeProvider([fake_ctrl('brightness')]), lazy])
+
+        self.assertIsNotNone(registry.get_by_text_id('brightness'))
+        self.assertEqual(created, [])
+        self.assertIsNone(registry.get_by_text_id('kiyo_pro_hdr'))
+        self.assertEqual(created, [])
+        self.assertIsNotNone(registry.get_by_text_id('logitech_led1_mode'))
+        self.assertEqual(created, [True])
+
+    def test_resync_after_the_list_is_replaced(self):
+        provider = FakeProvider([fake_ctrl('brightness')])
+        registry = CtrlRegistry([provider])
+        self.assertIsNotNone(registry.get_by_text_id('brightness'))
+
+        provider.ctrls = [fake_ctrl('contrast')]
+        self.assertIsNone(registry.get_by_text_id('brightness'))
+        self.assertIsNotNone(registry.get_by_text_id('contrast'))
+
+        provider.ctrls.append(fake_ctrl('gamma'))
+        self.assertIsNotNone(registry.get_by_text_id('gamma'))
+
+    def test_v4l2ctrls_index(self):
+        ctrls = V4L2Ctrls.__new__(V4L2Ctrls)
+        ctrls.ctrls = [fake_ctrl('brightness', 0x980900), fake_ctrl('contrast', 0x980901)]
+        ctrls.index_ctrls()
+
+        self.assertIs(ctrls.find_by_text_id('contrast'), ctrls.ctrls[1])
+        self.assertIs(ctrls.find_by_v4l2_id(0x980900), ctrls.ctrls[0])
+        self.assertIsNone(ctrls.find_by_text_id('gamma'))
+
+
+class GetAffectedTest(unittest.TestCase):
+    def test_dependents_of_every_provider(self):
+        auto, manual = fake_ctrl('auto'), fake_ctrl('manual')
+        preset, member = fake_ctrl('preset'), fake_ctrl('member')
+        other = fake_ctrl('other')
+        camera = fake_camera([
+            FakeProvider([auto, manual], {auto: [manual]}),
+            FakeProvider([preset, member], {preset: [member]}),
+            FakeProvider([other]),
+        ])
+
+        self.assertEqual(camera.get_affected_ctrls(auto), [auto, manual])
+        self.assertEqual(camera.get_affected_ctrls(preset), [preset, member])
+        self.assertEqual(camera.get_affected_ctrls(other), [other])
+
+    def test_transitive_dependents(self):
+        a, b, c = fake_ctrl('a'), fake_ctrl('b'), fake_ctrl('c')
+        camera = fake_camera([
+            FakeProvider([a, b], {a: [b]}),
+            FakeProvider([c], {b: [c], c: [a]}),
+        ])
+
+        self.assertEqual(camera.get_affected_ctrls(a), [a, b, c])
+
+    def test_lazy_provider_dependents(self):
+        auto, manual = fake_ctrl('auto'), fake_ctrl('manual')
+        lazy = LazyProvider(lambda: FakeProvider([auto, manual], {auto: [manual]}), ['auto', 'manual'])
+        camera = fake_camera([FakeProvider([fake_ctrl('brightness')]), lazy])
+
+        self.assertEqual(camera.get_affected_ctrls(auto), [auto])
+        camera.get_ctrls()
+        self.assertEqual(camera.get_affected_ctrls(auto), [auto, manual])
+
+
+class SetupCtrlsTest(unittest.TestCase):
+    def test_failed_keys(self):
+        reporting = FakeProvider([fake_ctrl('brightness'), fake_ctrl('contrast')])
+        reporting.setup_ctrls = lambda params, errs: [k for k in params if k == 'contrast']
+        failing = FailingProvider([fake_ctrl('hdr'), fake_ctrl('fov')])
+        working = FailingProvider([fake_ctrl('led')])
+        camera = fake_camera([reporting, failing, working])
+
+        errs = []
+        with self.assertLogs(level='WARNING'):
+            failed = camera.setup_ctrls({'brightness': 1, 'contrast': 2, 'hdr': 'on', 'fov': 'bad', 'led': 'on', 'gamma': 3}, errs)
+
+        self.assertEqual(sorted(failed), ['contrast', 'fov', 'gamma', 'hdr'])
+        self.assertEqual(len(errs), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
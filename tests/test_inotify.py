@@ -0,0 +1,34 @@
+import unittest
+from struct import pack
+
+from cameractrls import parse_inotify_events, InotifyEvent, INOTIFY_EVENT_FMT, IN_CREATE, IN_DELETE, IN_IGNORED
+
+
+def inotify_event(wd, mask, name=b'', namesize=0):
+    name = name.ljust(namesize, b'\x00')
+    return pack(INOTIFY_EVENT_FMT, wd, mask, 0, len(name)) + name
+
+
+class ParseInotifyEventsTest(unittest.TestCase):
+    def test_events_with_padded_names(self):
+        data = inotify_event(1, IN_CREATE, b'video0', 16) + inotify_event(2, IN_DELETE, b'usb-Razer_Kiyo_Pro-video-index0', 32)
+
+        self.assertEqual(parse_inotify_events(data), [
+            InotifyEvent(1, IN_CREATE, 0, 16, 'video0'),
+            InotifyEvent(2, IN_DELETE, 0, 32, 'usb-Razer_Kiyo_Pro-video-index0'),
+        ])
+
+    def test_event_without_name(self):
+        data = inotify_event(3, IN_IGNORED) + inotify_event(1, IN_CREATE, b'video2', 16)
+
+        self.assertEqual(parse_inotify_events(data), [
+            InotifyEvent(3, IN_IGNORED, 0, 0, ''),
+            InotifyEvent(1, IN_CREATE, 0, 16, 'video2'),
+        ])
+
+    def test_empty(self):
+        self.assertEqual(parse_inotify_events(b''), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+from struct import pack
+
+from cameractrls import UVCDescriptors, UVCUnit, UVC_EU1_GUID, UVC_VC_EXTENSION_UNIT, \
+    UVC_VC_PROCESSING_UNIT, UVC_VC_INPUT_TERMINAL
+
+GUID = bytes(range(16))
+
+
+def device_desc(vendor, product, bcd_device):
+    return pack('<BBHBBBBHHHBBBB', 18, 0x01, 0x0200, 0xef, 0x02, 0x01, 64, vendor, product, bcd_device, 1, 2, 3, 1)
+
+def interface_desc(number, cls, subclass):
+    return bytes([9, 0x04, number, 0, 1, cls, subclass, 0, 0])
+
+def xu_desc(unit_id, guid, controls):
+    body = bytes([0x24, UVC_VC_EXTENSION_UNIT, unit_id]) + guid + bytes([8, 1, 2, len(controls)]) + controls + bytes([0])
+    return bytes([len(body) + 1]) + body
+
+def pu_desc(unit_id, controls):
+    body = bytes([0x24, UVC_VC_PROCESSING_UNIT, unit_id, 1]) + pack('<H', 0) + bytes([len(controls)]) + controls + bytes([0, 0])
+    return bytes([len(body) + 1]) + body
+
+def ct_desc(terminal_id, controls):
+    body = bytes([0x24, UVC_VC_INPUT_TERMINAL, terminal_id]) + pack('<HBBHHH', 0x0201, 0, 0, 0, 0, 0) + \
+        bytes([len(controls)]) + controls
+    return bytes([len(body) + 1]) + body
+
+
+class ParseTest(unittest.TestCase):
+    def test_device_and_units(self):
+        descs = UVCDescriptors(
+            device_desc(0x046d, 0x085e, 0x0317) +
+            interface_desc(0, 0x0e, 0x01) +
+            ct_desc(1, b'\x0a\x00\x02') +
+            pu_desc(3, b'\x5b\x17') +
+            xu_desc(9, UVC_EU1_GUID, b'\xff\x01') +
+            interface_desc(1, 0x0e, 0x02)
+        )
+
+        self.assertEqual(descs.usb_ids, '046d:085e')
+        self.assertEqual(descs.bcd_device, '0317')
+        self.assertEqual(descs.units, [
+            UVCUnit(0, 1, UVC_VC_INPUT_TERMINAL, None, 0x02000a),
+            UVCUnit(0, 3, UVC_VC_PROCESSING_UNIT, None, 0x175b),
+            UVCUnit(0, 9, UVC_VC_EXTENSION_UNIT, UVC_EU1_GUID, 0x01ff),
+        ])
+        self.assertEqual(descs.find_unit_id(UVC_EU1_GUID), 9)
+        self.assertEqual(descs.find_unit_id(GUID), 0)
+
+    def test_units_outside_video_control_are_skipped(self):
+        descs = UVCDescriptors(
+            device_desc(0x1532, 0x0e05, 0x0100) +
+            interface_desc(0, 0x01, 0x01) +
+            xu_desc(2, GUID, b'\x01') +
+            interface_desc(1, 0x0e, 0x01) +
+            xu_desc(4, GUID, b'\x03')
+        )
+
+        self.assertEqual(descs.units, [UVCUnit(1, 4, UVC_VC_EXTENSION_UNIT, GUID, 3)])
+
+    def test_guid_matched_only_in_the_guid_field(self):
+        # the guid bytes in the controls bitmap of another unit must not match
+        descs = UVCDescriptors(
+            device_desc(0x1532, 0x0e05, 0x0100) +
+            interface_desc(0, 0x0e, 0x01) +
+            xu_desc(2, GUID, UVC_EU1_GUID)
+        )
+
+        self.assertEqual(descs.find_unit_id(UVC_EU1_GUID), 0)
+        self.assertEqual(descs.find_unit_id(GUID), 2)
+
+    def test_truncated_descriptors(self):
+        data = device_desc(0x046d, 0x085e, 0x0317) + interface_desc(0, 0x0e, 0x01) + xu_desc(9, GUID, b'\x01')
+        with self.assertLogs(level='WARNING'):
+            descs = UVCDescriptors(data[:-5])
+
+        self.assertEqual(descs.usb_ids, '046d:085e')
+        self.assertEqual(descs.units, [])
+
+    def test_empty(self):
+        descs = UVCDescriptors()
+
+        self.assertEqual(descs.usb_ids, '')
+        self.assertEqual(descs.units, [])
+
+
+if __name__ == '__main__':
+    unittest.main()